@@ -16,6 +16,11 @@ use \Magento\Framework\Module\Dir\Reader;
 
 class CacheWarmer implements CacheWarmerInterface
 {
+    /**
+     * Seconds to wait for the next line of a run handed to the persistent worker
+     */
+    private const WORKER_READ_TIMEOUT = 86400;
+
     /**
      * @param Config $config
      * @param Filesystem $filesystem
@@ -44,7 +49,7 @@ class CacheWarmer implements CacheWarmerInterface
         $scriptPath = $this->modulereader->getModuleDir('', 'Goat_TheCacheWarmer') . "/src/warmer.py";
 
         // Use the passed CSV file path or fall back to config
-        $csvSourceFilePaths = '';
+        $csvSourceFilePaths = [];
         if ($csvFilePath !== null) {
             // Validate that the provided CSV file exists
             if (!file_exists($csvFilePath)) {
@@ -53,7 +58,7 @@ class CacheWarmer implements CacheWarmerInterface
                     'message' => 'CSV file does not exist: ' . $csvFilePath
                 ];
             }
-            $csvSourceFilePaths = escapeshellarg($csvFilePath);
+            $csvSourceFilePaths = [$csvFilePath];
         } else {
             // Use configured CSV files from admin panel
             $csvFilesConfig = $this->config->getCsvFiles();
@@ -61,26 +66,20 @@ class CacheWarmer implements CacheWarmerInterface
             if (!empty($csvFilesConfig)) {
                 // Split by comma to get individual file paths and create absolute paths
                 $csvFiles = explode(',', $csvFilesConfig);
-                $absolutePaths = [];
 
                 foreach ($csvFiles as $file) {
                     $file = trim($file);
                     if (!empty($file)) {
                         // Check if it's an absolute path or relative to media directory
                         if (strpos($file, '/') === 0) {
-                            $absolutePaths[] = $file;
+                            $csvSourceFilePaths[] = $file;
                         } else {
                             // If relative path, make it absolute using media directory
                             $mediaPath = $this->filesystem->getDirectoryRead(\Magento\Framework\App\Filesystem\DirectoryList::MEDIA)->getAbsolutePath();
-                            $absolutePaths[] = rtrim($mediaPath, '/') . '/' . ltrim($file, '/');
+                            $csvSourceFilePaths[] = rtrim($mediaPath, '/') . '/' . ltrim($file, '/');
                         }
                     }
                 }
-
-                if (!empty($absolutePaths)) {
-                    // Join file paths with spaces for command line
-                    $csvSourceFilePaths = implode(' ', array_map('escapeshellarg', $absolutePaths));
-                }
             }
         }
 
@@ -95,49 +94,90 @@ class CacheWarmer implements CacheWarmerInterface
             ];
         }
 
-        // Build the command with all available options
-        $command = sprintf(
-            '%s %s --json-config %s --files %s',
-            escapeshellcmd($pythonPath),
-            escapeshellcmd($scriptPath),
-            escapeshellarg($configOption),
-            $csvSourceFilePaths
+        // Build the arguments with all available options. Column 1 holds the hit count
+        // of nginx generated CSV files, so the most visited pages are warmed first.
+        $arguments = array_merge(
+            ['--json-config', $configOption, '--files'],
+            $csvSourceFilePaths,
+            ['--weight-column', '1']
         );
 
         // Add timeout if specified (if it's a valid integer > 0)
         if ($timeout > 0) {
-            $command = sprintf('%s --timeout %d', $command, $timeout);
+            array_push($arguments, '--timeout', (string) $timeout);
         }
 
         // Add rate limit if specified (if it's a valid integer >= 0)
         $rateLimit = $this->config->getRateLimit();
         if ($rateLimit >= 0) {
-            $command = sprintf('%s --rate-limit %d', $command, $rateLimit);
+            array_push($arguments, '--rate-limit', (string) $rateLimit);
         }
 
         // Check if threading should be used
         if ($this->config->useThreads()) {
             // Add threads count if specified (if it's a valid integer > 0)
             if ($threads > 0) {
-                $command = sprintf('%s --threads %d', $command, $threads);
+                array_push($arguments, '--threads', (string) $threads);
             }
         } else {
             // Disable threading by adding --without-async flag
-            $command = sprintf('%s --without-async 1', $command);
+            array_push($arguments, '--without-async', '1');
+        }
+
+        // Prometheus metrics of the run for the node-exporter textfile collector
+        $metricsTextfile = $this->config->getMetricsTextfile();
+        if ($metricsTextfile !== '') {
+            array_push($arguments, '--metrics-textfile', $metricsTextfile);
+        }
+
+        // Pause while the storefront is busy, cron does not know about live traffic
+        $healthChecks = $this->config->getHealthChecks();
+        if ($healthChecks) {
+            $arguments = array_merge($arguments, ['--health-check'], $healthChecks);
         }
 
+        // Machine-readable report with latency percentiles and the slowest URLs
+        $reportPath = $this->filesystem
+            ->getDirectoryWrite(\Magento\Framework\App\Filesystem\DirectoryList::VAR_DIR)
+            ->getAbsolutePath('cache_warmer_report.json');
+        array_push($arguments, '--report', 'json', '--report-file', $reportPath);
+
+        $command = sprintf(
+            '%s %s %s',
+            escapeshellcmd($pythonPath),
+            escapeshellcmd($scriptPath),
+            implode(' ', array_map('escapeshellarg', $arguments))
+        );
+
         try {
             $output = [];
             $returnCode = 0;
 
-            // Execute the command and capture output
-            exec($command, $output, $returnCode);
+            // Never log the report of an earlier run if this one fails early
+            if (file_exists($reportPath)) {
+                unlink($reportPath);
+            }
+
+            // Hand the run to a persistent worker when one is listening, otherwise
+            // execute the command and capture output
+            $workerSocket = $this->config->getWorkerSocket();
+            if ($workerSocket === '' || !$this->runOnWorker($workerSocket, $arguments, $output, $returnCode)) {
+                exec($command, $output, $returnCode);
+            } else {
+                $command = 'job on ' . $workerSocket . ': ' . implode(' ', $arguments);
+            }
+
+            $report = null;
+            if (is_readable($reportPath)) {
+                $report = json_decode((string) file_get_contents($reportPath), true);
+            }
 
             $this->logger->info(
                 'Cache warming executed with command: ' . $command,
                 [
                     'output' => implode("\n", $output),
-                    'return_code' => $returnCode
+                    'return_code' => $returnCode,
+                    'report' => $report
                 ]
             );
 
@@ -145,7 +185,8 @@ class CacheWarmer implements CacheWarmerInterface
                 'status' => $returnCode === 0 ? 'success' : 'error',
                 'message' => 'Cache warming completed',
                 'output' => implode("\n", $output),
-                'return_code' => $returnCode
+                'return_code' => $returnCode,
+                'report' => $report
             ];
         } catch (\Exception $e) {
             $this->logger->error('Cache warming failed: ' . $e->getMessage());
@@ -156,4 +197,48 @@ class CacheWarmer implements CacheWarmerInterface
             ];
         }
     }
+
+    /**
+     * Run a job on the warmer.py --serve worker listening on a Unix socket
+     *
+     * Returns false without running anything when the worker cannot be reached.
+     *
+     * @param string $socketPath
+     * @param array $arguments
+     * @param array $output
+     * @param int $returnCode
+     * @return bool
+     */
+    private function runOnWorker(string $socketPath, array $arguments, array &$output, int &$returnCode): bool
+    {
+        $socket = @stream_socket_client('unix://' . $socketPath, $errorCode, $errorMessage, 5);
+        if ($socket === false) {
+            $this->logger->warning(
+                'Cache warmer worker not reachable, starting a new process instead: ' . $errorMessage,
+                ['socket' => $socketPath]
+            );
+
+            return false;
+        }
+
+        // A run prints nothing for long stretches, never give up on it while it is running
+        stream_set_timeout($socket, self::WORKER_READ_TIMEOUT);
+        fwrite($socket, json_encode(['argv' => $arguments]) . "\n");
+
+        // The connection closing without an exit code means the worker stopped mid-run
+        $returnCode = 1;
+        while (($line = fgets($socket)) !== false) {
+            $message = json_decode($line, true);
+            if (isset($message['exit'])) {
+                $returnCode = (int) $message['exit'];
+                break;
+            }
+            if (isset($message['output'])) {
+                $output[] = $message['output'];
+            }
+        }
+        fclose($socket);
+
+        return true;
+    }
 }
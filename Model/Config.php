@@ -28,6 +28,10 @@ class Config
     public const CSV_SOURCE_FOLDER_NAME = 'cacheWarmerCsvFiles';
     public const CONFIG_PATH_LOCK_TIMEOUT = 'goat_cache_warmer/general/lock_timeout';
     public const CONFIG_PATH_RATE_LIMIT = 'goat_cache_warmer/general/rate_limit';
+    public const CONFIG_PATH_METRICS_TEXTFILE = 'goat_cache_warmer/general/metrics_textfile';
+    public const CONFIG_PATH_HEALTH_CHECKS = 'goat_cache_warmer/general/health_checks';
+    public const CONFIG_PATH_CHANGE_FEED_FILE = 'goat_cache_warmer/general/change_feed_file';
+    public const CONFIG_PATH_WORKER_SOCKET = 'goat_cache_warmer/general/worker_socket';
     public const CONFIG_PATH_LOG_PATTERN = 'goat_cache_warmer/nginx_log_parsing/log_pattern';
     public const CONFIG_PATH_LOG_INCLUDE_BASE_DOMAIN = 'goat_cache_warmer/nginx_log_parsing/log_include_base_domain';
     public const CONFIG_PATH_IGNORED_USER_AGENTS = 'goat_cache_warmer/nginx_log_parsing/ignored_user_agents';
@@ -145,6 +149,48 @@ class Config
         return (int)$this->scopeConfig->getValue(self::CONFIG_PATH_RATE_LIMIT);
     }
 
+    /**
+     * Get the Prometheus textfile path the warmer writes its metrics to, empty when disabled
+     *
+     * @return string
+     */
+    public function getMetricsTextfile(): string
+    {
+        return trim((string) $this->scopeConfig->getValue(self::CONFIG_PATH_METRICS_TEXTFILE));
+    }
+
+    /**
+     * Get the origin health checks that pause warming while the storefront is busy, one per line
+     *
+     * @return array
+     */
+    public function getHealthChecks(): array
+    {
+        $value = (string) $this->scopeConfig->getValue(self::CONFIG_PATH_HEALTH_CHECKS);
+
+        return array_values(array_filter(array_map('trim', preg_split('/\R/', $value))));
+    }
+
+    /**
+     * Get the change feed file cache tags of saved entities are appended to, empty when disabled
+     *
+     * @return string
+     */
+    public function getChangeFeedFile(): string
+    {
+        return trim((string) $this->scopeConfig->getValue(self::CONFIG_PATH_CHANGE_FEED_FILE));
+    }
+
+    /**
+     * Get the Unix socket of a warmer.py --serve worker runs are handed to, empty to start a process per run
+     *
+     * @return string
+     */
+    public function getWorkerSocket(): string
+    {
+        return trim((string) $this->scopeConfig->getValue(self::CONFIG_PATH_WORKER_SOCKET));
+    }
+
     /**
      * Get delay in seconds for cache warming process
      *
@@ -0,0 +1,58 @@
+<?php
+
+declare(strict_types=1);
+
+/**
+ * Copyright (c) 2026 TheGoat team. All rights reserved.
+ * See https://example.com/license for license information.
+ */
+
+namespace Goat\TheCacheWarmer\Observer;
+
+use Magento\Framework\DataObject\IdentityInterface;
+use Magento\Framework\Event\Observer;
+use Magento\Framework\Event\ObserverInterface;
+use Psr\Log\LoggerInterface;
+use Goat\TheCacheWarmer\Model\Config;
+
+class WriteChangeFeed implements ObserverInterface
+{
+    /**
+     * @param Config $config
+     * @param LoggerInterface $logger
+     */
+    public function __construct(
+        private Config $config,
+        private LoggerInterface $logger,
+    ) {}
+
+    /**
+     * Append the cache tags of a saved entity to the change feed read by warmer.py --follow
+     *
+     * @param Observer $observer
+     * @return void
+     */
+    public function execute(Observer $observer): void
+    {
+        $feedFile = $this->config->getChangeFeedFile();
+        if ($feedFile === '' || !$this->config->isEnabled()) {
+            return;
+        }
+
+        $object = $observer->getEvent()->getObject();
+        if (!$object instanceof IdentityInterface) {
+            return;
+        }
+
+        $tags = array_values(array_unique(array_filter($object->getIdentities())));
+        if (!$tags) {
+            return;
+        }
+
+        // One line per save, appended atomically so concurrent saves never interleave
+        $line = json_encode(['tags' => $tags]) . "\n";
+        if (@file_put_contents($feedFile, $line, FILE_APPEND | LOCK_EX) === false) {
+            $this->logger->error('Could not write cache tags to the change feed ' . $feedFile);
+        }
+    }
+}
@@ -176,12 +176,12 @@ class UrlParser implements UrlParserInterface
                     throw new \Exception("Could not create full URL CSV file: " . $fullUrlCsvFilePath);
                 }
 
-                // Write header (only URL column)
-                fputcsv($fullUrlCsvHandle, ['URL']);
+                // Write header (URL and hit count, used by the warmer to warm the hottest pages first)
+                fputcsv($fullUrlCsvHandle, ['URL', 'Count']);
 
                 // Write all URLs directly as they include the complete domain
                 foreach ($topUrls as $url => $count) {
-                    fputcsv($fullUrlCsvHandle, [$url]);
+                    fputcsv($fullUrlCsvHandle, [$url, $count]);
                 }
 
                 fclose($fullUrlCsvHandle);
@@ -258,13 +258,13 @@ class UrlParser implements UrlParserInterface
                     throw new \Exception("Could not create full URL CSV file: " . $fullUrlCsvFilePath);
                 }
 
-                // Write header (only URL column)
-                fputcsv($fullUrlCsvHandle, ['URL']);
+                // Write header (URL and hit count, used by the warmer to warm the hottest pages first)
+                fputcsv($fullUrlCsvHandle, ['URL', 'Count']);
 
                 // Write matched URLs with full domain names
                 foreach ($topUrls as $url => $count) {
                     if (isset($urlPathToFullUrl[$url])) {
-                        fputcsv($fullUrlCsvHandle, [$urlPathToFullUrl[$url]]);
+                        fputcsv($fullUrlCsvHandle, [$urlPathToFullUrl[$url], $count]);
                     }
                 }
 
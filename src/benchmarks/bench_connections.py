@@ -0,0 +1,56 @@
+"""Compare TCP connections opened per URL with and without pooled sessions.
+
+Usage:
+    python src/benchmarks/bench_connections.py [--urls 2000] [--threads 5]
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from warmer import process_urls_threaded, warm_url  # noqa: E402
+from stand_in_server import StandInServer  # noqa: E402
+
+
+def run_unpooled(urls, threads):
+    """Warm URLs the way the warmer did before pooling: one bare request each"""
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(warm_url, urls))
+
+
+def run_pooled(urls, threads):
+    return process_urls_threaded(urls, max_workers=threads, custom_cookies={})
+
+
+def measure(server, label, runner, urls, threads):
+    server.reset_counters()
+    start_time = time.time()
+    results = runner(urls, threads)
+    elapsed = time.time() - start_time
+    failed = sum(1 for result in results if not result["success"])
+    print(
+        f"{label:<10} urls={len(urls)} threads={threads} "
+        f"connections={server.connections_opened} "
+        f"connections/url={server.connections_opened / len(urls):.3f} "
+        f"failed={failed} time={elapsed:.2f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Connection pooling benchmark")
+    parser.add_argument("--urls", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=5)
+    args = parser.parse_args()
+
+    with StandInServer() as server:
+        urls = [f"{server.base_url}/page-{i}" for i in range(args.urls)]
+        measure(server, "before", run_unpooled, urls, args.threads)
+        measure(server, "after", run_pooled, urls, args.threads)
+
+
+if __name__ == "__main__":
+    main()
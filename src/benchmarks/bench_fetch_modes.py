@@ -0,0 +1,69 @@
+"""Compare client cost of the fetch modes on large pages.
+
+Every mode warms the same URLs against a stand-in server returning pages of
+--body-size bytes. Each mode runs in its own process, so its CPU time and
+peak RSS are measured on their own.
+
+Usage:
+    python src/benchmarks/bench_fetch_modes.py [--urls 2000] [--threads 5] [--body-size 400000]
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from warmer import FETCH_MODES, process_urls_threaded  # noqa: E402
+from stand_in_server import StandInServer  # noqa: E402
+
+
+def measure(urls, threads, fetch_mode, results):
+    start_time = time.perf_counter()
+    start_cpu = time.process_time()
+    warmed = process_urls_threaded(
+        urls, max_workers=threads, custom_cookies={}, fetch_mode=fetch_mode
+    )
+    failed = sum(1 for result in warmed if not result["success"])
+    results.put(
+        (
+            time.perf_counter() - start_time,
+            time.process_time() - start_cpu,
+            # ru_maxrss is reported in kilobytes on Linux
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            failed,
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch mode benchmark")
+    parser.add_argument("--urls", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=5)
+    parser.add_argument("--body-size", type=int, default=400000)
+    args = parser.parse_args()
+
+    with StandInServer(body_size=args.body_size) as server:
+        urls = [f"{server.base_url}/page-{i}" for i in range(args.urls)]
+        print(f"urls={args.urls} threads={args.threads} body={args.body_size} bytes")
+        for fetch_mode in FETCH_MODES:
+            server.reset_counters()
+            results = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                target=measure, args=(urls, args.threads, fetch_mode, results)
+            )
+            process.start()
+            elapsed, cpu, peak, failed = results.get()
+            process.join()
+            print(
+                f"{fetch_mode:<8} time={elapsed:.2f}s client_cpu={cpu:.2f}s "
+                f"peak_rss={peak / 1024:.1f}MiB "
+                f"connections={server.connections_opened} failed={failed}"
+            )
+
+
+if __name__ == "__main__":
+    main()
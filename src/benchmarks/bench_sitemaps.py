@@ -0,0 +1,117 @@
+"""Compare reading a large sitemap index one child at a time vs in parallel.
+
+Generates a sitemap index with gzip compressed children in a temporary
+directory, serves it locally with an artificial per-request latency and
+reports the time and peak memory of each run. Each run happens in its own
+process so the peak RSS of one run does not hide the other.
+
+Usage:
+    python src/benchmarks/bench_sitemaps.py [--urls 1000000] [--per-sitemap 50000] [--threads 5] [--latency 0.2]
+"""
+
+import argparse
+import functools
+import gzip
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from warmer import iter_sitemap_urls  # noqa: E402
+
+NS = 'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"'
+
+
+class SlowHandler(SimpleHTTPRequestHandler):
+    latency = 0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def write_sitemaps(directory, url_count, per_sitemap):
+    children = []
+    for number, first in enumerate(range(0, url_count, per_sitemap)):
+        name = f"sitemap-{number}.xml.gz"
+        with gzip.open(os.path.join(directory, name), "wt") as handle:
+            handle.write(f'<?xml version="1.0" encoding="UTF-8"?><urlset {NS}>\n')
+            for i in range(first, min(first + per_sitemap, url_count)):
+                handle.write(
+                    f"<url><loc>https://magento.local/product-{i}.html</loc>"
+                    f"<lastmod>2026-01-01</lastmod></url>\n"
+                )
+            handle.write("</urlset>\n")
+        children.append(name)
+    return children
+
+
+def measure(index_url, threads, results):
+    start_time = time.perf_counter()
+    count = sum(1 for _ in iter_sitemap_urls([index_url], max_workers=threads))
+    elapsed = time.perf_counter() - start_time
+    # ru_maxrss is reported in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((count, elapsed, peak))
+
+
+def measure_in_process(index_url, threads):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=measure, args=(index_url, threads, results)
+    )
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sitemap fetching benchmark")
+    parser.add_argument("--urls", type=int, default=1000000)
+    parser.add_argument("--per-sitemap", type=int, default=50000)
+    parser.add_argument("--threads", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        children = write_sitemaps(directory, args.urls, args.per_sitemap)
+
+        SlowHandler.latency = args.latency
+        handler = functools.partial(SlowHandler, directory=directory)
+        httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{httpd.server_address[1]}"
+
+        with open(os.path.join(directory, "sitemap.xml"), "w") as handle:
+            handle.write(f'<?xml version="1.0" encoding="UTF-8"?><sitemapindex {NS}>')
+            for name in children:
+                handle.write(f"<sitemap><loc>{base_url}/{name}</loc></sitemap>")
+            handle.write("</sitemapindex>")
+
+        try:
+            print(f"urls={args.urls} sitemaps={len(children)} latency={args.latency}s")
+            for label, threads in (("sequential", 1), ("parallel", args.threads)):
+                count, elapsed, peak = measure_in_process(
+                    f"{base_url}/sitemap.xml", threads
+                )
+                print(
+                    f"{label:<10}: {count} urls in {elapsed:.2f}s, "
+                    f"peak RSS {peak / 1024:.1f} MiB"
+                )
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
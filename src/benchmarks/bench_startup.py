@@ -0,0 +1,111 @@
+"""Compare the per-run cost of starting the warmer like cron does.
+
+Every mode runs the same small job (--urls pages, one configuration) against
+a stand-in server, --runs times:
+
+    interpreter - a bare "python -c pass", the floor for a new process
+    script      - "python src/warmer.py", compiled again on every run
+    module      - "python -m warmer" from src/, reusing the cached bytecode
+    worker      - a job sent to a running "warmer.py --serve" worker
+
+Usage:
+    python src/benchmarks/bench_startup.py [--runs 20] [--urls 1]
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, SRC)
+
+from stand_in_server import StandInServer  # noqa: E402
+
+
+def run_process(command):
+    start_time = time.perf_counter()
+    subprocess.run(command, cwd=SRC, stdout=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - start_time
+
+
+def run_job(socket_path, argv):
+    start_time = time.perf_counter()
+    with socket.socket(socket.AF_UNIX) as client:
+        client.connect(socket_path)
+        client.sendall((json.dumps({"argv": argv}) + "\n").encode())
+        for line in client.makefile("r"):
+            message = json.loads(line)
+            if "exit" in message:
+                if message["exit"] != 0:
+                    raise RuntimeError(f"job failed with exit code {message['exit']}")
+                break
+    return time.perf_counter() - start_time
+
+
+def start_worker(socket_path):
+    worker = subprocess.Popen(
+        [sys.executable, "warmer.py", "--serve", socket_path],
+        cwd=SRC,
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 10
+    while not os.path.exists(socket_path):
+        if time.monotonic() > deadline or worker.poll() is not None:
+            raise RuntimeError("the worker did not start")
+        time.sleep(0.01)
+    return worker
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time benchmark")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--urls", type=int, default=1)
+    args = parser.parse_args()
+
+    with StandInServer() as server, tempfile.TemporaryDirectory() as directory:
+        urls_file = os.path.join(directory, "urls.csv")
+        with open(urls_file, "w") as f:
+            f.writelines(f"{server.base_url}/page-{i}\n" for i in range(args.urls))
+        config_file = os.path.join(directory, "config.json")
+        with open(config_file, "w") as f:
+            json.dump(
+                [{"name": "bench", "website_base_url": server.base_url, "headers": {}}],
+                f,
+            )
+        argv = ["--files", urls_file, "--json-config", config_file]
+
+        # Compile warmer.py once, like any earlier run would have
+        subprocess.run(
+            [sys.executable, "-m", "warmer", "--help"],
+            cwd=SRC,
+            stdout=subprocess.DEVNULL,
+        )
+        socket_path = os.path.join(directory, "worker.sock")
+        worker = start_worker(socket_path)
+        try:
+            modes = {
+                "interpreter": lambda: run_process([sys.executable, "-c", "pass"]),
+                "script": lambda: run_process([sys.executable, "warmer.py", *argv]),
+                "module": lambda: run_process([sys.executable, "-m", "warmer", *argv]),
+                "worker": lambda: run_job(socket_path, argv),
+            }
+            print(f"runs={args.runs} urls={args.urls}")
+            for label, run in modes.items():
+                times = [run() for _ in range(args.runs)]
+                print(
+                    f"{label:<11} median={statistics.median(times) * 1000:.1f}ms "
+                    f"min={min(times) * 1000:.1f}ms max={max(times) * 1000:.1f}ms"
+                )
+        finally:
+            worker.terminate()
+            worker.wait()
+
+
+if __name__ == "__main__":
+    main()
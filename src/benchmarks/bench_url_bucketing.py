@@ -0,0 +1,59 @@
+"""Compare matching URLs to configurations by rescanning vs host buckets.
+
+Usage:
+    python src/benchmarks/bench_url_bucketing.py [--urls 500000] [--configs 10]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from warmer import (  # noqa: E402
+    bucket_urls_by_host,
+    match_urls_by_base_url,
+    urls_for_config,
+)
+
+
+def build_inputs(url_count, config_count):
+    hosts = [f"store{i}.magento.local" for i in range(config_count)]
+    urls = [
+        f"https://{hosts[i % config_count]}/category-{i // 100}/product-{i}.html"
+        for i in range(url_count)
+    ]
+    configs = [
+        {"name": host, "website_base_url": f"https://{host}/", "headers": {}}
+        for host in hosts
+    ]
+    return urls, configs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="URL bucketing benchmark")
+    parser.add_argument("--urls", type=int, default=500000)
+    parser.add_argument("--configs", type=int, default=10)
+    args = parser.parse_args()
+
+    urls, configs = build_inputs(args.urls, args.configs)
+
+    start_time = time.perf_counter()
+    rescanned = [match_urls_by_base_url(urls, config) for config in configs]
+    rescan_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    buckets = bucket_urls_by_host(urls)
+    bucketed = [urls_for_config(buckets, config, urls) for config in configs]
+    bucket_time = time.perf_counter() - start_time
+
+    assert rescanned == bucketed
+    print(f"urls={args.urls} configs={args.configs}")
+    print(f"rescan per config: {rescan_time:.2f}s")
+    print(f"bucket once:       {bucket_time:.2f}s")
+    print(f"speedup:           {rescan_time / bucket_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""Benchmark suite measuring warming throughput against the stand-in storefront.
+
+Runs every combination of driver, engine, thread count and URL count as a
+scenario of its own:
+
+    function - process_urls_threaded() on a list of URLs
+    main     - a whole run of main() with a CSV file and a JSON configuration
+
+The stand-in server answers with the given latency distribution, x-cache HIT
+ratio and error rate, always the same way for the same --seed. Each scenario
+runs in its own process, so its peak RSS is measured on its own, and is
+reported with its URLs per second, p99 latency and the TCP connections it
+opened, each the median of --repeat runs. The results are written as JSON;
+with --compare they are checked against the results of an earlier commit.
+
+Usage:
+    python src/benchmarks/run_benchmarks.py [--urls 1000 10000] [--threads 5 20]
+        [--engines threads asyncio] [--drivers function main]
+        [--latency lognormal:0.005:0.5] [--hit-ratio 0.8] [--error-rate 0.01]
+        [--repeat 3] [--output results.json] [--compare baseline.json] [--tolerance 0.1]
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, SRC)
+
+from warmer import StageStats, main as warmer_main, process_urls_threaded  # noqa: E402
+from stand_in_server import StandInServer, parse_latency  # noqa: E402
+
+# Whether a larger value of a measurement is better
+MEASUREMENTS = {
+    "urls_per_second": True,
+    "p99": False,
+    "peak_rss_mib": False,
+    "connections": False,
+}
+
+
+def run_function(urls, engine, threads, directory):
+    stats = StageStats()
+    for result in process_urls_threaded(
+        urls,
+        max_workers=threads,
+        custom_cookies={},
+        engine=engine,
+        concurrency=threads,
+    ):
+        stats.add(result)
+    return stats.processed, stats.latency.percentile(99)
+
+
+def run_main(urls, engine, threads, directory):
+    urls_file = os.path.join(directory, "urls.csv")
+    with open(urls_file, "w") as f:
+        f.writelines(f"{url}\n" for url in urls)
+    base_url = urls[0].rsplit("/", 1)[0]
+    config_file = os.path.join(directory, "config.json")
+    with open(config_file, "w") as f:
+        json.dump([{"name": "bench", "website_base_url": base_url, "headers": {}}], f)
+    report_file = os.path.join(directory, "report.json")
+
+    argv = [
+        "--files",
+        urls_file,
+        "--json-config",
+        config_file,
+        "--engine",
+        engine,
+        "--threads",
+        str(threads),
+        "--concurrency",
+        str(threads),
+        "--retries",
+        "0",
+        "--progress-interval",
+        "0",
+        "--report",
+        "json",
+        "--report-file",
+        report_file,
+    ]
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        warmer_main(argv)
+    with open(report_file) as f:
+        stage = json.load(f)["stages"][0]
+    return stage["processed"], stage["latency"]["p99"]
+
+
+DRIVERS = {"function": run_function, "main": run_main}
+
+
+def measure(driver, urls, engine, threads, results):
+    with tempfile.TemporaryDirectory() as directory:
+        start_time = time.perf_counter()
+        processed, p99 = DRIVERS[driver](urls, engine, threads, directory)
+        duration = time.perf_counter() - start_time
+    # ru_maxrss is reported in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((processed, p99, duration, peak))
+
+
+def run_scenario(server, driver, engine, threads, url_count):
+    urls = [f"{server.base_url}/page-{i}" for i in range(url_count)]
+    server.reset_counters()
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=measure, args=(driver, urls, engine, threads, results)
+    )
+    process.start()
+    processed, p99, duration, peak = results.get()
+    process.join()
+    counters = server.counters()
+    return {
+        "name": f"{driver} {engine} threads={threads} urls={url_count}",
+        "driver": driver,
+        "engine": engine,
+        "threads": threads,
+        "urls": url_count,
+        "processed": processed,
+        "duration": duration,
+        "urls_per_second": processed / duration if duration else None,
+        "p99": p99,
+        "peak_rss_mib": peak / 1024,
+        "connections": counters["connections"],
+        "hit": counters["hit"],
+        "miss": counters["miss"],
+        "errors": counters["errors"],
+    }
+
+
+def run_repeated(server, repeat, *scenario):
+    """Run a scenario repeat times and keep the median of every measurement
+
+    The median of an even number of runs is the lower middle one, a value
+    that was actually measured.
+    """
+    runs = [run_scenario(server, *scenario) for _ in range(repeat)]
+    result = dict(runs[0])
+    for key in ("duration", *MEASUREMENTS):
+        values = [run[key] for run in runs if run[key] is not None]
+        result[key] = statistics.median_low(values) if values else None
+    return result
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=SRC,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Print each measurement against the baseline and return the regressions
+
+    A measurement regressed when it is worse than the baseline by more than
+    the tolerance, a share of the baseline value.
+    """
+    regressions = []
+    previous = {scenario["name"]: scenario for scenario in baseline["scenarios"]}
+    for scenario in results["scenarios"]:
+        before = previous.get(scenario["name"])
+        if before is None:
+            print(f"{scenario['name']}: not in the baseline", file=sys.stderr)
+            continue
+        changes = []
+        for key, higher_is_better in MEASUREMENTS.items():
+            old, new = before.get(key), scenario.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            flag = ""
+            if worse > tolerance:
+                flag = " REGRESSED"
+                regressions.append((scenario["name"], key))
+            changes.append(f"{key} {old:.4g} -> {new:.4g} ({change:+.1%}){flag}")
+        print(f"{scenario['name']}: " + ", ".join(changes), file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warming benchmark suite")
+    parser.add_argument("--urls", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--threads", type=int, nargs="+", default=[5, 20])
+    parser.add_argument(
+        "--engines",
+        nargs="+",
+        choices=("threads", "asyncio"),
+        default=["threads", "asyncio"],
+    )
+    parser.add_argument(
+        "--drivers", nargs="+", choices=tuple(DRIVERS), default=list(DRIVERS)
+    )
+    parser.add_argument(
+        "--latency",
+        default="lognormal:0.005:0.5",
+        help="Server latency distribution: SECONDS, fixed:S, uniform:LOW:HIGH, "
+        "exponential:MEAN or lognormal:MEDIAN:SIGMA (default: lognormal:0.005:0.5)",
+    )
+    parser.add_argument("--hit-ratio", type=float, default=0.8)
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--body-size", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Runs of each scenario, the median of each measurement is reported (default: 3)",
+    )
+    parser.add_argument(
+        "--output", help="Write the results to this file instead of stdout"
+    )
+    parser.add_argument("--compare", help="Results of an earlier run to compare with")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Share a measurement may get worse than in --compare before it counts as a regression (default: 0.1)",
+    )
+    args = parser.parse_args()
+
+    if args.repeat <= 0:
+        print("Error: Repeat must be a positive integer")
+        sys.exit(1)
+
+    try:
+        parse_latency(args.latency)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    server_settings = {
+        "latency": args.latency,
+        "hit_ratio": args.hit_ratio,
+        "error_rate": args.error_rate,
+        "error_status": args.error_status,
+        "body_size": args.body_size,
+        "seed": args.seed,
+    }
+    results = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "server": server_settings,
+        "repeat": args.repeat,
+        "scenarios": [],
+    }
+    with StandInServer(**server_settings) as server:
+        for driver in args.drivers:
+            for engine in args.engines:
+                for threads in args.threads:
+                    for url_count in args.urls:
+                        scenario = run_repeated(
+                            server, args.repeat, driver, engine, threads, url_count
+                        )
+                        results["scenarios"].append(scenario)
+                        print(
+                            f"{scenario['name']}: "
+                            f"{scenario['urls_per_second']:.0f} urls/s "
+                            f"p99={scenario['p99']:.4f}s "
+                            f"peak_rss={scenario['peak_rss_mib']:.1f}MiB "
+                            f"connections={scenario['connections']}",
+                            file=sys.stderr,
+                        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("server") != server_settings:
+            print(
+                "Warning: the baseline was measured with other server settings",
+                file=sys.stderr,
+            )
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} measurements regressed", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
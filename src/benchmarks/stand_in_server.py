@@ -0,0 +1,193 @@
+"""Local stand-in storefront used by the benchmarks.
+
+Serves every GET and HEAD path with an HTML body (small by default, or
+body_size bytes) and an x-cache header over HTTP/1.1 keep-alive, and counts
+how many TCP connections clients opened.
+
+Responses can be made to look like a real storefront: a latency
+distribution (see parse_latency), a share of x-cache HIT responses and a
+share of injected errors. Which pages are slow, cached or failing depends
+only on the path and the seed, so every run of a benchmark sees the same.
+"""
+
+import math
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def parse_latency(spec):
+    """Parse a latency distribution into a function drawing seconds from a Random
+
+    spec is a number of seconds or one of:
+        fixed:SECONDS
+        uniform:LOW:HIGH
+        exponential:MEAN
+        lognormal:MEDIAN:SIGMA  - long-tailed, like most real storefronts
+    """
+    if not spec:
+        return lambda rng: 0.0
+    kind, _, params = str(spec).partition(":")
+    try:
+        if not params:
+            seconds = float(kind)
+            return lambda rng: seconds
+        values = [float(value) for value in params.split(":")]
+        if kind == "fixed" and len(values) == 1:
+            return lambda rng: values[0]
+        if kind == "uniform" and len(values) == 2:
+            return lambda rng: rng.uniform(*values)
+        if kind == "exponential" and len(values) == 1 and values[0] > 0:
+            return lambda rng: rng.expovariate(1 / values[0])
+        if kind == "lognormal" and len(values) == 2 and values[0] > 0:
+            mu = math.log(values[0])
+            return lambda rng: rng.lognormvariate(mu, values[1])
+    except ValueError:
+        pass
+    raise ValueError(f"Unknown latency distribution {spec}")
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        # setup() runs once per accepted connection, not once per request
+        with self.server.lock:
+            self.server.connections_opened += 1
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def respond(self, send_body):
+        server = self.server
+        rng = random.Random(f"{server.seed}:{self.path}")
+        delay = server.latency(rng)
+        failing = rng.random() < server.error_rate
+        hit = rng.random() < server.hit_ratio
+        if delay > 0:
+            time.sleep(delay)
+
+        body = server.body
+        with server.lock:
+            server.requests_served += 1
+            if failing:
+                server.errors_injected += 1
+            elif hit:
+                server.hits += 1
+            else:
+                server.misses += 1
+        self.send_response(server.error_status if failing else 200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("x-cache", "HIT" if hit and not failing else "MISS")
+        self.end_headers()
+        if send_body:
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # Clients in "headers" fetch mode hang up early
+                self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInHTTPServer(ThreadingHTTPServer):
+    # Benchmarks open hundreds of connections at once
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up mid-response are expected, not worth a traceback
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StandInServer:
+    """Threaded HTTP server running in the background on a free local port
+
+    latency is a parse_latency() spec, hit_ratio the share of responses with
+    x-cache HIT and error_rate the share answered with error_status.
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        body_size=None,
+        latency=None,
+        hit_ratio=1.0,
+        error_rate=0.0,
+        error_status=503,
+        seed=0,
+    ):
+        self.httpd = StandInHTTPServer((host, port), StandInHandler)
+        self.httpd.body = b"<html><body>stand-in</body></html>"
+        if body_size:
+            self.httpd.body = self.httpd.body.ljust(body_size, b" ")
+        self.httpd.latency = parse_latency(latency)
+        self.httpd.hit_ratio = hit_ratio
+        self.httpd.error_rate = error_rate
+        self.httpd.error_status = error_status
+        self.httpd.seed = seed
+        self.httpd.daemon_threads = True
+        self.httpd.lock = threading.Lock()
+        self.httpd.connections_opened = 0
+        self.httpd.requests_served = 0
+        self.httpd.hits = 0
+        self.httpd.misses = 0
+        self.httpd.errors_injected = 0
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def connections_opened(self):
+        return self.httpd.connections_opened
+
+    @property
+    def requests_served(self):
+        return self.httpd.requests_served
+
+    def counters(self):
+        """Connections and responses by kind since the last reset_counters()"""
+        with self.httpd.lock:
+            return {
+                "connections": self.httpd.connections_opened,
+                "requests": self.httpd.requests_served,
+                "hit": self.httpd.hits,
+                "miss": self.httpd.misses,
+                "errors": self.httpd.errors_injected,
+            }
+
+    def reset_counters(self):
+        with self.httpd.lock:
+            self.httpd.connections_opened = 0
+            self.httpd.requests_served = 0
+            self.httpd.hits = 0
+            self.httpd.misses = 0
+            self.httpd.errors_injected = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
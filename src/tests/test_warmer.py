@@ -1,3 +1,4 @@
+import asyncio
 import unittest
 from unittest.mock import patch, mock_open, MagicMock
 import sys
@@ -10,12 +11,80 @@ sys.path.insert(0, "./src")
 try:
     from warmer import (
         warm_url,
+        create_session,
         read_urls_from_csv,
+        iter_urls_from_csv,
+        read_unique_urls,
+        is_warmable_url,
+        iter_by_priority,
+        url_fingerprint,
+        shard_of,
+        parse_shard,
+        parse_address,
+        run_coordinator,
+        SpaceSaving,
+        iter_access_log_urls,
+        read_access_logs,
+        compile_agent_patterns,
+        load_log_state,
+        save_log_state,
+        read_access_logs_incremental,
+        iter_sitemap_entries,
+        iter_sitemap_urls,
+        open_sitemap,
+        fetch_sitemaps_from_robots,
+        parse_lastmod,
+        iter_sitemap_rows,
         process_urls_threaded,
+        iter_warm_results,
+        StageStats,
+        LatencyHistogram,
+        cache_status,
+        build_report,
+        Metrics,
+        start_metrics_server,
+        WarmState,
+        cache_tags,
+        vary_headers,
+        compile_variants,
+        VariantPlanner,
+        VariantURL,
+        request_headers,
+        request_cookies,
+        parse_change_event,
+        iter_change_batches,
+        change_stages,
+        follow_file,
+        serve_change_feed,
+        plan_rewarm,
+        ProgressReporter,
+        format_duration,
+        process_urls_async,
+        warm_url_async,
+        TokenBucket,
+        RateLimiter,
+        ConcurrencyGate,
+        AdaptiveConcurrency,
+        RetryPolicy,
+        CircuitBreaker,
+        HealthMonitor,
+        parse_health_check,
+        parse_nginx_stub_status,
+        parse_fpm_status,
+        read_loadavg,
+        warm_with_retries,
+        main,
         load_config_from_json,
+        read_json_config,
+        load_settings,
+        run_job,
+        compile_normalization_rules,
+        normalize_url,
         extract_base_url_from_config,
         extract_base_url_from_url,
         match_urls_by_base_url,
+        bucket_urls_by_host,
+        urls_for_config,
     )
 except ImportError as e:
     print(f"Failed to import: {e}")
@@ -67,6 +136,86 @@ class TestWarmURL(unittest.TestCase):
         self.assertEqual(result["x_cache"], "MISS")
         self.assertIn("Connection error", result["error"])
 
+    def test_warm_url_uses_session(self):
+        """Test URL warming reuses the given session instead of requests.get"""
+        session = MagicMock()
+        session.get.return_value.status_code = 200
+        session.get.return_value.headers = {"x-cache": "HIT"}
+
+        with patch("requests.get") as mock_get:
+            result = warm_url("http://example.com/test", session=session)
+
+        mock_get.assert_not_called()
+        session.get.assert_called_once()
+        self.assertTrue(result["success"])
+
+    def test_warm_url_fetch_modes(self):
+        """Test each fetch mode's request and what happens to the body"""
+        for mode, method, stream, drained in (
+            ("full", "get", True, False),
+            ("stream", "get", True, True),
+            ("headers", "get", True, False),
+            ("head", "head", None, False),
+        ):
+            with self.subTest(mode=mode):
+                session = MagicMock()
+                response = getattr(session, method).return_value
+                response.status_code = 200
+                response.headers = {"x-cache": "HIT"}
+                response.raw.stream.return_value = iter([b"chunk", b"chunk"])
+
+                result = warm_url(
+                    "http://example.com/", session=session, fetch_mode=mode
+                )
+
+                self.assertTrue(result["success"])
+                self.assertEqual(result["x_cache"], "HIT")
+                kwargs = getattr(session, method).call_args.kwargs
+                self.assertEqual(kwargs.get("stream"), stream)
+                self.assertEqual(response.raw.stream.called, drained)
+                if drained:
+                    self.assertFalse(
+                        response.raw.stream.call_args.kwargs["decode_content"]
+                    )
+                response.close.assert_called_once()
+                if method == "head":
+                    session.get.assert_not_called()
+
+    def test_warm_url_timings_and_bytes(self):
+        """Test results carry timings and the body bytes read"""
+        session = MagicMock()
+        session.get.return_value.status_code = 200
+        session.get.return_value.headers = {"x-cache": "HIT"}
+        session.get.return_value.raw.stream.return_value = iter([b"ab", b"cde"])
+
+        result = warm_url("http://example.com/", session=session)
+
+        self.assertEqual(result["bytes"], 5)
+        self.assertEqual(result["connect"], 0.0)
+        self.assertLessEqual(result["ttfb"], result["elapsed"])
+
+
+class TestCreateSession(unittest.TestCase):
+    def test_create_session_pool_size(self):
+        """Test the session connection pool is sized to the worker count"""
+        with create_session(pool_size=8) as session:
+            adapter = session.get_adapter("https://example.com/")
+            self.assertEqual(adapter._pool_maxsize, 8)
+
+    def test_create_session_ignores_response_cookies(self):
+        """Test cookies set by responses are not stored in the session"""
+        from http.client import HTTPMessage
+        from urllib.request import Request
+
+        headers = HTTPMessage()
+        headers["Set-Cookie"] = "PHPSESSID=abc; path=/"
+        response = MagicMock()
+        response.info.return_value = headers
+
+        with create_session() as session:
+            session.cookies.extract_cookies(response, Request("http://example.com/"))
+            self.assertEqual(len(session.cookies), 0)
+
 
 class TestReadURLsFromCSV(unittest.TestCase):
     def test_read_urls_from_csv_success(self):
@@ -105,8 +254,570 @@ class TestReadURLsFromCSV(unittest.TestCase):
         self.assertEqual(urls, [])
 
 
+class TestReadUniqueURLs(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def write_file(self, name, content):
+        import gzip
+
+        path = os.path.join(self.tmpdir.name, name)
+        opener = gzip.open if name.endswith(".gz") else open
+        with opener(path, "wt") as f:
+            f.write(content)
+        return path
+
+    def test_is_warmable_url(self):
+        """Test the cheap URL check accepts http(s) URLs with a host only"""
+        self.assertTrue(is_warmable_url("http://example.com"))
+        self.assertTrue(is_warmable_url("HTTPS://example.com/page"))
+        self.assertFalse(is_warmable_url("ftp://example.com/page"))
+        self.assertFalse(is_warmable_url("http:///page"))
+        self.assertFalse(is_warmable_url("URL"))
+
+    def test_iter_urls_from_gzip_csv(self):
+        """Test gzip compressed CSV files are read transparently"""
+        path = self.write_file(
+            "urls.csv.gz", "URL\nhttp://example.com/page1\nhttp://example.com/page2\n"
+        )
+
+        self.assertEqual(
+            list(iter_urls_from_csv(path)),
+            ["http://example.com/page1", "http://example.com/page2"],
+        )
+
+    def test_read_unique_urls_across_files(self):
+        """Test a URL listed in several files is only kept once"""
+        first = self.write_file(
+            "nginx.csv", "http://example.com/page1\nhttp://example.com/page2\n"
+        )
+        second = self.write_file(
+            "sitemap.csv",
+            "http://EXAMPLE.com/page1\nhttp://example.com/page3\n"
+            "http://example.com/page2\n",
+        )
+
+        with patch("builtins.print"):
+            urls = read_unique_urls([first, second])
+
+        self.assertEqual(
+            urls,
+            [
+                "http://example.com/page1",
+                "http://example.com/page2",
+                "http://example.com/page3",
+            ],
+        )
+
+    def test_read_unique_urls_keeps_path_case(self):
+        """Test only the scheme and host are case-insensitive for duplicates"""
+        path = self.write_file(
+            "urls.csv", "http://example.com/Page\nhttp://example.com/page\n"
+        )
+
+        with patch("builtins.print"):
+            urls = read_unique_urls([path])
+
+        self.assertEqual(len(urls), 2)
+
+    def test_read_unique_urls_sums_weights(self):
+        """Test weights of a URL listed in several files are added up"""
+        first = self.write_file(
+            "nginx1.csv", "URL,Count\nhttp://example.com/a,10\nhttp://example.com/b,3\n"
+        )
+        second = self.write_file(
+            "nginx2.csv", "http://example.com/b,20\nhttp://example.com/c,oops\n"
+        )
+        weights = {}
+
+        with patch("builtins.print"):
+            urls = read_unique_urls([first, second], weight_column=1, weights=weights)
+
+        self.assertEqual(len(urls), 3)
+        self.assertEqual(weights[url_fingerprint("http://example.com/a")], 10)
+        self.assertEqual(weights[url_fingerprint("http://example.com/b")], 23)
+        self.assertEqual(weights[url_fingerprint("http://example.com/c")], 0)
+
+    def test_iter_by_priority(self):
+        """Test URLs come out highest weight first, ties in original order"""
+        urls = [f"http://example.com/{name}" for name in "abcde"]
+        weights = {
+            url_fingerprint("http://example.com/b"): 5,
+            url_fingerprint("http://example.com/d"): 50,
+            url_fingerprint("http://example.com/e"): 5,
+        }
+
+        self.assertEqual(
+            [url[-1] for url in iter_by_priority(urls, weights)],
+            ["d", "b", "e", "a", "c"],
+        )
+
+    def test_read_unique_urls_missing_file(self):
+        """Test a missing file is reported and the other files are still read"""
+        path = self.write_file("urls.csv", "http://example.com/page1\n")
+
+        with patch("builtins.print") as mock_print:
+            urls = read_unique_urls([os.path.join(self.tmpdir.name, "nope.csv"), path])
+
+        self.assertEqual(urls, ["http://example.com/page1"])
+        printed = " ".join(str(call.args[0]) for call in mock_print.call_args_list)
+        self.assertIn("not found", printed)
+
+
+def log_line(target, status=200, agent="Mozilla/5.0"):
+    return (
+        f'127.0.0.1 - - [01/Jan/2026:00:00:00 +0000] "GET {target} HTTP/1.1" '
+        f'{status} 1234 "-" "{agent}"\n'
+    )
+
+
+class TestAccessLogs(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def write_log(self, name, lines):
+        import gzip
+
+        path = os.path.join(self.tmpdir.name, name)
+        opener = gzip.open if name.endswith(".gz") else open
+        with opener(path, "wt") as f:
+            f.writelines(lines)
+        return path
+
+    def test_space_saving_exact_when_under_capacity(self):
+        """Test counts are exact while fewer items than capacity are seen"""
+        counter = SpaceSaving(capacity=10)
+        for item in "aabacabd":
+            counter.add(item)
+
+        self.assertEqual(counter.top(2), [("a", 4), ("b", 2)])
+
+    def test_space_saving_keeps_heavy_hitters(self):
+        """Test frequent items survive a long tail of one-off items"""
+        counter = SpaceSaving(capacity=20)
+        for i in range(5000):
+            counter.add(f"tail-{i}")
+            if i % 5 == 0:
+                counter.add("hot")
+            if i % 10 == 0:
+                counter.add("warm")
+
+        top = [item for item, _ in counter.top(2)]
+        self.assertEqual(top, ["hot", "warm"])
+        self.assertLessEqual(len(counter.counts), 20)
+        self.assertEqual(len(counter.heap), len(counter.counts))
+
+    def test_iter_access_log_urls_filters_non_pages(self):
+        """Test only successful GET requests of pages are kept"""
+        path = self.write_log(
+            "access.log",
+            [
+                log_line("/laptops"),
+                log_line("/laptops", status=404),
+                log_line("/static/version1/app.js"),
+                log_line("/media/catalog/product.jpg"),
+                log_line("/customer/section/load"),
+                log_line("/search?q=abc"),
+                log_line("https://shop.local/gaming"),
+                log_line("/bot-page", agent="Googlebot/2.1"),
+                "garbage line\n",
+            ],
+        )
+
+        urls = list(
+            iter_access_log_urls(
+                path,
+                base_url="https://magento.local/",
+                ignore_agents=compile_agent_patterns(["Googlebot"]),
+            )
+        )
+
+        self.assertEqual(
+            urls, ["https://magento.local/laptops", "https://shop.local/gaming"]
+        )
+
+    def test_iter_access_log_urls_without_base_url(self):
+        """Test path-only requests are skipped when no base URL is known"""
+        path = self.write_log(
+            "access.log", [log_line("/laptops"), log_line("http://shop.local/a")]
+        )
+
+        self.assertEqual(list(iter_access_log_urls(path)), ["http://shop.local/a"])
+
+    def test_read_access_logs_top_across_rotated_logs(self):
+        """Test counts add up over plain and gzip rotated logs"""
+        current = self.write_log(
+            "access.log", [log_line("/a")] * 2 + [log_line("/b")] * 3
+        )
+        rotated = self.write_log(
+            "access.log.1.gz", [log_line("/a")] * 4 + [log_line("/c")]
+        )
+
+        with patch("builtins.print"):
+            top = read_access_logs(
+                [current, rotated], top=2, base_url="http://shop.local"
+            )
+
+        self.assertEqual(top, [("http://shop.local/a", 6), ("http://shop.local/b", 3)])
+
+
+class TestIncrementalAccessLogs(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.log = os.path.join(self.tmpdir.name, "access.log")
+        self.state = load_log_state(os.path.join(self.tmpdir.name, "state.json"))
+
+    def append(self, path, text):
+        with open(path, "a") as f:
+            f.write(text)
+
+    def ingest(self, filenames, now=0, **kwargs):
+        with patch("builtins.print"):
+            return dict(
+                read_access_logs_incremental(
+                    filenames,
+                    self.state,
+                    base_url="http://shop.local",
+                    now=now,
+                    **kwargs,
+                )
+            )
+
+    def test_only_new_lines_are_parsed(self):
+        """Test a second run only counts lines appended since the first one"""
+        self.append(self.log, log_line("/a") * 2)
+        self.assertEqual(self.ingest([self.log]), {"http://shop.local/a": 2})
+
+        self.append(self.log, log_line("/b"))
+        top = self.ingest([self.log], half_life=0)
+
+        self.assertEqual(top, {"http://shop.local/a": 2, "http://shop.local/b": 1})
+
+    def test_partial_line_is_left_for_next_run(self):
+        """Test a line still being written is not consumed"""
+        self.append(self.log, log_line("/a") + log_line("/b").rstrip("\n"))
+        self.assertEqual(self.ingest([self.log]), {"http://shop.local/a": 1})
+
+        self.append(self.log, "\n")
+        top = self.ingest([self.log], half_life=0)
+
+        self.assertEqual(top, {"http://shop.local/a": 1, "http://shop.local/b": 1})
+
+    def test_rotation_is_detected(self):
+        """Test the rotated file is finished and the new log read from its start"""
+        self.append(self.log, log_line("/a"))
+        self.ingest([self.log])
+
+        self.append(self.log, log_line("/a"))
+        rotated = self.log + ".1"
+        os.rename(self.log, rotated)
+        self.append(self.log, log_line("/b"))
+        top = self.ingest([self.log, rotated], half_life=0)
+
+        self.assertEqual(top, {"http://shop.local/a": 2, "http://shop.local/b": 1})
+
+    def test_truncated_log_is_read_again(self):
+        """Test a copytruncate-rotated log is read from the start"""
+        self.append(self.log, log_line("/a") * 3)
+        self.ingest([self.log])
+
+        with open(self.log, "w") as f:
+            f.write(log_line("/b"))
+        top = self.ingest([self.log], half_life=0)
+
+        self.assertEqual(top, {"http://shop.local/a": 3, "http://shop.local/b": 1})
+
+    def test_reused_inode_is_read_again(self):
+        """Test a new log on the inode of a read one is read from the start"""
+        self.append(self.log, log_line("/a"))
+        self.ingest([self.log])
+
+        # Same inode and longer than the stored offset, but another log
+        with open(self.log, "w") as f:
+            f.write(log_line("/b") + log_line("/c"))
+        top = self.ingest([self.log], half_life=0)
+
+        self.assertEqual(
+            top,
+            {
+                "http://shop.local/a": 1,
+                "http://shop.local/b": 1,
+                "http://shop.local/c": 1,
+            },
+        )
+
+    def test_state_forgets_logs_not_passed(self):
+        """Test offsets of logs missing from a run are dropped from the state"""
+        other = self.log + ".1"
+        self.append(self.log, log_line("/a"))
+        self.append(other, log_line("/b"))
+        self.ingest([self.log, other])
+        self.assertEqual(len(self.state["files"]), 2)
+
+        os.remove(other)
+        self.ingest([self.log, other])
+
+        stat = os.stat(self.log)
+        self.assertEqual(list(self.state["files"]), [f"{stat.st_dev}:{stat.st_ino}"])
+
+    def test_compressed_logs_are_skipped(self):
+        """Test .gz logs are not counted again when they appear after rotation"""
+        import gzip
+
+        compressed = self.log + ".2.gz"
+        with gzip.open(compressed, "wt") as f:
+            f.write(log_line("/a"))
+        self.append(self.log, log_line("/b"))
+        top = self.ingest([self.log, compressed])
+
+        self.assertEqual(top, {"http://shop.local/b": 1})
+        self.assertEqual(len(self.state["files"]), 1)
+
+    def test_state_without_fingerprints_is_resumed(self):
+        """Test plain offsets of an older state file are still honoured"""
+        self.append(self.log, log_line("/a") + log_line("/b"))
+        stat = os.stat(self.log)
+        self.state["files"] = {f"{stat.st_dev}:{stat.st_ino}": len(log_line("/a"))}
+        top = self.ingest([self.log])
+
+        self.assertEqual(top, {"http://shop.local/b": 1})
+
+    def test_popularity_decays_with_half_life(self):
+        """Test older counts lose half their weight every half-life"""
+        self.append(self.log, log_line("/a") * 8)
+        self.ingest([self.log], now=0, half_life=1)
+
+        self.append(self.log, log_line("/b") * 3)
+        top = self.ingest([self.log], now=7200, half_life=1)
+
+        self.assertEqual(top, {"http://shop.local/a": 2, "http://shop.local/b": 3})
+
+    def test_state_round_trip(self):
+        """Test offsets and popularity survive saving and loading the state"""
+        path = os.path.join(self.tmpdir.name, "state.json")
+        self.append(self.log, log_line("/a"))
+        self.ingest([self.log])
+
+        save_log_state(path, self.state)
+        self.state = load_log_state(path)
+        top = self.ingest([self.log], half_life=0)
+
+        self.assertEqual(top, {"http://shop.local/a": 1})
+
+
+SITEMAP_NS = 'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"'
+
+
+def sitemap_xml(*locs):
+    entries = "".join(
+        f"<url><loc>{loc}</loc><lastmod>2026-01-0{i + 1}</lastmod>"
+        f"<image:image><image:loc>{loc}.jpg</image:loc></image:image></url>"
+        for i, loc in enumerate(locs)
+    )
+    return (
+        f'<?xml version="1.0"?><urlset {SITEMAP_NS} '
+        f'xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">'
+        f"{entries}</urlset>"
+    ).encode()
+
+
+def sitemap_index_xml(*locs):
+    entries = "".join(f"<sitemap><loc>{loc}</loc></sitemap>" for loc in locs)
+    return (
+        f'<?xml version="1.0"?><sitemapindex {SITEMAP_NS}>{entries}</sitemapindex>'
+    ).encode()
+
+
+class TestSitemaps(unittest.TestCase):
+    def test_iter_sitemap_entries_urlset(self):
+        """Test page URLs and lastmod are read, image locations are ignored"""
+        from io import BytesIO
+
+        entries = list(
+            iter_sitemap_entries(BytesIO(sitemap_xml("http://a/1", "http://a/2")))
+        )
+
+        self.assertEqual(
+            entries,
+            [("url", "http://a/1", "2026-01-01"), ("url", "http://a/2", "2026-01-02")],
+        )
+
+    def test_iter_sitemap_entries_index(self):
+        """Test sitemap index entries are reported as child sitemaps"""
+        from io import BytesIO
+
+        entries = list(
+            iter_sitemap_entries(BytesIO(sitemap_index_xml("http://a/s1.xml")))
+        )
+
+        self.assertEqual(entries, [("sitemap", "http://a/s1.xml", None)])
+
+    def test_open_sitemap_gunzips(self):
+        """Test gzip compressed sitemaps are detected and decompressed"""
+        import gzip
+        from io import BytesIO
+
+        session = MagicMock()
+        session.get.return_value.raw = BytesIO(gzip.compress(sitemap_xml("http://a/1")))
+
+        with open_sitemap("http://a/sitemap.xml.gz", session) as stream:
+            entries = list(iter_sitemap_entries(stream))
+
+        self.assertEqual(entries, [("url", "http://a/1", "2026-01-01")])
+
+    def test_open_sitemap_closes_response(self):
+        """Test closing a plain or gzip sitemap closes its streamed response"""
+        import gzip
+        from io import BytesIO
+
+        for body in (
+            sitemap_xml("http://a/1"),
+            gzip.compress(sitemap_xml("http://a/1")),
+        ):
+            with self.subTest(gzip=body[:2] == b"\x1f\x8b"):
+                session = MagicMock()
+                response = session.get.return_value
+                response.raw = BytesIO(body)
+
+                with open_sitemap("http://a/sitemap.xml", session) as stream:
+                    list(iter_sitemap_entries(stream))
+
+                response.close.assert_called_once_with()
+                self.assertTrue(response.raw.closed)
+
+    def test_fetch_sitemaps_from_robots(self):
+        """Test Sitemap: lines of robots.txt are returned"""
+        session = MagicMock()
+        session.get.return_value.text = (
+            "User-agent: *\nDisallow: /checkout/\n"
+            "Sitemap: https://a/sitemap.xml\nsitemap: https://a/media/s2.xml\n"
+        )
+
+        sitemaps = fetch_sitemaps_from_robots("https://a", session)
+
+        self.assertEqual(session.get.call_args.args[0], "https://a/robots.txt")
+        self.assertEqual(sitemaps, ["https://a/sitemap.xml", "https://a/media/s2.xml"])
+
+    def test_iter_sitemap_urls_follows_indexes(self):
+        """Test robots.txt, indexes and child sitemaps are all followed"""
+        from io import BytesIO
+
+        documents = {
+            "http://a/index.xml": sitemap_index_xml(
+                "http://a/s1.xml", "http://a/s2.xml"
+            ),
+            "http://a/s1.xml": sitemap_xml("http://a/1", "http://a/2"),
+            "http://a/s2.xml": sitemap_xml("http://a/3"),
+            "http://a/other.xml": sitemap_xml("http://a/4"),
+        }
+
+        def fake_open(url, session, timeout=50):
+            if url not in documents:
+                raise Exception("404 Not Found")
+            return BytesIO(documents[url])
+
+        with patch("warmer.open_sitemap", side_effect=fake_open), patch(
+            "warmer.fetch_sitemaps_from_robots",
+            return_value=["http://a/index.xml", "http://a/missing.xml"],
+        ), patch("builtins.print") as mock_print:
+            urls = sorted(
+                url
+                for url, _ in iter_sitemap_urls(
+                    ["http://a/other.xml"], robots=["http://a"], max_workers=3
+                )
+            )
+
+        self.assertEqual(urls, ["http://a/1", "http://a/2", "http://a/3", "http://a/4"])
+        self.assertIn("missing.xml", mock_print.call_args.args[0])
+
+    def test_iter_sitemap_urls_real_server(self):
+        """Test robots.txt, an index and a gzip child are fetched over HTTP"""
+        import gzip
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        documents = {}
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = documents.get(self.path)
+                self.send_response(200 if body is not None else 404)
+                self.send_header("Content-Length", str(len(body or b"")))
+                self.end_headers()
+                self.wfile.write(body or b"")
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        documents.update(
+            {
+                "/robots.txt": f"Sitemap: {base}/index.xml\n".encode(),
+                "/index.xml": sitemap_index_xml(f"{base}/s1.xml", f"{base}/s2.xml.gz"),
+                "/s1.xml": sitemap_xml(f"{base}/1", f"{base}/2"),
+                "/s2.xml.gz": gzip.compress(sitemap_xml(f"{base}/3")),
+            }
+        )
+
+        with patch("builtins.print") as mock_print:
+            urls = sorted(
+                url for url, _ in iter_sitemap_urls(robots=[base], max_workers=2)
+            )
+
+        self.assertEqual(urls, [f"{base}/1", f"{base}/2", f"{base}/3"])
+        self.assertNotIn(
+            "Error", " ".join(str(call.args) for call in mock_print.call_args_list)
+        )
+
+
+class TestSitemapLastmod(unittest.TestCase):
+    def test_parse_lastmod_formats(self):
+        """Test W3C dates and datetimes are parsed, dates without zone as UTC"""
+        self.assertEqual(parse_lastmod("1970-01-02"), 86400)
+        self.assertEqual(parse_lastmod("1970-01-01T01:00:00+01:00"), 0)
+        self.assertEqual(parse_lastmod("1970-01-01T00:01Z"), 60)
+        self.assertIsNone(parse_lastmod("yesterday"))
+        self.assertIsNone(parse_lastmod(None))
+
+    def test_iter_sitemap_rows_keeps_newest_lastmod(self):
+        """Test lastmods are keyed by the normalized URL, newest date wins"""
+        rules = compile_normalization_rules({"trailing_slash": "remove"})
+        lastmods = {}
+
+        rows = list(
+            iter_sitemap_rows(
+                [
+                    ("http://a/p/", "1970-01-03"),
+                    ("http://a/p", "1970-01-02"),
+                    ("http://a/q", None),
+                ],
+                rules,
+                lastmods,
+            )
+        )
+
+        self.assertEqual(
+            rows, [("http://a/p", 0.0), ("http://a/p", 0.0), ("http://a/q", 0.0)]
+        )
+        self.assertEqual(lastmods, {url_fingerprint("http://a/p"): 2 * 86400})
+
+
 class TestProcessURLsThreaded(unittest.TestCase):
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def test_process_urls_threaded_sequential(self, mock_get):
         """Test sequential processing of URLs"""
         # Setup mock response
@@ -131,7 +842,7 @@ class TestProcessURLsThreaded(unittest.TestCase):
             self.assertTrue(result["success"])
             self.assertEqual(result["status"], 200)
 
-    @patch("requests.get")
+    @patch("requests.Session.get")
     def test_process_urls_threaded_parallel(self, mock_get):
         """Test parallel processing of URLs"""
         # Setup mock response
@@ -156,6 +867,2236 @@ class TestProcessURLsThreaded(unittest.TestCase):
             self.assertTrue(result["success"])
             self.assertEqual(result["status"], 200)
 
+    @patch("warmer.iter_results_async")
+    def test_process_urls_threaded_asyncio_engine(self, mock_async):
+        """Test the asyncio engine delegates to the event loop pipeline"""
+        mock_async.return_value = iter([{"url": "http://example.com/page1"}])
+
+        results = process_urls_threaded(
+            ["http://example.com/page1"], engine="asyncio", concurrency=300
+        )
+
+        self.assertEqual(mock_async.call_args.args[1], 300)
+        self.assertEqual(len(results), 1)
+
+
+try:
+    import aiohttp  # noqa: F401
+
+    HAS_AIOHTTP = True
+except ImportError:
+    HAS_AIOHTTP = False
+
+
+class FakeAsyncContent:
+    def __init__(self, body):
+        self.body = body
+        self.chunks_read = 0
+
+    async def iter_chunked(self, size):
+        for start in range(0, len(self.body), size):
+            self.chunks_read += 1
+            yield self.body[start : start + size]
+
+
+class FakeAsyncResponse:
+    def __init__(self, status, headers, body=b""):
+        self.status = status
+        self.headers = headers
+        self.content = FakeAsyncContent(body)
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def read(self):
+        return self.content.body
+
+    def close(self):
+        self.closed = True
+
+
+@unittest.skipUnless(HAS_AIOHTTP, "aiohttp is not installed")
+class TestProcessURLsAsync(unittest.TestCase):
+    def test_warm_url_async_success(self):
+        """Test async URL warming returns the same result dict as warm_url"""
+        session = MagicMock()
+        session.get.return_value = FakeAsyncResponse(
+            200,
+            {
+                "x-cache": "HIT",
+                "etag": '"v1"',
+                "x-magento-tags": "cat_p_1,cat_p",
+                "vary": "Accept-Encoding, User-Agent",
+            },
+        )
+
+        result = asyncio.run(warm_url_async(session, "http://example.com/test"))
+
+        for timing in ("connect", "ttfb", "elapsed"):
+            self.assertGreaterEqual(result.pop(timing), 0)
+        self.assertEqual(
+            result,
+            {
+                "url": "http://example.com/test",
+                "status": 200,
+                "success": True,
+                "error": None,
+                "x_cache": "HIT",
+                "etag": '"v1"',
+                "last_modified": None,
+                "tags": ["cat_p_1", "cat_p"],
+                "vary": ["accept-encoding", "user-agent"],
+                "bytes": 0,
+            },
+        )
+
+    def test_warm_url_async_exception(self):
+        """Test async URL warming when the request fails"""
+        session = MagicMock()
+        session.get.side_effect = Exception("Connection error")
+
+        result = asyncio.run(warm_url_async(session, "http://example.com/test"))
+
+        self.assertFalse(result["success"])
+        self.assertEqual(result["x_cache"], "MISS")
+        self.assertIn("Connection error", result["error"])
+
+    def test_process_urls_async_bounded_concurrency(self):
+        """Test no more than `concurrency` requests are in flight at once"""
+        in_flight = 0
+        max_in_flight = 0
+
+        async def fake_warm(
+            session, url, headers=None, cookies=None, timeout=50, fetch_mode="stream"
+        ):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.001)
+            in_flight -= 1
+            return {"url": url, "success": True}
+
+        urls = [f"http://example.com/page{i}" for i in range(50)]
+        with patch("warmer.warm_url_async", fake_warm):
+            results = process_urls_async(urls, concurrency=7)
+
+        self.assertEqual(len(results), 50)
+        self.assertEqual(sorted(r["url"] for r in results), sorted(urls))
+        self.assertEqual(max_in_flight, 7)
+
+    def test_iter_results_async_stops_early(self):
+        """Test closing the async result stream early cancels the remaining URLs"""
+        warmed = []
+        in_flight = set()
+
+        async def fake_warm(
+            session, url, headers=None, cookies=None, timeout=50, fetch_mode="stream"
+        ):
+            warmed.append(url)
+            in_flight.add(url)
+            try:
+                await asyncio.sleep(0.001 if url.endswith("page0") else 10)
+            finally:
+                in_flight.discard(url)
+            return {"url": url, "success": True}
+
+        urls = (f"http://example.com/page{i}" for i in range(1000))
+        with patch("warmer.warm_url_async", fake_warm):
+            results = iter_warm_results(urls, engine="asyncio", concurrency=5)
+            next(results)
+            results.close()
+
+        self.assertLess(len(warmed), 20)
+        # Requests still running were cancelled, not left pending on a closed loop
+        self.assertEqual(in_flight, set())
+
+    def test_warm_url_async_fetch_modes(self):
+        """Test the asyncio engine streams, closes early or sends HEAD"""
+        body = b"x" * 200000
+
+        for mode, chunks_read, closed in (
+            ("stream", 4, False),
+            ("headers", 0, True),
+            ("head", 0, False),
+        ):
+            with self.subTest(mode=mode):
+                session = MagicMock()
+                response = FakeAsyncResponse(200, {"x-cache": "HIT"}, body)
+                session.get.return_value = response
+                session.head.return_value = response
+
+                result = asyncio.run(
+                    warm_url_async(session, "http://example.com/", fetch_mode=mode)
+                )
+
+                self.assertTrue(result["success"])
+                self.assertEqual(response.content.chunks_read, chunks_read)
+                self.assertEqual(response.closed, closed)
+                self.assertEqual(session.head.called, mode == "head")
+
+
+class FakeClock:
+    """Manually advanced clock whose sleep() only moves time forward"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_token_bucket_spaces_reservations_evenly(self):
+        """Test reservations are spaced at the refill rate"""
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, capacity=1, clock=clock)
+
+        delays = [bucket.reserve() for _ in range(4)]
+
+        self.assertEqual(delays, [0.0, 0.5, 1.0, 1.5])
+
+    def test_token_bucket_burst_capacity(self):
+        """Test a full bucket lets `capacity` requests through immediately"""
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1, capacity=3, clock=clock)
+
+        delays = [bucket.reserve() for _ in range(5)]
+
+        self.assertEqual(delays, [0.0, 0.0, 0.0, 1.0, 2.0])
+
+    def test_token_bucket_refills_over_time(self):
+        """Test idle time refills the bucket up to its capacity only"""
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1, capacity=2, clock=clock)
+        bucket.reserve()
+        bucket.reserve()
+
+        clock.now = 100
+        delays = [bucket.reserve() for _ in range(3)]
+
+        self.assertEqual(delays, [0.0, 0.0, 1.0])
+
+    def test_rate_limiter_holds_rate_across_workers(self):
+        """Test many workers sharing a limiter send at the requested rate"""
+        clock = FakeClock()
+        limiter = RateLimiter(urls_per_minute=120, clock=clock)
+        send_times = []
+
+        # Interleave 8 simulated workers: each one reserves a slot and
+        # records when its request would be sent
+        for i in range(240):
+            send_times.append(clock.now + limiter.reserve(f"http://a.com/{i}"))
+            if i % 8 == 7:
+                clock.sleep(0.1)
+
+        urls_per_minute = (len(send_times) - 1) / (max(send_times) / 60)
+        self.assertAlmostEqual(urls_per_minute, 120, delta=120 * 0.02)
+        self.assertEqual(send_times, sorted(send_times))
+
+    def test_rate_limiter_per_host_buckets(self):
+        """Test per-host limits pace each host independently"""
+        clock = FakeClock()
+        limiter = RateLimiter(per_host=60, clock=clock)
+
+        self.assertEqual(limiter.reserve("http://a.com/1"), 0.0)
+        self.assertEqual(limiter.reserve("http://b.com/1"), 0.0)
+        self.assertEqual(limiter.reserve("http://a.com/2"), 1.0)
+        self.assertEqual(limiter.reserve("http://b.com/2"), 1.0)
+
+    def test_rate_limiter_acquire_sleeps(self):
+        """Test acquire() blocks for the reserved delay"""
+        clock = FakeClock()
+        limiter = RateLimiter(urls_per_minute=30, clock=clock)
+
+        limiter.acquire("http://a.com/1", sleep=clock.sleep)
+        limiter.acquire("http://a.com/2", sleep=clock.sleep)
+
+        self.assertEqual(clock.now, 2.0)
+
+    @patch("requests.Session.get")
+    def test_process_urls_threaded_uses_limiter(self, mock_get):
+        """Test the threaded path waits on the shared limiter for every URL"""
+        mock_get.return_value.status_code = 200
+        mock_get.return_value.headers = {"x-cache": "HIT"}
+        limiter = MagicMock()
+        urls = [f"http://example.com/page{i}" for i in range(6)]
+
+        process_urls_threaded(urls, max_workers=3, rate_limiter=limiter)
+
+        self.assertEqual(
+            sorted(call.args[0] for call in limiter.acquire.call_args_list), urls
+        )
+
+
+class TestIterWarmResults(unittest.TestCase):
+    def test_iter_warm_results_bounded_window(self):
+        """Test URLs are pulled lazily and only max_in_flight are submitted"""
+        pulled = []
+
+        def url_source():
+            for i in range(100):
+                pulled.append(i)
+                yield f"http://example.com/page{i}"
+
+        def fake_warm(url, *args, **kwargs):
+            return {"url": url, "success": True, "x_cache": "HIT"}
+
+        with patch("warmer.warm_url", side_effect=fake_warm):
+            results = iter_warm_results(url_source(), max_workers=2, max_in_flight=4)
+            first = next(results)
+            self.assertLessEqual(len(pulled), 5)
+            remaining = list(results)
+
+        self.assertIn(first["url"], [f"http://example.com/page{i}" for i in range(5)])
+        self.assertEqual(len(remaining), 99)
+
+    def test_iter_warm_results_completion_order(self):
+        """Test a slow first URL does not hold up results that finished after it"""
+        import threading
+
+        release_slow = threading.Event()
+
+        def fake_warm(url, *args, **kwargs):
+            if url.endswith("slow"):
+                release_slow.wait(5)
+            return {"url": url}
+
+        urls = ["http://example.com/slow"] + [
+            f"http://example.com/page{i}" for i in range(5)
+        ]
+        with patch("warmer.warm_url", side_effect=fake_warm):
+            results = iter_warm_results(urls, max_workers=3, max_in_flight=3)
+            first_fast = [next(results)["url"] for _ in range(5)]
+            release_slow.set()
+            last = list(results)
+
+        self.assertNotIn("http://example.com/slow", first_fast)
+        self.assertEqual([r["url"] for r in last], ["http://example.com/slow"])
+
+    def test_iter_warm_results_reports_progress(self):
+        """Test the progress reporter sees every request and finished URL"""
+        progress = ProgressReporter(total=3)
+        urls = [f"http://example.com/page{i}" for i in range(3)]
+        requests_seen = []
+
+        def fake_warm(url, *args, **kwargs):
+            requests_seen.append(progress.requests)
+            return {"url": url}
+
+        with patch("warmer.warm_url", side_effect=fake_warm):
+            list(iter_warm_results(urls, max_workers=2, progress=progress))
+
+        self.assertEqual((progress.requests, progress.done), (0, 3))
+        self.assertTrue(all(count >= 1 for count in requests_seen))
+
+    def test_iter_warm_results_in_flight_excludes_gated_requests(self):
+        """Test requests held back by the gate are not counted as in flight"""
+        import threading
+        import time
+
+        progress = ProgressReporter()
+        gate = ConcurrencyGate(max_concurrency=1)
+        lock = threading.Lock()
+        counts = []
+
+        def fake_warm(url, *args, **kwargs):
+            with lock:
+                counts.append(progress.requests)
+            time.sleep(0.005)
+            return {"url": url}
+
+        urls = [f"http://example.com/page{i}" for i in range(12)]
+        with patch("warmer.warm_url", side_effect=fake_warm):
+            list(
+                iter_warm_results(
+                    urls, max_workers=4, max_in_flight=8, progress=progress, gate=gate
+                )
+            )
+
+        self.assertEqual(set(counts), {1})
+
+    def test_iter_warm_results_sequential(self):
+        """Test sequential mode yields one result per URL in order"""
+        urls = ["http://example.com/page1", "http://example.com/page2"]
+
+        with patch("warmer.warm_url", side_effect=lambda url, *a, **kw: {"url": url}):
+            results = list(iter_warm_results(urls, use_threads=False))
+
+        self.assertEqual([r["url"] for r in results], urls)
+
+
+class SimulatedOrigin:
+    """Origin with `capacity` PHP workers: requests beyond it queue up, so
+    latency grows with the load, and past `overload` in flight it answers 503"""
+
+    def __init__(self, capacity, latency=0.1, overload=None):
+        self.capacity = capacity
+        self.latency = latency
+        self.overload = overload
+
+    def respond(self, in_flight):
+        status = 503 if self.overload and in_flight > self.overload else 200
+        return {
+            "success": True,
+            "status": status,
+            "elapsed": self.latency * max(1.0, in_flight / self.capacity),
+        }
+
+    def run(self, controller, rounds):
+        """Send rounds of `limit` concurrent requests, return the limits used"""
+        limits = []
+        for _ in range(rounds):
+            in_flight = controller.limit
+            limits.append(in_flight)
+            for _ in range(in_flight):
+                controller.record(self.respond(in_flight))
+        return limits
+
+
+class TestAdaptiveConcurrency(unittest.TestCase):
+    def test_grows_to_maximum_on_healthy_origin(self):
+        """Test the limit grows by one per window up to the maximum"""
+        controller = AdaptiveConcurrency(initial=2, maximum=32)
+
+        limits = SimulatedOrigin(capacity=1000).run(controller, 200)
+
+        self.assertEqual(limits[:3], [2, 2, 2])
+        self.assertEqual(controller.limit, 32)
+        self.assertEqual(controller.decreases, 0)
+
+    def test_backs_off_when_origin_queues(self):
+        """Test a latency spike over the baseline keeps the limit near capacity"""
+        controller = AdaptiveConcurrency(initial=2, maximum=64)
+
+        limits = SimulatedOrigin(capacity=8).run(controller, 500)
+
+        # p95 doubles at 17 in flight, which halves the limit
+        self.assertEqual(controller.peak, 17)
+        self.assertTrue(all(8 <= limit <= 17 for limit in limits[-100:]))
+        self.assertGreater(controller.decreases, 1)
+
+    def test_latency_ceiling(self):
+        """Test the limit never settles where p95 exceeds the ceiling"""
+        controller = AdaptiveConcurrency(
+            initial=2, maximum=64, latency_ceiling=1.0, spike_ratio=100
+        )
+
+        SimulatedOrigin(capacity=1, latency=0.1).run(controller, 500)
+
+        self.assertEqual(controller.peak, 11)
+        self.assertLessEqual(controller.limit, 11)
+
+    def test_backs_off_sharply_on_errors(self):
+        """Test 5xx responses halve the limit within a window"""
+        controller = AdaptiveConcurrency(initial=2, maximum=64, spike_ratio=100)
+
+        SimulatedOrigin(capacity=1000, overload=10).run(controller, 500)
+
+        self.assertEqual(controller.peak, 11)
+        self.assertGreater(controller.decreases, 1)
+
+        controller = AdaptiveConcurrency(initial=20)
+        for _ in range(2):
+            controller.record({"success": False, "status": None})
+        self.assertEqual(controller.limit, 10)
+
+    def test_slower_pages_are_not_overload(self):
+        """Test a run moving from cached to uncached pages keeps its limit"""
+
+        def feed(controller, pages):
+            for x_cache, elapsed, count in pages:
+                for _ in range(count):
+                    controller.record(
+                        {
+                            "success": True,
+                            "status": 200,
+                            "x_cache": x_cache,
+                            "elapsed": elapsed,
+                        }
+                    )
+
+        # Latency does not depend on the load, only on the page
+        controller = AdaptiveConcurrency(initial=5, maximum=25)
+        feed(controller, [("HIT", 0.01, 300), ("HIT", 0.01, 5), ("MISS", 0.3, 5)] * 3)
+        feed(controller, [("MISS", 0.3, 1000)])
+
+        self.assertEqual(controller.decreases, 0)
+        self.assertEqual(controller.limit, 25)
+
+        # Without a cache status to tell them apart the shift costs one decrease
+        controller = AdaptiveConcurrency(initial=5, maximum=25)
+        feed(controller, [("", 0.01, 300), ("", 0.3, 1000)])
+
+        self.assertEqual(controller.decreases, 1)
+        self.assertEqual(controller.limit, 25)
+
+    def test_threaded_warming_follows_limit(self):
+        """Test threaded warming keeps in flight what the controller allows"""
+        import threading
+        import time
+
+        lock = threading.Lock()
+        in_flight = [0]
+        most_in_flight = [0]
+
+        def fake_warm(url, *args, **kwargs):
+            with lock:
+                in_flight[0] += 1
+                most_in_flight[0] = max(most_in_flight[0], in_flight[0])
+                load = in_flight[0]
+            # Four workers, past that requests wait for a free one
+            elapsed = 0.01 * max(1.0, load / 4)
+            time.sleep(elapsed)
+            with lock:
+                in_flight[0] -= 1
+            return {"url": url, "success": True, "status": 200, "elapsed": elapsed}
+
+        controller = AdaptiveConcurrency(initial=2, maximum=32, window=10)
+        urls = [f"http://example.com/page{i}" for i in range(300)]
+        with patch("warmer.warm_url", side_effect=fake_warm):
+            results = process_urls_threaded(urls, adaptive=controller)
+
+        self.assertEqual(len(results), 300)
+        self.assertGreater(controller.decreases, 0)
+        self.assertLessEqual(most_in_flight[0], controller.peak)
+        self.assertLess(controller.peak, 32)
+
+
+def failed_result(url, status=None):
+    return {
+        "url": url,
+        "status": status,
+        "success": status is not None,
+        "x_cache": "MISS",
+    }
+
+
+class TestRetries(unittest.TestCase):
+    def test_retry_policy_statuses(self):
+        """Test errors and listed statuses are retried up to the limit"""
+        policy = RetryPolicy(retries=2)
+
+        self.assertTrue(policy.should_retry(failed_result("u"), 1))
+        self.assertTrue(policy.should_retry(failed_result("u", 503), 2))
+        self.assertFalse(policy.should_retry(failed_result("u", 503), 3))
+        self.assertFalse(policy.should_retry(failed_result("u", 404), 1))
+        self.assertFalse(policy.should_retry(failed_result("u", 200), 1))
+
+    def test_retry_policy_jittered_backoff(self):
+        """Test the wait doubles per attempt, is capped and jittered"""
+        policy = RetryPolicy(backoff=1.0, max_backoff=5.0, random=lambda: 0.5)
+
+        self.assertEqual(
+            [policy.delay(attempt) for attempt in (1, 2, 3, 4)], [0.5, 1.0, 2.0, 2.5]
+        )
+
+    def test_warm_with_retries_recovers(self):
+        """Test a transient 502 is retried until the page is warm"""
+        responses = [
+            failed_result("u", 502),
+            failed_result("u"),
+            failed_result("u", 200),
+        ]
+        slept = []
+        policy = RetryPolicy(retries=3, sleep=slept.append, random=lambda: 1.0)
+
+        result = warm_with_retries("http://a/1", lambda url: responses.pop(0), policy)
+
+        self.assertEqual(result["status"], 200)
+        self.assertEqual(result["attempts"], 3)
+        self.assertEqual(slept, [1.0, 2.0])
+
+    def test_warm_with_retries_gives_up(self):
+        """Test the last failure is returned once retries are used up"""
+        calls = []
+        policy = RetryPolicy(retries=2, sleep=lambda seconds: None)
+
+        result = warm_with_retries(
+            "http://a/1",
+            lambda url: calls.append(url) or failed_result(url, 503),
+            policy,
+        )
+
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(result["status"], 503)
+        self.assertEqual(result["attempts"], 3)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_after_consecutive_failures(self):
+        """Test a host fails fast after enough failures in a row, others do not"""
+        breaker = CircuitBreaker(failures=3, clock=FakeClock())
+
+        with patch("builtins.print"):
+            for result in (failed_result("x"), failed_result("x", 200)) + (
+                failed_result("x", 502),
+            ) * 3:
+                self.assertTrue(breaker.allow("http://a.com/1"))
+                breaker.record("http://a.com/1", result)
+
+        self.assertFalse(breaker.allow("http://a.com/2"))
+        self.assertTrue(breaker.allow("http://b.com/1"))
+        self.assertEqual(breaker.trips, 1)
+
+    def test_single_probe_after_reset_timeout(self):
+        """Test one probe is let through after the timeout and closes the circuit"""
+        clock = FakeClock()
+        breaker = CircuitBreaker(failures=1, reset_timeout=30, clock=clock)
+        with patch("builtins.print"):
+            breaker.record("http://a.com/1", failed_result("x"))
+
+        clock.now = 29
+        self.assertFalse(breaker.allow("http://a.com/1"))
+        clock.now = 30
+        self.assertTrue(breaker.allow("http://a.com/1"))
+        self.assertFalse(breaker.allow("http://a.com/2"))
+
+        breaker.record("http://a.com/1", failed_result("x"))
+        self.assertFalse(breaker.allow("http://a.com/2"))
+        clock.now = 60
+        self.assertTrue(breaker.allow("http://a.com/2"))
+        breaker.record("http://a.com/2", failed_result("x", 200))
+        self.assertTrue(breaker.allow("http://a.com/3"))
+        self.assertTrue(breaker.allow("http://a.com/4"))
+
+    def test_dead_host_fails_fast(self):
+        """Test URLs of a down host stop costing requests once the circuit opens"""
+        requested = []
+
+        def fake_warm(url, *args, **kwargs):
+            requested.append(url)
+            return failed_result(url)
+
+        urls = [f"http://down.com/{i}" for i in range(100)]
+        with patch("warmer.warm_url", side_effect=fake_warm), patch("builtins.print"):
+            results = process_urls_threaded(
+                urls,
+                use_threads=False,
+                retry_policy=RetryPolicy(retries=1, sleep=lambda seconds: None),
+                breaker=CircuitBreaker(failures=5),
+            )
+
+        self.assertEqual(len(requested), 5)
+        self.assertEqual(len(results), 100)
+        self.assertTrue(all(result.get("circuit_open") for result in results[3:]))
+
+
+class TestHealthMonitor(unittest.TestCase):
+    def test_status_page_parsers(self):
+        """Test nginx stub_status, PHP-FPM status and loadavg signals are read"""
+        import tempfile
+
+        self.assertEqual(
+            parse_nginx_stub_status(
+                "Active connections: 291 \nserver accepts handled requests\n"
+                " 16630948 16630948 31070465 \nReading: 6 Writing: 179 Waiting: 106 \n"
+            ),
+            291,
+        )
+        self.assertEqual(
+            parse_fpm_status("pool:                 www\nactive processes:     12\n"),
+            12,
+        )
+        self.assertEqual(parse_fpm_status('{"pool":"www","active processes":7}'), 7)
+        with self.assertRaises(ValueError):
+            parse_fpm_status("<html>Not found</html>")
+        with tempfile.NamedTemporaryFile("w", suffix="loadavg") as f:
+            f.write("3.52 2.10 1.04 4/812 12345\n")
+            f.flush()
+            self.assertEqual(read_loadavg(f.name), 3.52)
+
+    def test_http_probes_real_server(self):
+        """Test nginx and latency checks against a real status server"""
+        import socket
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = b"ok"
+                if self.path == "/nginx_status":
+                    body = (
+                        b"Active connections: 42 \nserver accepts handled requests\n"
+                        b" 1 1 1 \nReading: 0 Writing: 1 Waiting: 41 \n"
+                    )
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        base = f"http://127.0.0.1:{server.server_address[1]}"
+        # A port nothing listens on
+        with socket.socket() as unused:
+            unused.bind(("127.0.0.1", 0))
+            closed = f"http://127.0.0.1:{unused.getsockname()[1]}/health"
+
+        with create_session() as session:
+            probes = {
+                spec: parse_health_check(spec, session, timeout=2)[2]
+                for spec in (
+                    f"nginx=10@{base}/nginx_status",
+                    f"latency=1@{base}/health",
+                    f"latency=1@{closed}",
+                )
+            }
+            # Probes run on the monitor's own thread
+            values = {}
+            thread = threading.Thread(
+                target=lambda: values.update(
+                    {spec: probe() for spec, probe in probes.items()}
+                )
+            )
+            thread.start()
+            thread.join()
+
+        self.assertEqual(values[f"nginx=10@{base}/nginx_status"], 42)
+        self.assertLess(values[f"latency=1@{base}/health"], 1)
+        self.assertEqual(values[f"latency=1@{closed}"], float("inf"))
+
+    def test_parse_health_check(self):
+        """Test check specs are parsed and a failing status URL counts as busy"""
+        import requests
+
+        session = MagicMock()
+        session.get.side_effect = requests.ConnectionError("refused")
+        label, threshold, probe = parse_health_check(
+            "latency=1.5@http://shop/health_check.php", session
+        )
+
+        self.assertEqual(label, "latency http://shop/health_check.php")
+        self.assertEqual(threshold, 1.5)
+        self.assertEqual(probe(), float("inf"))
+        self.assertEqual(parse_health_check("load=8", session)[0], "load /proc/loadavg")
+        for spec in ("cpu=1", "nginx=200", "load=high"):
+            with self.assertRaises(ValueError):
+                parse_health_check(spec, session)
+
+    def test_pauses_and_resumes_with_hysteresis(self):
+        """Test sending pauses at the threshold and resumes below the resume share"""
+        clock = FakeClock()
+        signal = [50]
+        lines = []
+        monitor = HealthMonitor(
+            [("nginx", 100, lambda: signal[0])], clock=clock, out=lines.append
+        )
+
+        monitor.check()
+        self.assertFalse(monitor.is_paused())
+        signal[0] = 120
+        monitor.check()
+        self.assertTrue(monitor.is_paused())
+        clock.now = 30
+        signal[0] = 90
+        monitor.check()
+        self.assertTrue(monitor.is_paused())
+        self.assertEqual(monitor.paused_time(), 30)
+        clock.now = 75
+        signal[0] = 70
+        monitor.check()
+
+        self.assertFalse(monitor.is_paused())
+        self.assertEqual(monitor.paused_time(), 75)
+        self.assertEqual(monitor.pauses, 1)
+        self.assertEqual(
+            lines,
+            [
+                "Origin busy, pausing: nginx at 120 (limit 100)",
+                "Origin recovered, resuming after 1m 15s paused",
+            ],
+        )
+
+    def test_failing_check_is_ignored(self):
+        """Test a check that cannot be measured neither pauses nor blocks resuming"""
+        lines = []
+
+        def broken():
+            raise ValueError("not an nginx stub_status page")
+
+        monitor = HealthMonitor([("nginx", 100, broken)], out=lines.append)
+        monitor.check()
+
+        self.assertFalse(monitor.is_paused())
+        self.assertEqual(
+            lines, ["Health check nginx failed: not an nginx stub_status page"]
+        )
+
+    def test_no_request_is_sent_while_paused(self):
+        """Test workers wait for the origin to recover before sending"""
+        import threading
+        import time
+
+        signal = [5.0]
+        monitor = HealthMonitor([("load", 4, lambda: signal[0])], out=lambda line: None)
+        monitor.check()
+        sent = []
+        resumed = []
+
+        def recover():
+            time.sleep(0.2)
+            signal[0] = 1.0
+            resumed.append(time.monotonic())
+            monitor.check()
+
+        def fake_warm(url, *args, **kwargs):
+            sent.append(time.monotonic())
+            return {"url": url, "success": True, "x_cache": "HIT"}
+
+        threading.Thread(target=recover).start()
+        with patch("warmer.warm_url", side_effect=fake_warm):
+            results = process_urls_threaded(
+                [f"http://a.com/{i}" for i in range(10)], max_workers=3, health=monitor
+            )
+
+        self.assertEqual(len(results), 10)
+        self.assertGreaterEqual(min(sent), resumed[0])
+        self.assertGreaterEqual(monitor.paused_time(), 0.2)
+
+
+class TestProgressReporter(unittest.TestCase):
+    def test_progress_format_with_rate_and_eta(self):
+        """Test the progress line shows done, in flight, rate and ETA"""
+        clock = FakeClock()
+        progress = ProgressReporter(total=1000, clock=clock)
+        for _ in range(10):
+            progress.request_started()
+        for _ in range(100):
+            progress.completed()
+        clock.now = 10
+
+        self.assertEqual(
+            progress.format(),
+            "Progress: 100/1000 done, 10 in flight, 10.0 URLs/s, ETA 1m 30s",
+        )
+
+    def test_progress_format_without_total(self):
+        """Test the progress line omits the ETA when the total is unknown"""
+        clock = FakeClock()
+        progress = ProgressReporter(clock=clock)
+
+        self.assertEqual(progress.format(), "Progress: 0 done, 0 in flight, 0.0 URLs/s")
+
+    def test_progress_reports_periodically(self):
+        """Test reports are printed from the background thread"""
+        lines = []
+        with ProgressReporter(
+            total=1, interval=0.01, out=lambda line, **kw: lines.append(line)
+        ):
+            import time
+
+            time.sleep(0.1)
+
+        self.assertTrue(lines)
+
+    def test_format_duration(self):
+        """Test durations are formatted with the largest sensible unit"""
+        self.assertEqual(format_duration(5), "5s")
+        self.assertEqual(format_duration(125), "2m 05s")
+        self.assertEqual(format_duration(3723), "1h 02m 03s")
+
+
+class TestStageStats(unittest.TestCase):
+    def test_stage_stats_counts_incrementally(self):
+        """Test HIT/MISS counting one result at a time"""
+        stats = StageStats()
+        stats.add({"success": True, "x_cache": "HIT"})
+        stats.add({"success": True, "x_cache": "miss"})
+        stats.add({"success": True, "x_cache": "Not found"})
+        stats.add({"success": False, "x_cache": "MISS"})
+
+        self.assertEqual(stats.processed, 4)
+        self.assertEqual(stats.hit_count, 1)
+        self.assertEqual(stats.miss_count, 1)
+
+
+class TestWarmState(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.filename = os.path.join(self.tmpdir.name, "state.db")
+        self.clock = FakeClock()
+        self.clock.now = 1000.0
+
+    def open_state(self):
+        state = WarmState(self.filename, clock=self.clock)
+        self.addCleanup(state.db.close)
+        return state
+
+    def result(self, url, status=200, etag=None, last_modified=None):
+        return {
+            "url": url,
+            "status": status,
+            "success": True,
+            "x_cache": "MISS",
+            "etag": etag,
+            "last_modified": last_modified,
+        }
+
+    def test_state_persists_between_runs(self):
+        """Test warm times and validators are read back after reopening"""
+        state = self.open_state()
+        state.record("A", self.result("http://a/1", etag='"v1"'))
+        state.record("A", {"url": "http://a/2", "status": None, "success": False})
+        state.record("A", self.result("http://a/3", status=503))
+        state.close()
+
+        state = self.open_state()
+        self.assertEqual(state.get("A", "http://a/1"), (1000.0, '"v1"', None))
+        self.assertIsNone(state.get("B", "http://a/1"))
+        self.assertIsNone(state.get("A", "http://a/2"))
+        self.assertIsNone(state.get("A", "http://a/3"))
+
+    def test_not_modified_keeps_validators(self):
+        """Test a 304 without validators refreshes the time only"""
+        state = self.open_state()
+        state.record("A", self.result("http://a/1", etag='"v1"', last_modified="Mon"))
+        self.clock.now = 2000.0
+        state.record("A", self.result("http://a/1", status=304))
+
+        self.assertEqual(state.get("A", "http://a/1"), (2000.0, '"v1"', "Mon"))
+
+    def test_plan_rewarm(self):
+        """Test recent unchanged URLs are skipped and the rest sent conditionally"""
+        state = self.open_state()
+        for url in ("http://a/recent", "http://a/changed"):
+            state.record("A", self.result(url, etag='"v1"'))
+        self.clock.now = 0.0
+        state.record("A", self.result("http://a/old", last_modified="Mon"))
+        self.clock.now = 1500.0
+
+        urls, url_headers, skipped = plan_rewarm(
+            ["http://a/new", "http://a/recent", "http://a/changed", "http://a/old"],
+            state,
+            "A",
+            max_age=1000,
+            lastmods={url_fingerprint("http://a/changed"): 1200.0},
+            conditional=True,
+        )
+
+        self.assertEqual(urls, ["http://a/new", "http://a/changed", "http://a/old"])
+        self.assertEqual(url_headers, {"http://a/old": {"If-Modified-Since": "Mon"}})
+        self.assertEqual(skipped, 1)
+
+
+class TestLatencyMetrics(unittest.TestCase):
+    def test_cache_status_uses_last_cache(self):
+        """Test chained x-cache headers are classified by the last cache"""
+        self.assertEqual(cache_status("HIT, MISS"), "MISS")
+        self.assertEqual(cache_status("MISS, HIT"), "HIT")
+        self.assertEqual(cache_status("hit"), "HIT")
+        self.assertEqual(cache_status("Not found"), "OTHER")
+
+    def test_histogram_percentiles(self):
+        """Test percentiles are within the bucket resolution"""
+        histogram = LatencyHistogram()
+        for millisecond in range(1, 1001):
+            histogram.add(millisecond / 1000)
+
+        for percent, expected in ((50, 0.5), (95, 0.95), (99, 0.99)):
+            self.assertAlmostEqual(
+                histogram.percentile(percent), expected, delta=expected * 0.05
+            )
+        self.assertEqual(histogram.percentile(100), 1.0)
+        self.assertIsNone(LatencyHistogram().percentile(50))
+
+    def test_stage_stats_breakdowns(self):
+        """Test latencies are split by status and cache status, slowest first"""
+        stats = StageStats()
+        for i in range(20):
+            stats.add(
+                {
+                    "url": f"http://a/{i}",
+                    "success": True,
+                    "status": 200 if i % 2 else 503,
+                    "x_cache": "HIT, MISS" if i % 4 else "MISS, HIT",
+                    "elapsed": i / 10,
+                    "bytes": 100,
+                }
+            )
+        stats.add(
+            {"url": "http://a/x", "success": False, "x_cache": "MISS", "elapsed": 5.0}
+        )
+
+        report = stats.to_dict()
+
+        self.assertEqual(report["by_status"]["200"]["count"], 10)
+        self.assertEqual(report["by_status"]["error"]["count"], 1)
+        self.assertEqual(report["by_cache_status"]["MISS"]["count"], 15)
+        self.assertEqual(report["by_cache_status"]["HIT"]["count"], 5)
+        self.assertEqual(report["bytes"], 2000)
+        self.assertEqual(
+            [entry["url"] for entry in report["slowest"][:3]],
+            ["http://a/x", "http://a/19", "http://a/18"],
+        )
+        self.assertEqual(len(report["slowest"]), StageStats.SLOWEST)
+        self.assertEqual(stats.hit_count, 5)
+        self.assertEqual(stats.miss_count, 15)
+
+    def test_build_report_totals(self):
+        """Test stage reports are summed and empty stages left out"""
+        first = StageStats()
+        first.add(
+            {"url": "http://a/1", "success": True, "x_cache": "HIT", "elapsed": 0.1}
+        )
+        second = StageStats()
+        second.add(
+            {"url": "http://b/1", "success": True, "x_cache": "MISS", "elapsed": 0.2}
+        )
+
+        report = build_report([(1, "A", first), (2, "B", None), (3, "C", second)], 1.5)
+
+        self.assertEqual([stage["name"] for stage in report["stages"]], ["A", "C"])
+        self.assertEqual(report["totals"]["processed"], 2)
+        self.assertEqual(report["totals"]["hit"], 1)
+        self.assertEqual(report["duration"], 1.5)
+
+
+class TestMetrics(unittest.TestCase):
+    def result(self, elapsed, status=200, x_cache="HIT"):
+        return {
+            "url": "http://a/",
+            "success": status is not None,
+            "status": status,
+            "x_cache": x_cache,
+            "elapsed": elapsed,
+            "bytes": 100,
+        }
+
+    def test_render_counters_and_histogram(self):
+        """Test requests are counted by labels and durations bucketed cumulatively"""
+        metrics = Metrics(clock=lambda: 1700000000.0)
+        stage = metrics.stage('Logged "in"')
+        stage.start(3)
+        for _ in range(3):
+            stage.request_started()
+        for _ in range(2):
+            stage.request_finished()
+        stage.observe(self.result(0.07))
+        stage.observe(self.result(0.3, x_cache="HIT, MISS"))
+
+        text = metrics.render()
+
+        self.assertIn(
+            'warmer_requests_total{stage="Logged \\"in\\"",status="200",cache_status="HIT"} 1',
+            text,
+        )
+        self.assertIn('warmer_requests_in_flight{stage="Logged \\"in\\""} 1', text)
+        self.assertIn(
+            'warmer_request_duration_seconds_bucket{stage="Logged \\"in\\"",'
+            'cache_status="HIT",le="0.05"} 0',
+            text,
+        )
+        self.assertIn(
+            'warmer_request_duration_seconds_bucket{stage="Logged \\"in\\"",'
+            'cache_status="HIT",le="0.1"} 1',
+            text,
+        )
+        self.assertIn(
+            'warmer_request_duration_seconds_count{stage="Logged \\"in\\"",'
+            'cache_status="MISS"} 1',
+            text,
+        )
+        self.assertIn("warmer_run_start_timestamp_seconds 1700000000.0", text)
+        self.assertNotIn("warmer_run_end_timestamp_seconds", text)
+
+        metrics.finish(True)
+        self.assertIn("warmer_run_success 1", metrics.render())
+
+    def test_failed_requests(self):
+        """Test failed requests are counted with an error status"""
+        metrics = Metrics()
+        metrics.stage("A").observe(self.result(1.0, status=None))
+
+        self.assertIn(
+            'warmer_requests_total{stage="A",status="error",cache_status="none"} 1',
+            metrics.render(),
+        )
+
+    def test_metrics_endpoint(self):
+        """Test /metrics is served and other paths are not"""
+        import urllib.error
+        import urllib.request
+
+        metrics = Metrics()
+        metrics.stage("A").observe(self.result(0.1))
+        server = start_metrics_server(metrics, 0, "127.0.0.1")
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+        with urllib.request.urlopen(f"{base_url}/metrics") as response:
+            body = response.read().decode()
+            content_type = response.headers["Content-Type"]
+
+        self.assertIn('warmer_requests_total{stage="A"', body)
+        self.assertTrue(content_type.startswith("text/plain; version=0.0.4"))
+        with self.assertRaises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{base_url}/other")
+
+
+class TestSharding(unittest.TestCase):
+    def test_shard_of_is_stable_and_balanced(self):
+        """Test URLs spread evenly and the shard ignores scheme and host case"""
+        urls = [f"https://shop.example/product-{i}.html" for i in range(8000)]
+        counts = [0] * 4
+        for url in urls:
+            counts[shard_of(url, 4)] += 1
+
+        for count in counts:
+            self.assertGreater(count, 1800)
+            self.assertLess(count, 2200)
+        self.assertEqual(
+            shard_of("HTTPS://Shop.Example/Product-1.html", 4),
+            shard_of("https://shop.example/Product-1.html", 4),
+        )
+
+    def test_adding_a_shard_only_moves_urls_to_it(self):
+        """Test going from 4 to 5 shards leaves every other URL in place"""
+        moved = 0
+        for i in range(5000):
+            url = f"https://shop.example/{i}"
+            before, after = shard_of(url, 4), shard_of(url, 5)
+            if before != after:
+                self.assertEqual(after, 4)
+                moved += 1
+        self.assertGreater(moved, 700)
+        self.assertLess(moved, 1300)
+
+    def test_parse_shard_and_address(self):
+        """Test --shard and address values are parsed and checked"""
+        self.assertEqual(parse_shard("2/4"), (2, 4))
+        for value in ("0/4", "5/4", "2", "a/b"):
+            with self.assertRaises(ValueError):
+                parse_shard(value)
+        self.assertEqual(parse_address("warm-1:7070"), ("warm-1", 7070))
+        self.assertEqual(parse_address("7070", "0.0.0.0"), ("0.0.0.0", 7070))
+        with self.assertRaises(ValueError):
+            parse_address("7070")
+
+    def test_workers_warm_every_url_exactly_once(self):
+        """Test a coordinator and 3 worker processes warm each URL once"""
+        import json
+        import socket
+        import subprocess
+        import tempfile
+        import threading
+        from collections import Counter
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        import warmer
+
+        served = Counter()
+        lock = threading.Lock()
+
+        class CountingHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                with lock:
+                    served[self.path] += 1
+                self.send_response(200)
+                self.send_header("Content-Length", "2")
+                self.send_header("x-cache", "MISS")
+                self.end_headers()
+                self.wfile.write(b"ok")
+
+            def log_message(self, format, *args):
+                pass
+
+        origin = ThreadingHTTPServer(("127.0.0.1", 0), CountingHandler)
+        origin.daemon_threads = True
+        threading.Thread(target=origin.serve_forever, daemon=True).start()
+        self.addCleanup(origin.server_close)
+        self.addCleanup(origin.shutdown)
+        base_url = f"http://127.0.0.1:{origin.server_address[1]}"
+        urls = [f"{base_url}/page-{i}" for i in range(300)]
+
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        config_file = os.path.join(tmpdir.name, "config.json")
+        with open(config_file, "w") as f:
+            json.dump(
+                [{"name": "Guest", "website_base_url": base_url, "headers": {}}], f
+            )
+
+        server = socket.create_server(("127.0.0.1", 0))
+        self.addCleanup(server.close)
+        port = server.getsockname()[1]
+        workers = [
+            subprocess.Popen(
+                [
+                    sys.executable,
+                    warmer.__file__,
+                    "--worker",
+                    f"127.0.0.1:{port}",
+                    "--json-config",
+                    config_file,
+                    "--progress-interval",
+                    "0",
+                    "--retries",
+                    "0",
+                ],
+                stdout=subprocess.DEVNULL,
+            )
+            for _ in range(3)
+        ]
+        try:
+            merged, unfinished = run_coordinator(server, 3, urls)
+        finally:
+            for worker in workers:
+                worker.wait(timeout=60)
+
+        self.assertEqual(unfinished, [])
+        self.assertEqual([worker.returncode for worker in workers], [0, 0, 0])
+        self.assertEqual(merged[1].processed, 300)
+        self.assertEqual(merged[1].miss_count, 300)
+        self.assertEqual(set(served), {f"/page-{i}" for i in range(300)})
+        self.assertEqual(set(served.values()), {1})
+
+    def test_coordinator_stops_waiting_for_missing_workers(self):
+        """Test shards of workers that never connect are reported unfinished"""
+        import socket
+
+        server = socket.create_server(("127.0.0.1", 0))
+        self.addCleanup(server.close)
+
+        with patch("builtins.print") as printed:
+            merged, unfinished = run_coordinator(
+                server, 2, ["http://a.com/1", "http://a.com/2"], connect_timeout=0.1
+            )
+
+        self.assertEqual((merged, unfinished), ({}, [1, 2]))
+        self.assertIn("Only 0 of 2 workers connected", printed.call_args.args[0])
+
+
+class TestFollow(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def open_index(self):
+        state = WarmState(os.path.join(self.tmpdir.name, "state.db"))
+        self.addCleanup(state.db.close)
+        return state
+
+    def test_cache_tags(self):
+        """Test tags are read from X-Magento-Tags or Surrogate-Key"""
+        self.assertEqual(
+            cache_tags({"x-magento-tags": "cat_p_1, cat_c_2,store"}),
+            ["cat_p_1", "cat_c_2", "store"],
+        )
+        self.assertEqual(
+            cache_tags({"surrogate-key": "cat_p_1 store"}), ["cat_p_1", "store"]
+        )
+        self.assertIsNone(cache_tags({"x-cache": "HIT"}))
+
+    def test_tag_index(self):
+        """Test pages are found by their tags, per configuration, latest tags only"""
+        index = self.open_index()
+        page = {"url": "http://a/1", "status": 200, "success": True, "x_cache": "MISS"}
+        index.record("Guest", {**page, "tags": ["cat_p_1", "store"]})
+        index.record(
+            "Guest", {**page, "url": "http://a/2", "tags": ["cat_p_2", "store"]}
+        )
+        index.record("Wholesale", {**page, "tags": ["cat_p_1"]})
+        index.record("Guest", {**page, "tags": ["cat_p_3"]})
+        index.record("Guest", {**page, "status": 304, "tags": []})
+        index.commit()
+
+        self.assertEqual(
+            index.urls_for_tags(["cat_p_1"]), {"Wholesale": {"http://a/1"}}
+        )
+        self.assertEqual(index.urls_for_tags(["cat_p_3"]), {"Guest": {"http://a/1"}})
+        self.assertEqual(
+            index.urls_for_tags(["store", "missing"], chunk_size=1),
+            {"Guest": {"http://a/2"}},
+        )
+
+    def test_parse_change_event(self):
+        """Test feed lines with URLs and tags, bare URLs and junk"""
+        self.assertEqual(
+            parse_change_event(
+                '{"urls": ["http://a/1", "not a url"], "tag": "cat_p_1"}'
+            ),
+            (["http://a/1"], ["cat_p_1"]),
+        )
+        self.assertEqual(parse_change_event("http://a/2\n"), (["http://a/2"], []))
+        for line in ("", "garbage", "[1, 2]", '{"other": 1}'):
+            self.assertIsNone(parse_change_event(line))
+
+    def test_bursts_are_coalesced(self):
+        """Test events close together become one batch, later ones the next"""
+        import queue
+        import threading
+        import time
+
+        lines = queue.Queue()
+        for line in (
+            '{"tags": ["cat_p_1"]}',
+            "http://a/1",
+            "junk",
+            '{"tags": ["cat_p_1"]}',
+        ):
+            lines.put(line)
+        stop = threading.Event()
+        batches = iter_change_batches(lines, quiet=0.1, max_wait=0.4, stop=stop)
+
+        self.assertEqual(next(batches), ({"http://a/1"}, {"cat_p_1"}))
+
+        def trickle():
+            # Never quiet for long, the batch is closed by max_wait
+            for i in range(20):
+                lines.put(f"http://a/{i}")
+                time.sleep(0.05)
+
+        threading.Thread(target=trickle).start()
+        started = time.monotonic()
+        urls, tags = next(batches)
+        self.assertLess(time.monotonic() - started, 0.8)
+        self.assertLess(len(urls), 20)
+        stop.set()
+
+    def test_change_stages(self):
+        """Test URLs go to their host's configurations, tags to their configs"""
+        index = self.open_index()
+        index.record(
+            "Wholesale",
+            {
+                "url": "http://a.com/p",
+                "status": 200,
+                "success": True,
+                "tags": ["cat_p_1"],
+            },
+        )
+        configurations = [
+            {"name": "Guest", "website_base_url": "a.com", "headers": {}},
+            {"name": "Wholesale", "website_base_url": "a.com", "headers": {}},
+            {"name": "Other", "website_base_url": "b.com", "headers": {}},
+        ]
+
+        stages = change_stages(
+            configurations, {"http://a.com/x"}, {"cat_p_1"}, index=index
+        )
+
+        self.assertEqual(
+            [(number, config["name"], urls) for number, config, urls in stages],
+            [
+                (1, "Guest", ["http://a.com/x"]),
+                (2, "Wholesale", ["http://a.com/p", "http://a.com/x"]),
+            ],
+        )
+
+    def test_follow_file_tails_appends_and_rotation(self):
+        """Test only lines appended after start are read, also after rotation"""
+        import queue
+        import threading
+
+        filename = os.path.join(self.tmpdir.name, "changes.jsonl")
+        with open(filename, "w") as f:
+            f.write("http://a/old\n")
+        lines = queue.Queue()
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=follow_file, args=(filename, lines, stop, 0.01), daemon=True
+        )
+        thread.start()
+        self.addCleanup(stop.set)
+
+        import time
+
+        time.sleep(0.05)
+        with open(filename, "a") as f:
+            f.write("http://a/1\nhttp://a/par")
+        self.assertEqual(lines.get(timeout=2), "http://a/1")
+        with open(filename, "a") as f:
+            f.write("tial\n")
+        self.assertEqual(lines.get(timeout=2), "http://a/partial")
+
+        os.rename(filename, filename + ".1")
+        with open(filename, "w") as f:
+            f.write("http://a/rotated\n")
+        self.assertEqual(lines.get(timeout=2), "http://a/rotated")
+
+    def test_change_feed_socket(self):
+        """Test lines sent to the TCP change feed reach the queue"""
+        import queue
+        import socket
+
+        lines = queue.Queue()
+        server = serve_change_feed(("127.0.0.1", 0), lines)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        with socket.create_connection(server.server_address) as connection:
+            connection.sendall(b'{"tags": ["cat_p_1"]}\nhttp://a/1\n')
+
+        self.assertEqual(lines.get(timeout=2), '{"tags": ["cat_p_1"]}\n')
+        self.assertEqual(lines.get(timeout=2), "http://a/1\n")
+
+
+class TestServe(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_import_skips_requests_and_asyncio(self):
+        """Test importing the warmer does not load modules only some modes need"""
+        import subprocess
+        import warmer
+
+        deferred = [
+            "requests",
+            "asyncio",
+            "http.server",
+            "socketserver",
+            "sqlite3",
+            "xml.etree.ElementTree",
+        ]
+        code = (
+            "import sys; sys.path.insert(0, sys.argv[1]); import warmer; "
+            "print(*[name for name in sys.argv[2:] if name in sys.modules])"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", code, os.path.dirname(warmer.__file__), *deferred],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+
+        self.assertEqual(output.split(), [])
+
+    def test_load_settings_reuses_unchanged_file(self):
+        """Test a worker parses a configuration again only once it changed"""
+        import warmer
+
+        path = self.write_file("config.json", '[{"name": "A", "headers": {}}]')
+        with patch.object(warmer, "_settings_cache", {}):
+            first = load_settings(path)
+            self.assertIs(load_settings(path), first)
+
+            self.write_file("config.json", '[{"name": "B", "headers": {}}]  ')
+            changed = load_settings(path)
+
+        self.assertIsNot(changed, first)
+        self.assertEqual(changed["configurations"][0]["name"], "B")
+
+    def test_load_settings_without_worker_reads_file(self):
+        """Test a single run keeps nothing between reads"""
+        path = self.write_file("config.json", '[{"name": "A", "headers": {}}]')
+
+        self.assertIsNot(load_settings(path), load_settings(path))
+
+    def test_job_output_sends_lines(self):
+        """Test job output is framed as JSON lines followed by the exit code"""
+        import io
+        import json
+        import warmer
+
+        wfile = io.BytesIO()
+        out = warmer._JobOutput(wfile)
+        out.write("first\nsec")
+        out.write("ond\n")
+        out.write("partial")
+        out.finish(3)
+
+        messages = [json.loads(line) for line in wfile.getvalue().splitlines()]
+        self.assertEqual(
+            messages,
+            [
+                {"output": "first"},
+                {"output": "second"},
+                {"output": "partial"},
+                {"exit": 3},
+            ],
+        )
+
+    def test_run_job_returns_exit_code(self):
+        """Test a job's exit code and usage errors are reported instead of exiting"""
+        from io import StringIO
+
+        out = StringIO()
+        self.assertEqual(run_job(["--bogus"], out), 2)
+        self.assertIn("unrecognized arguments: --bogus", out.getvalue())
+
+        out = StringIO()
+        self.assertEqual(
+            run_job(["--follow", "changes.jsonl", "--json-config", "c.json"], out), 1
+        )
+        self.assertIn("cannot run as a job", out.getvalue())
+
+    def test_serve_runs_jobs(self):
+        """Test a --serve worker runs every job sent to its socket"""
+        import json
+        import socket
+        import subprocess
+        import threading
+        import time
+        import warmer
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        served = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                served.append(self.path)
+                self.send_response(200)
+                self.send_header("Content-Length", "2")
+                self.send_header("x-cache", "MISS")
+                self.end_headers()
+                self.wfile.write(b"ok")
+
+            def log_message(self, format, *args):
+                pass
+
+        origin = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        origin.daemon_threads = True
+        threading.Thread(target=origin.serve_forever, daemon=True).start()
+        self.addCleanup(origin.server_close)
+        self.addCleanup(origin.shutdown)
+        base_url = f"http://127.0.0.1:{origin.server_address[1]}"
+
+        urls_file = self.write_file("urls.csv", f"{base_url}/page\n")
+        config_file = self.write_file(
+            "config.json",
+            json.dumps(
+                [{"name": "Guest", "website_base_url": base_url, "headers": {}}]
+            ),
+        )
+        socket_path = os.path.join(self.tmpdir.name, "worker.sock")
+        worker = subprocess.Popen(
+            [sys.executable, warmer.__file__, "--serve", socket_path],
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            deadline = time.monotonic() + 10
+            while not os.path.exists(socket_path) and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+            def send(argv):
+                with socket.socket(socket.AF_UNIX) as client:
+                    client.connect(socket_path)
+                    client.sendall((json.dumps({"argv": argv}) + "\n").encode())
+                    return [json.loads(line) for line in client.makefile("r")]
+
+            argv = [
+                "--files",
+                urls_file,
+                "--json-config",
+                config_file,
+                "--retries",
+                "0",
+            ]
+            for _ in range(2):
+                messages = send(argv)
+                self.assertEqual(messages[-1], {"exit": 0})
+                self.assertIn({"output": "Total Cache MISS: 1"}, messages)
+        finally:
+            worker.terminate()
+            worker.wait(timeout=10)
+
+        self.assertEqual(served, ["/page", "/page"])
+        self.assertFalse(os.path.exists(socket_path))
+
+
+class TestVariants(unittest.TestCase):
+    DIMENSIONS = [
+        {
+            "name": "device",
+            "header": "User-Agent",
+            "values": {"desktop": "D", "mobile": "M"},
+        },
+        {"cookie": "currency", "values": ["EUR", "USD", "GBP"]},
+    ]
+
+    def result(self, url, vary):
+        return {"url": url, "success": vary is not None, "vary": vary}
+
+    def test_vary_headers(self):
+        """Test the Vary header is split into lowercase header names"""
+        self.assertEqual(
+            vary_headers({"vary": "Accept-Encoding, User-Agent,"}),
+            ["accept-encoding", "user-agent"],
+        )
+        self.assertEqual(vary_headers({}), [])
+
+    def test_compile_variants(self):
+        """Test dimensions default their name and the Vary header they depend on"""
+        device, currency = compile_variants(self.DIMENSIONS)
+
+        self.assertEqual(
+            (device.name, device.target, device.vary),
+            ("device", "header", "user-agent"),
+        )
+        self.assertEqual(device.values, [("desktop", "D"), ("mobile", "M")])
+        self.assertEqual(
+            (currency.name, currency.target, currency.vary),
+            ("currency", "cookie", None),
+        )
+        self.assertEqual(
+            compile_variants([{"cookie": "c", "values": [None, "x"]}])[0].values,
+            [("none", None), ("x", "x")],
+        )
+
+    def test_compile_variants_invalid(self):
+        """Test malformed dimensions are rejected"""
+        for spec in (
+            {"header": "A"},
+            [{"header": "A", "cookie": "b", "values": ["1"]}],
+            [{"values": ["1"]}],
+            [{"header": "A", "values": []}],
+        ):
+            with self.subTest(spec=spec), self.assertRaises(ValueError):
+                compile_variants(spec)
+
+    def test_request_headers_and_cookies(self):
+        """Test variant headers and cookies merge, validators only go with the base"""
+        url_headers = {"http://a/1": {"If-None-Match": '"v1"'}}
+        base = VariantURL(
+            "http://a/1", (0, 0), "base", {"User-Agent": "D"}, {"currency": "EUR"}
+        )
+        other = VariantURL("http://a/1", (1, 0), "other", {"User-Agent": "M"}, {})
+
+        self.assertEqual(
+            request_headers({"Accept": "*/*"}, url_headers, base),
+            {"Accept": "*/*", "User-Agent": "D", "If-None-Match": '"v1"'},
+        )
+        self.assertEqual(
+            request_headers({"Accept": "*/*"}, url_headers, other),
+            {"Accept": "*/*", "User-Agent": "M"},
+        )
+        self.assertEqual(
+            request_cookies({"store": "de"}, base), {"store": "de", "currency": "EUR"}
+        )
+        self.assertEqual(request_cookies({"store": "de"}, other), {"store": "de"})
+        self.assertEqual(other, "http://a/1")
+
+    def test_planner_prunes_by_vary(self):
+        """Test only the dimensions named by Vary are expanded after the base variant"""
+        planner = VariantPlanner(compile_variants(self.DIMENSIONS))
+        sent = []
+        for url in planner.expand(["http://a/1", "http://a/2"]):
+            sent.append((str(url), url.combination))
+            if url.is_base:
+                vary = ["user-agent"] if url == "http://a/1" else []
+                planner.observe(self.result(url, vary))
+
+        self.assertEqual(len(sent), len(set(sent)))
+        self.assertEqual(sum(1 for url, _ in sent if url == "http://a/1"), 6)
+        self.assertEqual(
+            [combination for url, combination in sent if url == "http://a/2"],
+            [(0, 0), (0, 1), (0, 2)],
+        )
+        self.assertEqual((planner.urls, planner.requests, planner.pruned), (2, 9, 3))
+
+    def test_planner_failed_base_warms_everything(self):
+        """Test a URL whose base request failed is warmed in every combination"""
+        planner = VariantPlanner(compile_variants(self.DIMENSIONS))
+        sent = []
+        for url in planner.expand(["http://a/1"]):
+            sent.append(url)
+            if url.is_base:
+                planner.observe(self.result(url, None))
+
+        self.assertEqual(len(sent), 6)
+
+    def test_planner_leaves_late_variants_pending(self):
+        """Test variants of URLs whose base result came back late are drained later"""
+        planner = VariantPlanner(compile_variants(self.DIMENSIONS))
+        sent = list(planner.expand(["http://a/1", "http://a/2"]))
+        self.assertEqual([url.combination for url in sent], [(0, 0), (0, 0)])
+
+        planner.observe(self.result(sent[0], ["user-agent"]))
+        planner.observe(self.result(sent[1], []))
+        # A repeated result must not queue the same variants again
+        planner.observe(self.result(sent[1], []))
+        late = [(str(url), url.combination) for url in planner.drain()]
+
+        self.assertEqual(len(late), 5 + 2)
+        self.assertEqual(len(set(late)), 7)
+        self.assertFalse(planner.pending)
+
+    def test_main_warms_variants(self):
+        """Test main warms every variant through one stage"""
+        import json
+        import tempfile
+        from io import StringIO
+
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        csv_file = os.path.join(tmpdir.name, "urls.csv")
+        with open(csv_file, "w") as f:
+            f.write("http://a.com/product\nhttp://a.com/cms\n")
+        config_file = os.path.join(tmpdir.name, "config.json")
+        with open(config_file, "w") as f:
+            json.dump(
+                [
+                    {
+                        "name": "Store",
+                        "website_base_url": "a.com",
+                        "headers": {"Accept": "text/html"},
+                        "cookies": {"store": "default"},
+                        "variants": self.DIMENSIONS,
+                    }
+                ],
+                f,
+            )
+        sent = []
+
+        def fake_warm(url, headers=None, cookies=None, *args, **kwargs):
+            sent.append(
+                (
+                    str(url),
+                    headers["User-Agent"],
+                    headers["Accept"],
+                    cookies["currency"],
+                    cookies["store"],
+                )
+            )
+            vary = ["user-agent"] if url.endswith("product") else []
+            return {"url": url, "success": True, "x_cache": "MISS", "vary": vary}
+
+        output = StringIO()
+        argv = [
+            "warmer.py",
+            "--files",
+            csv_file,
+            "--json-config",
+            config_file,
+            "--progress-interval",
+            "0",
+        ]
+        with patch.object(sys, "argv", argv), patch("sys.stdout", output), patch(
+            "warmer.warm_url", side_effect=fake_warm
+        ):
+            main()
+
+        self.assertEqual(len(sent), len(set(sent)))
+        self.assertEqual(
+            sum(1 for entry in sent if entry[0] == "http://a.com/product"), 6
+        )
+        self.assertEqual(
+            {entry[1] for entry in sent if entry[0] == "http://a.com/cms"}, {"D"}
+        )
+        self.assertEqual(
+            {entry[2:] for entry in sent},
+            {("text/html", c, "default") for c in ("EUR", "USD", "GBP")},
+        )
+        self.assertIn(
+            "Variants: 9 requests for 2 URLs, 3 combinations skipped", output.getvalue()
+        )
+        self.assertIn("Total Cache MISS: 9", output.getvalue())
+
+
+class TestConcurrencyGate(unittest.TestCase):
+    def test_gate_global_limit(self):
+        """Test the global budget is shared by every host"""
+        gate = ConcurrencyGate(max_concurrency=2)
+
+        self.assertTrue(gate.acquire("http://a.com/1", blocking=False))
+        self.assertTrue(gate.acquire("http://b.com/1", blocking=False))
+        self.assertFalse(gate.acquire("http://c.com/1", blocking=False))
+
+        gate.release("http://a.com/1")
+        self.assertTrue(gate.acquire("http://c.com/1", blocking=False))
+
+    def test_gate_per_host_limit(self):
+        """Test a busy host does not use up the slots of other hosts"""
+        gate = ConcurrencyGate(max_concurrency=10, per_host=1)
+
+        self.assertTrue(gate.acquire("http://a.com/1", blocking=False))
+        self.assertFalse(gate.acquire("http://a.com/2", blocking=False))
+        self.assertTrue(gate.acquire("http://b.com/1", blocking=False))
+
+        gate.release("http://a.com/1")
+        self.assertTrue(gate.acquire("http://a.com/2", blocking=False))
+
+    def test_gate_failed_global_acquire_returns_host_slot(self):
+        """Test a refused request does not keep its host slot"""
+        gate = ConcurrencyGate(max_concurrency=1, per_host=1)
+        gate.acquire("http://a.com/1")
+
+        self.assertFalse(gate.acquire("http://b.com/1", blocking=False))
+        gate.release("http://a.com/1")
+        self.assertTrue(gate.acquire("http://b.com/1", blocking=False))
+
+
+class TestMain(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def run_main(self, *args):
+        from io import StringIO
+
+        output = StringIO()
+        with patch.object(sys, "argv", ["warmer.py", *args]), patch(
+            "sys.stdout", output
+        ):
+            main()
+        return output.getvalue()
+
+    def test_main_parallel_stages(self):
+        """Test stages overlap with --parallel-stages and totals still add up"""
+        import json
+        import threading
+        import time
+
+        csv_file = self.write_file(
+            "urls.csv",
+            "".join(f"http://a.com/{i}\nhttp://b.com/{i}\n" for i in range(10)),
+        )
+        config_file = self.write_file(
+            "config.json",
+            json.dumps(
+                [
+                    {"name": "A", "website_base_url": "a.com", "headers": {}},
+                    {"name": "B", "website_base_url": "b.com", "headers": {}},
+                ]
+            ),
+        )
+        lock = threading.Lock()
+        hosts_in_flight = set()
+        overlapped = []
+
+        def fake_warm(url, *args, **kwargs):
+            host = url.split("/")[2]
+            with lock:
+                hosts_in_flight.add(host)
+                if len(hosts_in_flight) > 1:
+                    overlapped.append(url)
+            time.sleep(0.01)
+            with lock:
+                hosts_in_flight.discard(host)
+            return {"url": url, "success": True, "x_cache": "HIT"}
+
+        with patch("warmer.warm_url", side_effect=fake_warm):
+            output = self.run_main(
+                "--files",
+                csv_file,
+                "--json-config",
+                config_file,
+                "--threads",
+                "1",
+                "--parallel-stages",
+                "2",
+                "--progress-interval",
+                "0",
+            )
+
+        self.assertTrue(overlapped)
+        self.assertIn("Total Cache HIT: 20", output)
+        self.assertIn("STAGE 2: B Configuration\nFINAL SUMMARY:", output)
+
+    def test_main_parallel_stages_async_gate(self):
+        """Test the default gate of async parallel stages follows --concurrency"""
+        import json
+
+        csv_file = self.write_file(
+            "urls.csv",
+            "".join(f"http://a.com/{i}\nhttp://b.com/{i}\n" for i in range(10)),
+        )
+        config_file = self.write_file(
+            "config.json",
+            json.dumps(
+                [
+                    {"name": "A", "website_base_url": "a.com", "headers": {}},
+                    {"name": "B", "website_base_url": "b.com", "headers": {}},
+                ]
+            ),
+        )
+
+        async def fake_warm(
+            session, url, headers=None, cookies=None, timeout=50, fetch_mode="stream"
+        ):
+            await asyncio.sleep(0.001)
+            return {"url": url, "success": True, "x_cache": "HIT"}
+
+        with patch("warmer.warm_url_async", fake_warm), patch(
+            "warmer.ConcurrencyGate", wraps=ConcurrencyGate
+        ) as gate_class:
+            output = self.run_main(
+                "--files",
+                csv_file,
+                "--json-config",
+                config_file,
+                "--engine",
+                "asyncio",
+                "--concurrency",
+                "7",
+                "--threads",
+                "1",
+                "--parallel-stages",
+                "2",
+                "--progress-interval",
+                "0",
+            )
+
+        self.assertEqual(gate_class.call_args.args, (14,))
+        self.assertIn("Total Cache HIT: 20", output)
+
+    def test_main_does_not_retry_by_default(self):
+        """Test failures cost one request each unless retries are asked for"""
+        import json
+
+        csv_file = self.write_file(
+            "urls.csv", "".join(f"http://a.com/{i}\n" for i in range(20))
+        )
+        config_file = self.write_file(
+            "config.json",
+            json.dumps([{"name": "A", "website_base_url": "a.com", "headers": {}}]),
+        )
+        warmed = []
+
+        def fake_warm(url, *args, **kwargs):
+            warmed.append(url)
+            return {"url": url, "success": False, "status_code": 503}
+
+        with patch("warmer.warm_url", side_effect=fake_warm):
+            self.run_main(
+                "--files",
+                csv_file,
+                "--json-config",
+                config_file,
+                "--progress-interval",
+                "0",
+            )
+
+        # Every URL was requested once, none failed fast on an open circuit
+        self.assertEqual(sorted(warmed), sorted(f"http://a.com/{i}" for i in range(20)))
+
+    def test_main_access_log_hottest_first(self):
+        """Test access log URLs are warmed most visited first without a CSV"""
+        import json
+
+        log_file = self.write_file(
+            "access.log",
+            log_line("/a") + log_line("/b") * 3 + log_line("/c") * 2,
+        )
+        config_file = self.write_file(
+            "config.json",
+            json.dumps(
+                [{"name": "A", "website_base_url": "shop.local", "headers": {}}]
+            ),
+        )
+        warmed = []
+
+        def fake_warm(url, *args, **kwargs):
+            warmed.append(url)
+            return {"url": url, "success": True, "x_cache": "MISS"}
+
+        with patch("warmer.warm_url", side_effect=fake_warm):
+            self.run_main(
+                "--access-log",
+                log_file,
+                "--access-log-base-url",
+                "http://shop.local",
+                "--json-config",
+                config_file,
+                "--without-async",
+                "1",
+                "--progress-interval",
+                "0",
+            )
+
+        self.assertEqual(
+            warmed,
+            ["http://shop.local/b", "http://shop.local/c", "http://shop.local/a"],
+        )
+
+    def test_main_state_db_skips_recent_and_sends_validators(self):
+        """Test a second run skips recent URLs and revalidates older ones"""
+        import json
+
+        csv_file = self.write_file("urls.csv", "http://a.com/1\nhttp://a.com/2\n")
+        config_file = self.write_file(
+            "config.json",
+            json.dumps([{"name": "A", "website_base_url": "a.com", "headers": {}}]),
+        )
+        state_db = os.path.join(self.tmpdir.name, "state.db")
+        sent_headers = {}
+
+        def fake_warm(url, headers=None, *args, **kwargs):
+            sent_headers[url] = headers
+            return {
+                "url": url,
+                "status": 304 if headers else 200,
+                "success": True,
+                "x_cache": "HIT",
+                "etag": f'"{url[-1]}"',
+                "last_modified": None,
+            }
+
+        args = [
+            "--files",
+            csv_file,
+            "--json-config",
+            config_file,
+            "--state-db",
+            state_db,
+            "--conditional",
+            "--progress-interval",
+            "0",
+        ]
+        with patch("warmer.warm_url", side_effect=fake_warm):
+            self.run_main(*args)
+            sent_headers.clear()
+            output = self.run_main(*args, "--skip-recent", "1")
+
+        self.assertEqual(sent_headers, {})
+        self.assertIn("Total skipped as unchanged: 2", output)
+
+        with patch("warmer.warm_url", side_effect=fake_warm):
+            output = self.run_main(*args)
+
+        self.assertEqual(sent_headers["http://a.com/2"], {"If-None-Match": '"2"'})
+        self.assertIn("Not modified (304): 2", output)
+
+    def test_main_json_report(self):
+        """Test --report json writes stage latencies to the report file"""
+        import json
+
+        csv_file = self.write_file("urls.csv", "http://a.com/1\nhttp://a.com/2\n")
+        config_file = self.write_file(
+            "config.json",
+            json.dumps([{"name": "A", "website_base_url": "a.com", "headers": {}}]),
+        )
+        report_file = os.path.join(self.tmpdir.name, "report.json")
+
+        def fake_warm(url, *args, **kwargs):
+            return {
+                "url": url,
+                "status": 200,
+                "success": True,
+                "x_cache": "HIT, MISS",
+                "elapsed": 0.25,
+            }
+
+        with patch("warmer.warm_url", side_effect=fake_warm):
+            output = self.run_main(
+                "--files",
+                csv_file,
+                "--json-config",
+                config_file,
+                "--progress-interval",
+                "0",
+                "--report",
+                "json",
+                "--report-file",
+                report_file,
+            )
+
+        with open(report_file) as f:
+            report = json.load(f)
+        self.assertEqual(report["totals"]["miss"], 2)
+        self.assertEqual(report["stages"][0]["name"], "A")
+        self.assertEqual(report["stages"][0]["by_cache_status"]["MISS"]["count"], 2)
+        self.assertIn("Latency p50 / p95 / p99:", output)
+
+    def test_main_json_report_on_stdout(self):
+        """Test a JSON report without a file is alone on stdout"""
+        import json
+        from io import StringIO
+
+        csv_file = self.write_file("urls.csv", "http://a.com/1\nhttp://a.com/2\n")
+        config_file = self.write_file(
+            "config.json",
+            json.dumps([{"name": "A", "website_base_url": "a.com", "headers": {}}]),
+        )
+
+        def fake_warm(url, *args, **kwargs):
+            return {"url": url, "status": 200, "success": True, "x_cache": "MISS"}
+
+        stderr = StringIO()
+        with patch("warmer.warm_url", side_effect=fake_warm), patch(
+            "sys.stderr", stderr
+        ):
+            output = self.run_main(
+                "--files",
+                csv_file,
+                "--json-config",
+                config_file,
+                "--progress-interval",
+                "0",
+                "--report",
+                "json",
+            )
+
+        self.assertEqual(json.loads(output)["totals"]["miss"], 2)
+        self.assertIn("FINAL AGGREGATE SUMMARY:", stderr.getvalue())
+
+    def test_main_metrics_textfile(self):
+        """Test --metrics-textfile writes the run's metrics at the end"""
+        import json
+
+        csv_file = self.write_file("urls.csv", "http://a.com/1\nhttp://a.com/2\n")
+        config_file = self.write_file(
+            "config.json",
+            json.dumps([{"name": "A", "website_base_url": "a.com", "headers": {}}]),
+        )
+        textfile = os.path.join(self.tmpdir.name, "warmer.prom")
+
+        def fake_warm(url, *args, **kwargs):
+            return {
+                "url": url,
+                "status": 200,
+                "success": True,
+                "x_cache": "MISS",
+                "elapsed": 0.2,
+            }
+
+        with patch("warmer.warm_url", side_effect=fake_warm):
+            self.run_main(
+                "--files",
+                csv_file,
+                "--json-config",
+                config_file,
+                "--progress-interval",
+                "0",
+                "--metrics-textfile",
+                textfile,
+            )
+
+        with open(textfile) as f:
+            text = f.read()
+        self.assertIn(
+            'warmer_requests_total{stage="A",status="200",cache_status="MISS"} 2', text
+        )
+        self.assertIn('warmer_requests_in_flight{stage="A"} 0', text)
+        self.assertIn("warmer_run_success 1", text)
+
+    def test_main_shards_split_urls_without_overlap(self):
+        """Test --shard 1/3 ... 3/3 together warm every URL exactly once"""
+        import json
+
+        urls = [f"http://a.com/{i}" for i in range(60)]
+        csv_file = self.write_file("urls.csv", "".join(f"{url}\n" for url in urls))
+        config_file = self.write_file(
+            "config.json",
+            json.dumps([{"name": "A", "website_base_url": "a.com", "headers": {}}]),
+        )
+        warmed = []
+
+        def fake_warm(url, *args, **kwargs):
+            warmed.append(url)
+            return {"url": url, "success": True, "x_cache": "HIT"}
+
+        with patch("warmer.warm_url", side_effect=fake_warm):
+            for index in (1, 2, 3):
+                self.run_main(
+                    "--files",
+                    csv_file,
+                    "--json-config",
+                    config_file,
+                    "--progress-interval",
+                    "0",
+                    "--shard",
+                    f"{index}/3",
+                )
+
+        self.assertEqual(sorted(warmed), sorted(urls))
+
+    def test_main_follow_rejects_url_sources(self):
+        """Test --follow cannot be given URL sources of its own"""
+        with self.assertRaises(SystemExit):
+            self.run_main(
+                "--files",
+                "urls.csv",
+                "--json-config",
+                "c.json",
+                "--follow",
+                "changes.jsonl",
+            )
+
+    def test_main_follow_requires_state_db(self):
+        """Test --follow without --state-db is rejected instead of dropping tags"""
+        with patch("warmer.follow") as follow, patch("builtins.print") as printed:
+            with self.assertRaises(SystemExit):
+                self.run_main("--json-config", "c.json", "--follow", "changes.jsonl")
+
+        follow.assert_not_called()
+        self.assertIn("--follow requires --state-db", printed.call_args.args[0])
+
+    def test_main_worker_rejects_url_sources(self):
+        """Test a --worker cannot be given URL sources of its own"""
+        with self.assertRaises(SystemExit):
+            self.run_main(
+                "--files",
+                "urls.csv",
+                "--json-config",
+                "c.json",
+                "--worker",
+                "host:7070",
+            )
+
+    def test_main_health_check_reports_paused_time(self):
+        """Test --health-check runs the monitor and the summary shows the paused time"""
+        import json
+
+        csv_file = self.write_file("urls.csv", "http://a.com/1\n")
+        config_file = self.write_file(
+            "config.json",
+            json.dumps([{"name": "A", "website_base_url": "a.com", "headers": {}}]),
+        )
+        loadavg = self.write_file("loadavg", "0.50 0.40 0.30 1/100 42\n")
+
+        def fake_warm(url, *args, **kwargs):
+            return {"url": url, "success": True, "x_cache": "HIT"}
+
+        with patch("warmer.warm_url", side_effect=fake_warm):
+            output = self.run_main(
+                "--files",
+                csv_file,
+                "--json-config",
+                config_file,
+                "--progress-interval",
+                "0",
+                "--health-check",
+                f"load=4@{loadavg}",
+            )
+
+        self.assertIn("Paused while the origin was busy: 0s", output)
+
+    def test_main_conditional_requires_state_db(self):
+        """Test --conditional without --state-db is rejected"""
+        with self.assertRaises(SystemExit):
+            self.run_main(
+                "--files", "urls.csv", "--json-config", "c.json", "--conditional"
+            )
+
 
 class TestLoadConfigFromJSON(unittest.TestCase):
     def test_load_config_from_json_success(self):
@@ -217,6 +3158,123 @@ class TestLoadConfigFromJSON(unittest.TestCase):
             except SystemExit:
                 pass  # Expected for invalid JSON
 
+    def test_read_json_config_with_settings(self):
+        """Test the object form with configurations and normalization rules"""
+        json_content = (
+            '{"normalization": {"trailing_slash": "keep"},'
+            ' "configurations": [{"name": "test", "headers": {}}]}'
+        )
+
+        with patch("builtins.open", mock_open(read_data=json_content)):
+            settings = read_json_config("test.json")
+
+        self.assertEqual(settings["configurations"][0]["name"], "test")
+        self.assertEqual(settings["normalization"]["trailing_slash"], "keep")
+        self.assertTrue(settings["normalization"]["sort_query"])
+
+    def test_read_json_config_list_has_no_normalization(self):
+        """Test the plain list form keeps URLs as they are"""
+        json_content = '[{"name": "test", "headers": {}}]'
+
+        with patch("builtins.open", mock_open(read_data=json_content)):
+            settings = read_json_config("test.json")
+
+        self.assertIsNone(settings["normalization"])
+
+    def test_read_json_config_unknown_normalization_rule(self):
+        """Test a misspelled normalization rule is rejected"""
+        json_content = (
+            '{"normalization": {"sort_querry": true},'
+            ' "configurations": [{"name": "test", "headers": {}}]}'
+        )
+
+        with patch("builtins.open", mock_open(read_data=json_content)), patch(
+            "builtins.print"
+        ):
+            with self.assertRaises(SystemExit):
+                read_json_config("test.json")
+
+
+class TestNormalizeURL(unittest.TestCase):
+    def setUp(self):
+        self.rules = compile_normalization_rules(True)
+
+    def test_normalize_url_collapses_variants(self):
+        """Test common variants of one page normalize to the same URL"""
+        variants = [
+            "https://Example.COM/laptops/",
+            "https://example.com:443/laptops",
+            "https://example.com/laptops?utm_source=mail&gclid=abc",
+            "https://example.com/laptops/?fbclid=x#reviews",
+        ]
+
+        normalized = {normalize_url(url, self.rules) for url in variants}
+
+        self.assertEqual(normalized, {"https://example.com/laptops"})
+
+    def test_normalize_url_sorts_query(self):
+        """Test query parameters are sorted and kept otherwise"""
+        self.assertEqual(
+            normalize_url("http://example.com/c?p=2&dir=asc&q=a%20b", self.rules),
+            "http://example.com/c?dir=asc&p=2&q=a%20b",
+        )
+
+    def test_normalize_url_keeps_query_encoding(self):
+        """Test bare keys, reserved characters and "+" are passed through as-is"""
+        rules = compile_normalization_rules(
+            {"sort_query": False, "drop_query_params": []}
+        )
+        for url in (
+            "http://example.com/c?foo",
+            "http://example.com/c?c=red,blue",
+            "http://example.com/c?q=a+b",
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(normalize_url(url, rules), url)
+
+        self.assertEqual(
+            normalize_url("http://example.com/c?q=a+b&foo&c=red,blue", self.rules),
+            "http://example.com/c?c=red,blue&foo&q=a+b",
+        )
+
+    def test_normalize_url_drops_params_by_decoded_key(self):
+        """Test encoded parameter names still match the dropped patterns"""
+        self.assertEqual(
+            normalize_url("http://example.com/?utm%5Fsource=x&p=2", self.rules),
+            "http://example.com/?p=2",
+        )
+
+    def test_normalize_url_root_path(self):
+        """Test the root path keeps its single slash"""
+        self.assertEqual(
+            normalize_url("http://example.com", self.rules), "http://example.com/"
+        )
+        self.assertEqual(
+            normalize_url("http://example.com/", self.rules), "http://example.com/"
+        )
+
+    def test_normalize_url_add_trailing_slash(self):
+        """Test trailing_slash add skips file-like paths"""
+        rules = compile_normalization_rules({"trailing_slash": "add"})
+
+        self.assertEqual(
+            normalize_url("http://example.com/laptops", rules),
+            "http://example.com/laptops/",
+        )
+        self.assertEqual(
+            normalize_url("http://example.com/laptop.html", rules),
+            "http://example.com/laptop.html",
+        )
+
+    def test_normalize_url_custom_dropped_params(self):
+        """Test configured parameter patterns replace the defaults"""
+        rules = compile_normalization_rules({"drop_query_params": ["sid"]})
+
+        self.assertEqual(
+            normalize_url("http://example.com/?sid=1&utm_source=x", rules),
+            "http://example.com/?utm_source=x",
+        )
+
 
 class TestExtractBaseURL(unittest.TestCase):
     def test_extract_base_url_from_config_with_protocol(self):
@@ -305,5 +3363,48 @@ class TestMatchURLsByBaseURL(unittest.TestCase):
         self.assertEqual(len(matched_urls), 1)
 
 
+class TestBucketURLsByHost(unittest.TestCase):
+    def test_bucket_urls_by_host(self):
+        """Test URLs are grouped by host and port, keeping their order"""
+        urls = [
+            "http://example.com/page1",
+            "http://other.com/page3",
+            "http://example.com/page2",
+            "https://example.com:8080/page4",
+            "not a valid url",
+        ]
+
+        buckets = bucket_urls_by_host(urls)
+
+        self.assertEqual(
+            buckets,
+            {
+                "example.com": ["http://example.com/page1", "http://example.com/page2"],
+                "other.com": ["http://other.com/page3"],
+                "example.com:8080": ["https://example.com:8080/page4"],
+            },
+        )
+
+    def test_urls_for_config_matches_linear_scan(self):
+        """Test bucket lookups return the same URLs as match_urls_by_base_url"""
+        urls = [
+            "http://example.com/page1",
+            "http://other.com/page3",
+            "http://example.com/page2",
+        ]
+        buckets = bucket_urls_by_host(urls)
+
+        for config in (
+            {"website_base_url": "http://example.com"},
+            {"website_base_url": "https://other.com/store/"},
+            {"website_base_url": "missing.com"},
+            {},
+        ):
+            self.assertEqual(
+                urls_for_config(buckets, config, urls),
+                match_urls_by_base_url(urls, config),
+            )
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,20 +1,171 @@
 import argparse
+import contextlib
 import csv
+import fnmatch
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
+import math
+import re
+import signal
+import stat
 import sys
 import time
 import json
-from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
+import random
+import socket
+import threading
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 import warnings
-import requests
+from urllib.parse import unquote_plus, urlparse, urlsplit, urlunsplit
 
 
-def warm_url(url, headers=None, cookies=None, timeout=50):
-    """Send a GET request to warm up a URL with specified headers and cookies"""
+class _ConnectTiming(threading.local):
+    # Seconds the current thread's request spent opening connections (TCP
+    # and TLS), zero when a pooled connection was reused. The class default
+    # covers threads that only fetch sitemaps or run health checks.
+    seconds = 0.0
+
+
+_connect_timing = _ConnectTiming()
+
+# HTTPAdapter subclass built by _load_requests()
+_TimedHTTPAdapter = None
+
+
+def _load_requests():
+    """Import requests on first use and return the module
+
+    requests and urllib3 make up most of the startup time, so runs that end
+    before sending a request (--help, invalid options, a coordinator) never
+    import them. The first call also does the per-process setup every
+    request relies on.
+    """
+    global _TimedHTTPAdapter
+    import requests
+
+    if _TimedHTTPAdapter is not None:
+        return requests
+
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+    from urllib3.exceptions import InsecureRequestWarning
+
+    class TimedHTTPConnection(HTTPConnection):
+        def connect(self):
+            start_time = time.monotonic()
+            super().connect()
+            _connect_timing.seconds += time.monotonic() - start_time
+
+    class TimedHTTPSConnection(HTTPSConnection):
+        def connect(self):
+            start_time = time.monotonic()
+            super().connect()
+            _connect_timing.seconds += time.monotonic() - start_time
+
+    class TimedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = TimedHTTPConnection
+
+    class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = TimedHTTPSConnection
+
+    class TimedHTTPAdapter(HTTPAdapter):
+        """HTTPAdapter whose connections record how long connecting took"""
+
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                "http": TimedHTTPConnectionPool,
+                "https": TimedHTTPSConnectionPool,
+            }
+
+    # Pages are requested with verify=False, which would warn on every request
+    warnings.simplefilter("ignore", InsecureRequestWarning)
+    _TimedHTTPAdapter = TimedHTTPAdapter
+    return requests
+
+
+def create_session(pool_size=5):
+    """Create a keep-alive HTTP session with a connection pool for pool_size workers"""
+    from http.cookiejar import DefaultCookiePolicy
+
+    session = _load_requests().Session()
+    adapter = _TimedHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # Never store cookies set by responses, every configuration sends its own
+    # cookies and they must not leak into the next URL's request
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+# How the body of a warmed page is fetched:
+#   full    - download and buffer the whole body
+#   stream  - read the body in chunks and throw them away, still compressed
+#   headers - close the connection once the headers arrived
+#   head    - send a HEAD request instead of a GET
+FETCH_MODES = ("full", "stream", "headers", "head")
+BODY_CHUNK_SIZE = 64 * 1024
+
+
+def warm_url(
+    url, headers=None, cookies=None, timeout=50, session=None, fetch_mode="stream"
+):
+    """Send a GET request to warm up a URL with specified headers and cookies
+
+    When a session is given its pooled keep-alive connections are reused,
+    otherwise a new connection is opened for the request. fetch_mode is
+    one of FETCH_MODES, the body is never kept.
+
+    Besides the status and cache headers, the result holds timings in
+    seconds: "connect" (opening connections, only measured on sessions
+    from create_session), "ttfb" (until the response headers arrived) and
+    "elapsed" (the whole request), and "bytes", the body bytes read.
+    "tags" lists the page's cache tags when the response exposes them (see
+    cache_tags) and "vary" the request headers named by its Vary header.
+    """
+    http = session if session is not None else _load_requests()
+    _connect_timing.seconds = 0.0
+    start_time = time.monotonic()
+    ttfb = None
     try:
-        warnings.simplefilter("ignore")
-        response = requests.get(
-            url, headers=headers, cookies=cookies, timeout=timeout, verify=False
-        )
+        if fetch_mode == "head":
+            response = http.head(
+                url,
+                headers=headers,
+                cookies=cookies,
+                timeout=timeout,
+                verify=False,
+                allow_redirects=True,
+            )
+        else:
+            # Always streamed, so the call returns once the headers arrived
+            response = http.get(
+                url,
+                headers=headers,
+                cookies=cookies,
+                timeout=timeout,
+                verify=False,
+                stream=True,
+            )
+        ttfb = time.monotonic() - start_time
+        body_bytes = 0
+        if fetch_mode == "full":
+            body_bytes = len(response.content)
+        elif fetch_mode == "stream":
+            # Draining the body returns the connection to the pool
+            for chunk in response.raw.stream(BODY_CHUNK_SIZE, decode_content=False):
+                body_bytes += len(chunk)
+        # Without a drained body this drops the connection instead of reusing it
+        response.close()
         # Extract x-cache header
         x_cache = response.headers.get("x-cache", "Not found")
 
@@ -24,6 +175,14 @@ def warm_url(url, headers=None, cookies=None, timeout=50):
             "success": True,
             "error": None,
             "x_cache": x_cache,
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+            "tags": cache_tags(response.headers),
+            "vary": vary_headers(response.headers),
+            "connect": _connect_timing.seconds if session is not None else None,
+            "ttfb": ttfb,
+            "elapsed": time.monotonic() - start_time,
+            "bytes": body_bytes,
         }
     except Exception as e:
         return {
@@ -32,179 +191,4057 @@ def warm_url(url, headers=None, cookies=None, timeout=50):
             "success": False,
             "error": str(e),
             "x_cache": "MISS",
+            "etag": None,
+            "last_modified": None,
+            "tags": None,
+            "vary": None,
+            "connect": _connect_timing.seconds if session is not None else None,
+            "ttfb": ttfb,
+            "elapsed": time.monotonic() - start_time,
+            "bytes": 0,
+        }
+
+
+async def warm_url_async(
+    session, url, headers=None, cookies=None, timeout=50, fetch_mode="stream"
+):
+    """Send a GET request to warm up a URL on an aiohttp session
+
+    Returns the same result dict as warm_url, fetch_mode works the same.
+    Connect times are measured on sessions created with
+    connect_trace_config().
+    """
+    import aiohttp
+
+    timing = {"connect": 0.0}
+    start_time = time.monotonic()
+    ttfb = None
+    request = session.head if fetch_mode == "head" else session.get
+    try:
+        async with request(
+            url,
+            headers=headers,
+            cookies=cookies,
+            timeout=aiohttp.ClientTimeout(total=timeout),
+            allow_redirects=True,
+            trace_request_ctx=timing,
+        ) as response:
+            ttfb = time.monotonic() - start_time
+            body_bytes = 0
+            if fetch_mode == "full":
+                body_bytes = len(await response.read())
+            elif fetch_mode == "stream":
+                async for chunk in response.content.iter_chunked(BODY_CHUNK_SIZE):
+                    body_bytes += len(chunk)
+            elif fetch_mode == "headers":
+                response.close()
+            x_cache = response.headers.get("x-cache", "Not found")
+
+            return {
+                "url": url,
+                "status": response.status,
+                "success": True,
+                "error": None,
+                "x_cache": x_cache,
+                "etag": response.headers.get("etag"),
+                "last_modified": response.headers.get("last-modified"),
+                "tags": cache_tags(response.headers),
+                "vary": vary_headers(response.headers),
+                "connect": timing["connect"],
+                "ttfb": ttfb,
+                "elapsed": time.monotonic() - start_time,
+                "bytes": body_bytes,
+            }
+    except Exception as e:
+        return {
+            "url": url,
+            "status": None,
+            "success": False,
+            "error": str(e) or type(e).__name__,
+            "x_cache": "MISS",
+            "etag": None,
+            "last_modified": None,
+            "tags": None,
+            "vary": None,
+            "connect": timing["connect"],
+            "ttfb": ttfb,
+            "elapsed": time.monotonic() - start_time,
+            "bytes": 0,
         }
 
 
+def cache_tags(headers):
+    """Cache tags of a response, from X-Magento-Tags or Fastly's Surrogate-Key
+
+    Returns None when the response exposes neither header.
+    """
+    tags = headers.get("x-magento-tags")
+    if tags is not None:
+        return [tag for tag in (tag.strip() for tag in tags.split(",")) if tag]
+    keys = headers.get("surrogate-key")
+    if keys is not None:
+        return keys.split()
+    return None
+
+
+def vary_headers(headers):
+    """Lowercase header names of a response's Vary header, empty without one"""
+    return [
+        name
+        for name in (
+            name.strip().lower() for name in headers.get("vary", "").split(",")
+        )
+        if name
+    ]
+
+
+def connect_trace_config():
+    """aiohttp TraceConfig adding the time spent opening connections to each
+    request's trace_request_ctx["connect"]"""
+    import aiohttp
+
+    async def on_start(session, context, params):
+        context.connect_started = time.monotonic()
+
+    async def on_end(session, context, params):
+        context.trace_request_ctx["connect"] += (
+            time.monotonic() - context.connect_started
+        )
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_start.append(on_start)
+    trace_config.on_connection_create_end.append(on_end)
+    return trace_config
+
+
+# Cheap stand-in for urlparse(): an http(s) scheme followed by a non-empty host
+_WARMABLE_URL = re.compile(r"https?://[^/?#]", re.IGNORECASE)
+
+
+def is_warmable_url(url):
+    """Check that a URL has an http(s) scheme and a host"""
+    return _WARMABLE_URL.match(url) is not None
+
+
+def _iter_csv_url_rows(filename):
+    opener = gzip.open if filename.endswith(".gz") else open
+    with opener(filename, "rt", newline="", encoding="utf-8") as csvfile:
+        for row in csv.reader(csvfile):
+            if row:  # Skip empty rows
+                url = row[0].strip()
+                # Only keep non-empty URLs with a scheme and host, this
+                # also skips header rows
+                if url and is_warmable_url(url):
+                    yield url, row
+
+
+def iter_urls_from_csv(filename):
+    """Yield valid URLs from a CSV file one row at a time (first column)
+
+    Files ending in .gz are decompressed on the fly. Errors opening or
+    reading the file are raised to the caller.
+    """
+    for url, _ in _iter_csv_url_rows(filename):
+        yield url
+
+
+def iter_weighted_urls_from_csv(filename, weight_column):
+    """Yield (url, weight) pairs from a CSV file one row at a time
+
+    The weight, e.g. a hit count, is read from weight_column (0-based, the
+    URL being column 0). Rows without a numeric weight get 0.
+    """
+    for url, row in _iter_csv_url_rows(filename):
+        try:
+            weight = float(row[weight_column])
+        except (IndexError, ValueError):
+            weight = 0.0
+        yield url, weight
+
+
 def read_urls_from_csv(filename):
     """Read URLs from CSV file (assuming first column contains URLs)"""
-    urls = []
     try:
-        with open(filename, "r", newline="", encoding="utf-8") as csvfile:
-            reader = csv.reader(csvfile)
-            for row in reader:
-                if row:  # Skip empty rows
-                    url = row[0].strip()
-                    if url:  # Only add non-empty URLs
-                        # Validate that the URL looks like a proper URL with scheme and netloc
-                        try:
-                            from urllib.parse import urlparse
-
-                            parsed_url = urlparse(url)
-                            if (
-                                parsed_url.scheme in ("http", "https")
-                                and parsed_url.netloc
-                            ):
-                                urls.append(url)
-                        except Exception:
-                            # If we can't parse it as a URL, skip it
-                            continue
+        return list(iter_urls_from_csv(filename))
     except FileNotFoundError:
         print(f"Error: File '{filename}' not found.")
         return []
     except Exception as e:
         print(f"Error reading CSV file: {e}")
         return []
-    return urls
 
 
-def process_urls_threaded(
-    urls,
-    max_workers=5,
-    timeout=50,
-    custom_headers=None,
-    custom_cookies=None,
-    use_threads=True,
-    rate_limit=None,
+def _url_key(url):
+    scheme, separator, rest = url.partition("://")
+    host, slash, path = rest.partition("/")
+    return f"{scheme.lower()}{separator}{host.lower()}{slash}{path}"
+
+
+def url_fingerprint(url):
+    """Compact dedup key of a URL: a 64-bit hash with scheme and host lowercased"""
+    # hash() is only stable within one process, which is all the seen-set needs
+    return hash(_url_key(url))
+
+
+def shard_of(url, shards):
+    """Shard (0-based) a URL belongs to among `shards`, by rendezvous hashing
+
+    Every shard scores the URL with a stable hash and the highest score
+    wins, so all processes and hosts agree on the split, and going from N
+    to N + 1 shards only moves the URLs the new shard wins.
+    """
+    key = _url_key(url).encode()
+    return max(
+        range(shards),
+        key=lambda shard: hashlib.blake2b(
+            key, digest_size=8, salt=shard.to_bytes(8, "big")
+        ).digest(),
+    )
+
+
+def parse_shard(value):
+    """Parse a --shard "i/N" value into (i, N), i counting from 1"""
+    index, _, count = value.partition("/")
+    index, count = int(index), int(count)
+    if not 1 <= index <= count:
+        raise ValueError(f"Shard {value} is not between 1/{count} and {count}/{count}")
+    return index, count
+
+
+def add_unique_urls(rows, all_urls, seen, normalization=None, weights=None):
+    """Append the (url, weight) rows whose URL is not in seen yet to all_urls
+
+    URLs are canonicalized first when normalization rules are given, and
+    every occurrence's weight is added to the weights dict, keyed by
+    url_fingerprint(), when one is given. Returns (added, duplicates).
+    """
+    added = 0
+    duplicates = 0
+    for url, weight in rows:
+        if normalization:
+            url = normalize_url(url, normalization)
+        key = url_fingerprint(url)
+        if weights is not None:
+            weights[key] = weights.get(key, 0.0) + weight
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        all_urls.append(url)
+        added += 1
+    return added, duplicates
+
+
+def read_unique_urls(
+    filenames,
+    seen=None,
+    normalization=None,
+    weight_column=None,
+    weights=None,
+    all_urls=None,
 ):
-    """Process URLs in parallel using ThreadPoolExecutor or sequentially"""
-    if not use_threads:
-        # Sequential processing without threads
-        results = []
-        start_time = time.time()
-        for i, url in enumerate(urls):
-            # Apply rate limiting if specified and threading is disabled
-            if rate_limit and i > 0:
-                elapsed_time = time.time() - start_time
-                target_elapsed = (
-                    i / rate_limit * 60
-                )  # seconds per URL based on rate limit
-                sleep_time = max(0, target_elapsed - elapsed_time)
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
-
-            result = warm_url(url, custom_headers, custom_cookies, timeout)
-            results.append(result)
-        return results
-
-    # Threaded processing (original behavior) - no rate limiting in threaded mode
-    results = []
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all tasks
-        future_to_url = {
-            executor.submit(warm_url, url, custom_headers, custom_cookies, timeout): url
-            for url in urls
-        }
-        # Collect results as they complete
-        for future in future_to_url:
-            result = future.result()
-            results.append(result)
-    return results
+    """Read URLs from all CSV files, skipping URLs already read from any of them
 
+    Files are streamed row by row and only the first occurrence of each URL
+    is kept. Pass a seen set to deduplicate against earlier reads as well.
+    With compiled normalization rules URLs are canonicalized first, so
+    equivalent variants count as duplicates too.
 
-def load_config_from_json(json_file):
-    """Load configuration from JSON file"""
+    With a weight_column, the weights of every occurrence of a URL are summed
+    into the weights dict, keyed by url_fingerprint().
+    """
+    if seen is None:
+        seen = set()
+    if all_urls is None:
+        all_urls = []
+
+    for filename in filenames:
+        print(f"Reading URLs from {filename}.")
+        read_before = len(all_urls)
+        duplicates = 0
+        try:
+            if weight_column is None:
+                rows = ((url, 0.0) for url in iter_urls_from_csv(filename))
+            else:
+                rows = iter_weighted_urls_from_csv(filename, weight_column)
+            _, duplicates = add_unique_urls(
+                rows, all_urls, seen, normalization, weights
+            )
+        except FileNotFoundError:
+            print(f"Error: File '{filename}' not found.")
+        except Exception as e:
+            print(f"Error reading CSV file: {e}")
+        found = len(all_urls) - read_before
+
+        if not found and not duplicates:
+            print(f"No URLs found in {filename}.")
+            continue
+        message = f"Found {found} URLs in {filename}."
+        if duplicates:
+            message += f" Skipped {duplicates} duplicate URLs."
+        print(message)
+    return all_urls
+
+
+def iter_by_priority(urls, weights):
+    """Yield URLs from a priority queue, highest weight first
+
+    weights maps url_fingerprint() to a weight, URLs missing from it count
+    as 0. URLs with the same weight keep their original order.
+    """
+    heap = [
+        (-weights.get(url_fingerprint(url), 0.0), position, url)
+        for position, url in enumerate(urls)
+    ]
+    heapq.heapify(heap)
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+
+class SpaceSaving:
+    """Bounded-memory top-N counter (the Space-Saving heavy hitters algorithm)
+
+    At most `capacity` items are tracked. An untracked item replaces the
+    least counted one and inherits its count, so counts are over-estimated
+    by at most the smallest tracked count, and any item seen more than
+    total / capacity times is always tracked.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        # One (count, item) entry per tracked item, the count may be stale
+        self.heap = []
+
+    def add(self, item, count=1):
+        counts = self.counts
+        if item in counts:
+            counts[item] += count
+            return
+        if len(counts) < self.capacity:
+            counts[item] = count
+            heapq.heappush(self.heap, (count, item))
+            return
+
+        # Find the least counted item, refreshing stale heap entries on the way
+        while True:
+            low, victim = self.heap[0]
+            current = counts[victim]
+            if current == low:
+                break
+            heapq.heapreplace(self.heap, (current, victim))
+
+        del counts[victim]
+        counts[item] = low + count
+        heapq.heapreplace(self.heap, (low + count, item))
+
+    def top(self, n):
+        """Return the n most counted (item, count) pairs, highest first"""
+        return heapq.nlargest(n, self.counts.items(), key=lambda pair: pair[1])
+
+
+# Request line and status of the nginx "combined" (and similar) log formats
+_ACCESS_LOG_REQUEST = re.compile(
+    r'"GET (?P<target>[^\s"]+) HTTP/[\d.]+" (?P<status>\d{3}) '
+)
+
+# Same filters as Service/UrlParser::isPageUrl with the module's default di.xml
+NON_PAGE_PATH_PATTERNS = (
+    r"^/media/",
+    r"^/skin/",
+    r"^/js/",
+    r"^/css/",
+    r"^/favicon\.ico$",
+)
+NON_PAGE_PATH_PARTS = (
+    "checkout",
+    "uploads",
+    "pub",
+    "customer",
+    "static",
+    "customer/section",
+    "?",
+    "/rest/V1",
+)
+NON_PAGE_EXTENSIONS = tuple(
+    ".jpg .jpeg .png .gif .bmp .svg .webp .ico .css .js .pdf .doc .docx .xls"
+    " .xlsx .ppt .pptx .zip .rar .7z .gz .tar .mp3 .mp4 .avi .mov .woff .woff2"
+    " .ttf .eot .html .xml .php .json".split()
+)
+_NON_PAGE_PATH = re.compile(
+    "|".join(NON_PAGE_PATH_PATTERNS + tuple(map(re.escape, NON_PAGE_PATH_PARTS)))
+)
+
+
+def is_page_path(path):
+    """Check that a request path is a page and not an asset, API call or checkout"""
+    return (
+        not path.lower().endswith(NON_PAGE_EXTENSIONS)
+        and _NON_PAGE_PATH.search(path) is None
+    )
+
+
+def iter_access_log_urls(filename, base_url=None, ignore_agents=None):
+    """Yield page URLs of successful GET requests from an nginx access log
+
+    The log is streamed line by line, .gz files (rotated logs) are
+    decompressed on the fly. Requests logged with a full URL are used as
+    they are, path-only requests are prefixed with base_url and skipped
+    without one. Lines matching the compiled ignore_agents regex are skipped.
+    """
+    opener = gzip.open if filename.endswith(".gz") else open
+    with opener(filename, "rt", encoding="utf-8", errors="replace") as log:
+        yield from iter_page_urls_from_log_lines(log, base_url, ignore_agents)
+
+
+def iter_page_urls_from_log_lines(lines, base_url=None, ignore_agents=None):
+    """Yield page URLs of successful GET requests from access log lines"""
+    if base_url:
+        base_url = base_url.rstrip("/")
+    for line in lines:
+        match = _ACCESS_LOG_REQUEST.search(line)
+        if match is None or match.group("status") != "200":
+            continue
+        if ignore_agents is not None and ignore_agents.search(line):
+            continue
+
+        target = match.group("target")
+        if target.startswith("/"):
+            if not base_url:
+                continue
+            path = target
+            url = base_url + target
+        elif is_warmable_url(target):
+            path = "/" + target.partition("://")[2].partition("/")[2]
+            url = target
+        else:
+            continue
+
+        if is_page_path(path):
+            yield url
+
+
+def load_log_state(filename):
+    """Load the incremental access log state, or an empty one if there is none
+
+    The state holds the byte offset reached in each log file, keyed by its
+    device and inode together with a fingerprint of its first line, and the
+    decayed popularity score of each page.
+    """
     try:
-        with open(json_file, "r") as f:
-            config_data = json.load(f)
+        with open(filename, "r") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        state = {}
+    state.setdefault("files", {})
+    state.setdefault("popularity", {})
+    state.setdefault("updated", None)
+    return state
 
-        # Validate the structure of the loaded configuration
-        if not isinstance(config_data, list):
-            raise ValueError("JSON configuration must be a list of configurations")
 
-        for i, config in enumerate(config_data):
-            if "name" not in config or "headers" not in config:
-                raise ValueError(
-                    f"Configuration at index {i} is missing required fields 'name' and/or 'headers'"
+def save_log_state(filename, state):
+    """Write the access log state atomically, so a crash never truncates it"""
+    temporary = f"{filename}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(state, f)
+    os.replace(temporary, filename)
+
+
+def _log_fingerprint(log, size=4096):
+    """Digest of the first line of an open log, None until it has one"""
+    log.seek(0)
+    first = log.readline(size)
+    if not first.endswith(b"\n") and len(first) < size:
+        return None
+    return hashlib.blake2b(first, digest_size=8).hexdigest()
+
+
+def _iter_new_log_lines(filename, files_state, seen):
+    """Yield complete lines added to a log since the offset stored for its inode
+
+    A file whose inode is new is read from the start. A rotated log keeps
+    its inode, so passing it as well (e.g. access.log.1) picks up the lines
+    written after the last run and before the rotation. A file that shrank
+    below its offset was truncated, and one whose first line changed is a
+    new log on a reused inode; both are read again from the start. The key
+    of the file is added to seen.
+    """
+    with open(filename, "rb") as log:
+        file_stat = os.fstat(log.fileno())
+        key = f"{file_stat.st_dev}:{file_stat.st_ino}"
+        seen.add(key)
+        entry = files_state.get(key) or {}
+        if isinstance(entry, int):
+            # State written before fingerprints were stored
+            entry = {"offset": entry}
+        offset = entry.get("offset", 0)
+        fingerprint = _log_fingerprint(log)
+        reused = entry.get("fingerprint", fingerprint) != fingerprint
+        if file_stat.st_size < offset or reused:
+            offset = 0
+
+        log.seek(offset)
+        for line in log:
+            # Leave a line that is still being written for the next run
+            if not line.endswith(b"\n"):
+                break
+            offset += len(line)
+            yield line.decode("utf-8", errors="replace")
+    files_state[key] = {"offset": offset, "fingerprint": fingerprint}
+
+
+def read_access_logs_incremental(
+    filenames,
+    state,
+    top=500,
+    capacity=None,
+    base_url=None,
+    ignore_agents=None,
+    half_life=24,
+    now=None,
+):
+    """Count page hits added to the access logs since the last run
+
+    Only the bytes after the offsets stored in state are parsed. New counts
+    are merged into the persisted popularity scores after decaying them
+    with a half_life in hours, and the table is trimmed to capacity entries
+    (default: 20 x top). Offsets of logs not passed in this run are
+    dropped, and compressed logs are skipped. Updates state in place and
+    returns the top (url, score) pairs of the whole table.
+    """
+    now = time.time() if now is None else now
+    capacity = capacity or top * 20
+
+    counter = SpaceSaving(capacity)
+    seen = set()
+    for filename in filenames:
+        if filename.endswith(".gz"):
+            # A log compressed by logrotate gets a new inode, reading it would
+            # count lines already read from the plain log a second time
+            print(f"Skipping compressed access log {filename} in incremental mode.")
+            continue
+        print(f"Parsing new lines of access log {filename}.")
+        hits = 0
+        try:
+            lines = _iter_new_log_lines(filename, state["files"], seen)
+            for url in iter_page_urls_from_log_lines(lines, base_url, ignore_agents):
+                counter.add(url)
+                hits += 1
+        except FileNotFoundError:
+            print(f"Error: Access log '{filename}' not found.")
+            continue
+        except Exception as e:
+            print(f"Error reading access log: {e}")
+        print(f"Counted {hits} new page hits in {filename}.")
+
+    # Forget logs that were rotated away, their inodes may be reused
+    state["files"] = {
+        key: entry for key, entry in state["files"].items() if key in seen
+    }
+
+    decay = 1.0
+    if state["updated"] is not None and half_life > 0:
+        decay = 0.5 ** (max(0.0, now - state["updated"]) / 3600 / half_life)
+
+    popularity = {url: score * decay for url, score in state["popularity"].items()}
+    for url, count in counter.counts.items():
+        popularity[url] = popularity.get(url, 0.0) + count
+
+    state["popularity"] = dict(
+        heapq.nlargest(capacity, popularity.items(), key=lambda pair: pair[1])
+    )
+    state["updated"] = now
+    return heapq.nlargest(top, state["popularity"].items(), key=lambda pair: pair[1])
+
+
+def compile_agent_patterns(patterns):
+    """Combine user agent regexes into one precompiled regex, None for none"""
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns))
+
+
+def read_access_logs(
+    filenames, top=500, capacity=None, base_url=None, ignore_agents=None
+):
+    """Count page hits over all access logs and return the top (url, count) pairs
+
+    Memory is bounded by a SpaceSaving counter of `capacity` entries
+    (default: 20 x top) however large the logs are.
+    """
+    counter = SpaceSaving(capacity or top * 20)
+    for filename in filenames:
+        print(f"Parsing access log {filename}.")
+        hits = 0
+        try:
+            for url in iter_access_log_urls(filename, base_url, ignore_agents):
+                counter.add(url)
+                hits += 1
+        except FileNotFoundError:
+            print(f"Error: Access log '{filename}' not found.")
+            continue
+        except Exception as e:
+            print(f"Error reading access log: {e}")
+        print(f"Counted {hits} page hits in {filename}.")
+    return counter.top(top)
+
+
+def iter_sitemap_entries(stream):
+    """Yield ("url" | "sitemap", loc, lastmod) from a sitemap or sitemap index
+
+    stream is a binary file-like object. The XML is parsed incrementally
+    and every entry is cleared as soon as it is read, so memory stays flat
+    however many URLs a sitemap has.
+    """
+    from xml.etree import ElementTree
+
+    root = None
+    depth = 0
+    loc = lastmod = None
+    for event, elem in ElementTree.iterparse(stream, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if root is None:
+                root = elem
+            continue
+
+        tag = elem.tag.rpartition("}")[2]
+        # <loc> and <lastmod> directly under <url>/<sitemap>, not the ones
+        # nested in image or video extensions
+        if depth == 3 and tag == "loc":
+            loc = (elem.text or "").strip()
+        elif depth == 3 and tag == "lastmod":
+            lastmod = (elem.text or "").strip() or None
+        elif depth == 2 and tag in ("url", "sitemap"):
+            if loc:
+                yield tag, loc, lastmod
+            loc = lastmod = None
+            root.clear()
+        depth -= 1
+
+
+class _SitemapStream(io.BufferedReader):
+    """Buffered body of a streamed response, closing the response with it"""
+
+    def __init__(self, response):
+        super().__init__(response.raw)
+        self.response = response
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            # Hands the connection back to the session's pool
+            self.response.close()
+
+
+class _GzipSitemapStream(gzip.GzipFile):
+    """GzipFile that also closes the stream it decompresses"""
+
+    def close(self):
+        stream = self.fileobj
+        try:
+            super().close()
+        finally:
+            if stream is not None:
+                stream.close()
+
+
+def open_sitemap(url, session, timeout=50):
+    """Open a sitemap as a streamed binary file object, gunzipping .xml.gz files
+
+    Closing the file object closes the response.
+    """
+    response = session.get(url, timeout=timeout, verify=False, stream=True)
+    try:
+        response.raise_for_status()
+    except Exception:
+        response.close()
+        raise
+    # Undo Content-Encoding on the fly, gzip files themselves are sniffed below
+    response.raw.decode_content = True
+    # Let the io wrappers see a clean end of file instead of a closed stream
+    response.raw.auto_close = False
+    stream = _SitemapStream(response)
+    if stream.peek(2)[:2] == b"\x1f\x8b":
+        return _GzipSitemapStream(fileobj=stream)
+    return stream
+
+
+def fetch_sitemaps_from_robots(robots_url, session, timeout=50):
+    """Return the sitemap URLs listed in a robots.txt file
+
+    robots_url may also be a store base URL, /robots.txt is then appended.
+    """
+    if not robots_url.rstrip("/").endswith("robots.txt"):
+        robots_url = robots_url.rstrip("/") + "/robots.txt"
+    response = session.get(robots_url, timeout=timeout, verify=False)
+    response.raise_for_status()
+    return [
+        line.split(":", 1)[1].strip()
+        for line in response.text.splitlines()
+        if line.strip().lower().startswith("sitemap:")
+    ]
+
+
+def iter_sitemap_urls(sitemaps=(), robots=(), max_workers=5, timeout=50):
+    """Fetch sitemaps concurrently and yield (url, lastmod) for every page
+
+    Sitemap indexes are followed, every child sitemap is fetched and parsed
+    by a pool of max_workers threads over one pooled session, and page URLs
+    are yielded while the sitemaps are still being downloaded. A bounded
+    queue between the workers and the caller keeps memory constant.
+    Sitemaps that fail to load are reported and skipped.
+    """
+    entries = queue.Queue(maxsize=10000)
+    stopped = threading.Event()
+    task_done = object()
+    pending = 0
+    pending_lock = threading.Lock()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                entries.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def submit(task, *task_args):
+        nonlocal pending
+        if stopped.is_set():
+            return
+        with pending_lock:
+            pending += 1
+        executor.submit(run, task, *task_args)
+
+    def run(task, *task_args):
+        try:
+            task(*task_args)
+        except Exception as e:
+            print(f"Error loading sitemap {task_args[0]}: {e}")
+        finally:
+            put(task_done)
+
+    def parse_robots(robots_url):
+        for sitemap_url in fetch_sitemaps_from_robots(robots_url, session, timeout):
+            submit(parse_sitemap, sitemap_url)
+
+    def parse_sitemap(sitemap_url):
+        with open_sitemap(sitemap_url, session, timeout) as stream:
+            for kind, loc, lastmod in iter_sitemap_entries(stream):
+                if stopped.is_set():
+                    return
+                if kind == "sitemap":
+                    submit(parse_sitemap, loc)
+                else:
+                    put((loc, lastmod))
+
+    with create_session(pool_size=max_workers) as session:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            for robots_url in robots:
+                submit(parse_robots, robots_url)
+            for sitemap_url in sitemaps:
+                submit(parse_sitemap, sitemap_url)
+
+            while True:
+                with pending_lock:
+                    if not pending:
+                        break
+                item = entries.get()
+                if item is task_done:
+                    with pending_lock:
+                        pending -= 1
+                else:
+                    yield item
+        finally:
+            stopped.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def parse_lastmod(value):
+    """Parse a sitemap <lastmod> (W3C datetime) into a UNIX timestamp
+
+    Dates without a time zone are taken as UTC. Returns None for a missing
+    or malformed value.
+    """
+    try:
+        moment = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def iter_sitemap_rows(entries, normalization=None, lastmods=None):
+    """Turn (url, lastmod) sitemap entries into (url, weight) rows
+
+    URLs are canonicalized with the normalization rules, and when a lastmods
+    dict is given the newest lastmod of every URL is stored in it as a
+    timestamp, keyed by url_fingerprint().
+    """
+    for url, lastmod in entries:
+        if normalization:
+            url = normalize_url(url, normalization)
+        if lastmods is not None:
+            timestamp = parse_lastmod(lastmod)
+            if timestamp is not None:
+                key = url_fingerprint(url)
+                lastmods[key] = max(timestamp, lastmods.get(key, timestamp))
+        yield url, 0.0
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at `rate` tokens per second
+
+    Callers reserve a token and get back how long to wait before using it.
+    Tokens can be reserved ahead of time, so concurrent workers are queued
+    at evenly spaced slots instead of racing for the next refill.
+    """
+
+    def __init__(self, rate, capacity=1, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Take one token and return the seconds to wait before it is valid"""
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class RateLimiter:
+    """URLs-per-minute limit shared by all workers, optionally also per host"""
+
+    def __init__(
+        self, urls_per_minute=None, burst=1, per_host=None, clock=time.monotonic
+    ):
+        self.burst = burst
+        self.per_host = per_host
+        self.clock = clock
+        self.bucket = (
+            TokenBucket(urls_per_minute / 60, burst, clock) if urls_per_minute else None
+        )
+        self.host_buckets = {}
+        self.lock = threading.Lock()
+
+    def _host_bucket(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            bucket = self.host_buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(self.per_host / 60, self.burst, self.clock)
+                self.host_buckets[host] = bucket
+            return bucket
+
+    def reserve(self, url):
+        """Take a slot for url and return the seconds to wait before sending it"""
+        delay = self.bucket.reserve() if self.bucket else 0.0
+        if self.per_host:
+            delay = max(delay, self._host_bucket(url).reserve())
+        return delay
+
+    def acquire(self, url, sleep=time.sleep):
+        """Block the calling worker until url may be sent"""
+        delay = self.reserve(url)
+        if delay > 0:
+            sleep(delay)
+
+
+class ConcurrencyGate:
+    """Caps requests in flight across all stages, in total and per host"""
+
+    def __init__(self, max_concurrency=None, per_host=None):
+        self.total = (
+            threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        )
+        self.per_host = per_host
+        self.host_slots = {}
+        self.lock = threading.Lock()
+
+    def _host_slot(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            slot = self.host_slots.get(host)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.per_host)
+                self.host_slots[host] = slot
+            return slot
+
+    def acquire(self, url, blocking=True):
+        """Take a slot for url, returns False if blocking is off and none is free"""
+        # Always take the host slot first, so callers can't deadlock each other
+        host_slot = self._host_slot(url) if self.per_host else None
+        if host_slot is not None and not host_slot.acquire(blocking):
+            return False
+        if self.total is not None and not self.total.acquire(blocking):
+            if host_slot is not None:
+                host_slot.release()
+            return False
+        return True
+
+    def release(self, url):
+        if self.total is not None:
+            self.total.release()
+        if self.per_host:
+            self._host_slot(url).release()
+
+
+HEALTH_CHECK_KINDS = ("latency", "nginx", "fpm", "load")
+
+
+def parse_nginx_stub_status(text):
+    """Active connections on an nginx stub_status page"""
+    match = re.search(r"Active connections:\s*(\d+)", text)
+    if match is None:
+        raise ValueError("not an nginx stub_status page")
+    return int(match.group(1))
+
+
+def parse_fpm_status(text):
+    """Active processes on a PHP-FPM status page, plain text or ?json"""
+    try:
+        return int(json.loads(text)["active processes"])
+    except (ValueError, KeyError, TypeError):
+        pass
+    match = re.search(r"^active processes:\s*(\d+)", text, re.MULTILINE)
+    if match is None:
+        raise ValueError("not a PHP-FPM status page")
+    return int(match.group(1))
+
+
+def read_loadavg(filename="/proc/loadavg"):
+    """The 1 minute load average from a /proc/loadavg style file"""
+    with open(filename) as f:
+        return float(f.read().split()[0])
+
+
+def health_probe(kind, target, session, timeout=10):
+    """Return a function measuring the `kind` health signal at target
+
+    A status URL that fails or does not answer in time is as busy as it
+    gets: its latency probe returns infinity.
+    """
+    if kind == "load":
+        return lambda: read_loadavg(target or "/proc/loadavg")
+
+    def fetch():
+        response = session.get(target, timeout=timeout)
+        response.raise_for_status()
+        return response.text
+
+    if kind == "nginx":
+        return lambda: parse_nginx_stub_status(fetch())
+    if kind == "fpm":
+        return lambda: parse_fpm_status(fetch())
+
+    def latency():
+        start = time.perf_counter()
+        try:
+            fetch()
+        except _load_requests().RequestException:
+            return math.inf
+        return time.perf_counter() - start
+
+    return latency
+
+
+def parse_health_check(spec, session, timeout=10):
+    """Parse a --health-check "KIND=THRESHOLD[@TARGET]" into (label, limit, probe)"""
+    check, _, target = spec.partition("@")
+    kind, _, threshold = check.partition("=")
+    if kind not in HEALTH_CHECK_KINDS:
+        raise ValueError(
+            f"unknown kind '{kind}' in '{spec}', "
+            f"use one of {', '.join(HEALTH_CHECK_KINDS)}"
+        )
+    if kind != "load" and not target:
+        raise ValueError(
+            f"the {kind} check needs a status URL, e.g. {kind}={threshold}@URL"
+        )
+    label = f"{kind} {target or '/proc/loadavg'}"
+    return label, float(threshold), health_probe(kind, target, session, timeout)
+
+
+class HealthMonitor:
+    """Pauses warming while the origin is busy, polling health checks in the background
+
+    Every `interval` seconds each (label, threshold, probe) check is
+    measured. New requests wait as soon as one signal reaches its threshold
+    and go on once all are below `resume` times their threshold, so a
+    signal hovering around its threshold does not flip the state on every
+    poll. Requests already in flight finish. Checks that fail are reported
+    and left out.
+    """
+
+    def __init__(self, checks, interval=5, resume=0.8, out=print, clock=time.monotonic):
+        self.checks = checks
+        self.interval = interval
+        self.resume = resume
+        self.out = out
+        self.clock = clock
+        self.running = threading.Event()
+        self.running.set()
+        self.paused_since = None
+        self.paused_total = 0.0
+        self.pauses = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def check(self):
+        """Measure every signal once and pause or resume accordingly"""
+        busy = []
+        recovered = True
+        for label, threshold, probe in self.checks:
+            try:
+                value = probe()
+            except Exception as e:
+                self.out(f"Health check {label} failed: {e}")
+                continue
+            if value >= threshold:
+                busy.append(f"{label} at {value:g} (limit {threshold:g})")
+            if value >= threshold * self.resume:
+                recovered = False
+
+        with self.lock:
+            if busy and self.paused_since is None:
+                self.paused_since = self.clock()
+                self.pauses += 1
+                self.running.clear()
+                message = f"Origin busy, pausing: {', '.join(busy)}"
+            elif recovered and self.paused_since is not None:
+                paused = self._resume()
+                message = (
+                    f"Origin recovered, resuming after {format_duration(paused)} paused"
                 )
+            else:
+                return
+        self.out(message)
 
-        return config_data
-    except FileNotFoundError:
-        print(f"Error: Configuration file '{json_file}' not found.")
-        sys.exit(1)
-    except json.JSONDecodeError as e:
-        print(f"Error: Invalid JSON in configuration file: {e}")
-        sys.exit(1)
-    except Exception as e:
-        print(f"Error loading configuration from JSON: {e}")
-        sys.exit(1)
+    def _resume(self):
+        paused = self.clock() - self.paused_since
+        self.paused_total += paused
+        self.paused_since = None
+        self.running.set()
+        return paused
+
+    def paused_time(self):
+        """Seconds spent paused so far, including a pause still going on"""
+        with self.lock:
+            if self.paused_since is None:
+                return self.paused_total
+            return self.paused_total + self.clock() - self.paused_since
+
+    def is_paused(self):
+        return not self.running.is_set()
+
+    def wait(self):
+        """Block the calling worker while warming is paused"""
+        self.running.wait()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.check()
+
+    def start(self):
+        # Check before the first request, a run may start in a busy moment
+        self.check()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            if self.paused_since is not None:
+                self._resume()
+
+
+class RetryPolicy:
+    """Which failed requests to send again and how long to wait before each retry
+
+    Connection errors, timeouts and the given status codes are retried up
+    to `retries` times. The wait doubles with every attempt from `backoff`
+    seconds, capped at max_backoff, and is jittered over the whole range so
+    workers that failed together do not retry together.
+    """
+
+    def __init__(
+        self,
+        retries=2,
+        backoff=1.0,
+        max_backoff=30.0,
+        statuses=(429, 502, 503, 504),
+        sleep=time.sleep,
+        random=random.random,
+    ):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = frozenset(statuses)
+        self.sleep = sleep
+        self.random = random
+
+    def should_retry(self, result, attempt):
+        """Check whether a result of the attempt-th try (1-based) is retried"""
+        if attempt > self.retries or result.get("circuit_open"):
+            return False
+        return not result["success"] or result.get("status") in self.statuses
+
+    def delay(self, attempt):
+        """Seconds to wait after the attempt-th try (1-based) failed"""
+        return self.random() * min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+
+
+class CircuitBreaker:
+    """Per-host circuit breaker that fails URLs fast while their backend is down
+
+    After `failures` consecutive failed requests to a host (connection
+    errors, timeouts and 5xx responses) its circuit opens: its URLs fail at
+    once without a request. After reset_timeout seconds a single probe
+    request is let through, success closes the circuit and failure opens it
+    again. Shared by all workers and stages.
+    """
+
+    def __init__(self, failures=10, reset_timeout=30, clock=time.monotonic):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.hosts = {}
+        self.trips = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def is_failure(result):
+        return not result["success"] or (result.get("status") or 0) >= 500
+
+    def allow(self, url):
+        """Check whether a request to url may be sent now"""
+        host = urlparse(url).netloc
+        with self.lock:
+            circuit = self.hosts.get(host)
+            if circuit is None or circuit["opened_at"] is None:
+                return True
+            if circuit["probing"]:
+                return False
+            if self.clock() - circuit["opened_at"] < self.reset_timeout:
+                return False
+            circuit["probing"] = True
+            return True
+
+    def record(self, url, result):
+        """Feed the result of a request that allow() let through"""
+        host = urlparse(url).netloc
+        failed = self.is_failure(result)
+        with self.lock:
+            circuit = self.hosts.get(host)
+            if circuit is None:
+                if not failed:
+                    return
+                circuit = {"failed": 0, "opened_at": None, "probing": False}
+                self.hosts[host] = circuit
+            circuit["probing"] = False
+            if not failed:
+                circuit["failed"] = 0
+                circuit["opened_at"] = None
+                return
+            circuit["failed"] += 1
+            tripped = (
+                circuit["opened_at"] is None and circuit["failed"] >= self.failures
+            )
+            if circuit["opened_at"] is not None or tripped:
+                circuit["opened_at"] = self.clock()
+            if tripped:
+                self.trips += 1
+        if tripped:
+            print_block(
+                [
+                    f"Circuit breaker opened for {host} after {self.failures} "
+                    f"failed requests in a row, retrying in {self.reset_timeout:g}s"
+                ]
+            )
+
+
+def circuit_open_result(url):
+    """Result of a URL that was not requested because its circuit is open"""
+    return {
+        "url": url,
+        "status": None,
+        "success": False,
+        "error": "Circuit breaker open for this host",
+        "x_cache": "MISS",
+        "etag": None,
+        "last_modified": None,
+        "elapsed": 0.0,
+        "circuit_open": True,
+    }
+
+
+def warm_with_retries(url, warm_once, retry_policy=None, breaker=None):
+    """Warm a URL with warm_once(url), retrying and going through a circuit breaker
+
+    Returns the result of the last attempt made, with the number of
+    attempts in "attempts".
+    """
+    result = None
+    attempt = 0
+    while True:
+        if breaker is not None and not breaker.allow(url):
+            # Keep the real error when the circuit opened between retries
+            result = result or circuit_open_result(url)
+            break
+        result = warm_once(url)
+        attempt += 1
+        if breaker is not None:
+            breaker.record(url, result)
+        if retry_policy is None or not retry_policy.should_retry(result, attempt):
+            break
+        retry_policy.sleep(retry_policy.delay(attempt))
+    result["attempts"] = attempt
+    return result
+
+
+async def warm_with_retries_async(
+    url, warm_once, retry_policy=None, breaker=None, rate_limiter=None
+):
+    """Coroutine version of warm_with_retries for the asyncio engine
+
+    Retries take a new rate_limiter slot, the first attempt's slot is taken
+    before the task is created.
+    """
+    import asyncio
+
+    result = None
+    attempt = 0
+    while True:
+        if breaker is not None and not breaker.allow(url):
+            result = result or circuit_open_result(url)
+            break
+        result = await warm_once(url)
+        attempt += 1
+        if breaker is not None:
+            breaker.record(url, result)
+        if retry_policy is None or not retry_policy.should_retry(result, attempt):
+            break
+        delay = retry_policy.delay(attempt)
+        if rate_limiter:
+            delay = max(delay, rate_limiter.reserve(url))
+        await asyncio.sleep(delay)
+    result["attempts"] = attempt
+    return result
+
+
+class AdaptiveConcurrency:
+    """AIMD controller choosing how many requests to keep in flight
+
+    Every `window` results the p95 latency is computed. While it stays under
+    latency_ceiling seconds and below spike_ratio times the best p95 seen
+    since the last decrease (the latency gradient: the origin starts
+    queueing), the limit grows by one. Otherwise it is multiplied by
+    `backoff`, and so it is as soon as failed requests (5xx, 429, timeouts
+    and connection errors) make up more than error_ceiling of a window.
+    Results of requests that were already in flight when the limit dropped
+    are not held against the new limit.
+
+    The best p95 is kept per cache status, cached pages answer far faster
+    than uncached ones whatever the load, and measured again after every
+    decrease, so a run moving on to slower pages is not mistaken for an
+    overloaded origin for good.
+    """
+
+    def __init__(
+        self,
+        initial=5,
+        minimum=1,
+        maximum=64,
+        latency_ceiling=2.0,
+        error_ceiling=0.05,
+        window=20,
+        backoff=0.5,
+        spike_ratio=2.0,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(initial, maximum))
+        self.latency_ceiling = latency_ceiling
+        self.error_ceiling = error_ceiling
+        self.window = window
+        self.backoff = backoff
+        self.spike_ratio = spike_ratio
+        self.peak = self.limit
+        self.decreases = 0
+        self.baselines = {}
+        self.latencies = []
+        self.errors = 0
+        self.ignore = 0
+
+    @staticmethod
+    def is_error(result):
+        status = result.get("status")
+        return not result["success"] or status is None or status >= 500 or status == 429
+
+    def record(self, result):
+        """Feed one finished request to the controller"""
+        if result.get("circuit_open"):
+            # Not sent at all, says nothing about the load of the origin
+            return
+        if self.ignore:
+            self.ignore -= 1
+            return
+        self.latencies.append(
+            (cache_status(result.get("x_cache") or ""), result.get("elapsed") or 0.0)
+        )
+        if self.is_error(result):
+            self.errors += 1
+            if self.errors > self.error_ceiling * self.window:
+                self._decrease()
+                return
+        if len(self.latencies) < self.window:
+            return
+
+        if self._p95(elapsed for _, elapsed in self.latencies) > self.latency_ceiling:
+            self._decrease()
+            return
+        by_status = {}
+        for status, elapsed in self.latencies:
+            by_status.setdefault(status, []).append(elapsed)
+        for status, latencies in by_status.items():
+            # Too few results of a cache status in this window to tell
+            if len(latencies) < self.window // 2:
+                continue
+            p95 = self._p95(latencies)
+            baseline = self.baselines.get(status)
+            if baseline is None or p95 < baseline:
+                self.baselines[status] = baseline = p95
+            if p95 > baseline * self.spike_ratio:
+                self._decrease()
+                return
+        self.limit = min(self.limit + 1, self.maximum)
+        self.peak = max(self.peak, self.limit)
+        self._reset()
+
+    @staticmethod
+    def _p95(latencies):
+        latencies = sorted(latencies)
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    def _decrease(self):
+        # Requests sent under the old limit are still on their way
+        self.ignore = self.limit
+        self.limit = max(self.minimum, int(self.limit * self.backoff))
+        self.decreases += 1
+        self.baselines = {}
+        self._reset()
+
+    def _reset(self):
+        self.latencies = []
+        self.errors = 0
+
+    def format(self):
+        return (
+            f"Adaptive concurrency: settled at {self.limit} "
+            f"(peak {self.peak}, backed off {self.decreases} times)"
+        )
+
+
+def _require_aiohttp():
+    try:
+        import aiohttp  # noqa: F401
+    except ImportError:
+        print("Error: the asyncio engine requires aiohttp (pip install aiohttp)")
+        sys.exit(1)
+
+
+def iter_results_async(
+    urls,
+    concurrency=100,
+    timeout=50,
+    custom_headers=None,
+    custom_cookies=None,
+    rate_limiter=None,
+    gate=None,
+    url_headers=None,
+    retry_policy=None,
+    breaker=None,
+    fetch_mode="stream",
+    health=None,
+    request_trackers=(),
+):
+    """Warm URLs on an asyncio event loop and yield results as they complete
+
+    The generator drives its own event loop, which only runs while the
+    caller asks for the next result. At most `concurrency` requests are in
+    flight or waiting to be collected at once, all sharing one aiohttp
+    connection pool. Requires the aiohttp package.
+    """
+    _require_aiohttp()
+    import asyncio
+
+    import aiohttp
+
+    loop = asyncio.new_event_loop()
+    results = asyncio.Queue(maxsize=concurrency)
+    finished = object()
+
+    async def produce():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def warm_once(url):
+            # The gate and health monitor are shared with threads of other
+            # stages, so poll them instead of blocking the event loop
+            while health and health.is_paused():
+                await asyncio.sleep(0.1)
+            # Back off while the gate stays full, so waiting coroutines
+            # don't keep the loop busy
+            delay = 0.001
+            while gate and not gate.acquire(url, blocking=False):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.1)
+            try:
+                with _tracking_request(request_trackers):
+                    return await warm_url_async(
+                        session,
+                        url,
+                        request_headers(custom_headers, url_headers, url),
+                        request_cookies(custom_cookies, url),
+                        timeout,
+                        fetch_mode,
+                    )
+            finally:
+                if gate:
+                    gate.release(url)
+
+        async def run(url):
+            try:
+                result = await warm_with_retries_async(
+                    url, warm_once, retry_policy, breaker, rate_limiter
+                )
+                await results.put(result)
+            finally:
+                semaphore.release()
+
+        tasks = set()
+        cancelled = False
+        try:
+            # Bodies are thrown away, so skip decompressing them and never
+            # keep cookies set by responses between URLs
+            async with aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=concurrency, ssl=False),
+                cookie_jar=aiohttp.DummyCookieJar(),
+                auto_decompress=False,
+                trace_configs=[connect_trace_config()],
+            ) as session:
+                for url in urls:
+                    if rate_limiter:
+                        delay = rate_limiter.reserve(url)
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                    # Only create a task once a slot is free, so pending
+                    # coroutines never pile up for the whole URL list
+                    await semaphore.acquire()
+                    task = asyncio.create_task(run(url))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                if tasks:
+                    await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            # The consumer stopped early: stop the requests still in flight
+            # before the loop closes instead of leaving them pending
+            cancelled = True
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            if not cancelled:
+                await results.put(finished)
+
+    producer = loop.create_task(produce())
+    try:
+        while True:
+            result = loop.run_until_complete(results.get())
+            if result is finished:
+                break
+            yield result
+        # Re-raise anything that stopped the producer early
+        loop.run_until_complete(producer)
+    finally:
+        if not producer.done():
+            producer.cancel()
+            loop.run_until_complete(asyncio.gather(producer, return_exceptions=True))
+        loop.close()
+
+
+def process_urls_async(
+    urls,
+    concurrency=100,
+    timeout=50,
+    custom_headers=None,
+    custom_cookies=None,
+    rate_limit=None,
+    rate_limiter=None,
+    fetch_mode="stream",
+):
+    """Process URLs concurrently on a single asyncio event loop
+
+    At most `concurrency` requests are in flight at once, all sharing one
+    aiohttp connection pool. Requires the aiohttp package.
+    """
+    if rate_limiter is None and rate_limit:
+        rate_limiter = RateLimiter(rate_limit)
+
+    return list(
+        iter_results_async(
+            urls,
+            concurrency,
+            timeout,
+            custom_headers,
+            custom_cookies,
+            rate_limiter,
+            fetch_mode=fetch_mode,
+        )
+    )
+
+
+def iter_warm_results(
+    urls,
+    max_workers=5,
+    timeout=50,
+    custom_headers=None,
+    custom_cookies=None,
+    use_threads=True,
+    rate_limiter=None,
+    engine="threads",
+    concurrency=100,
+    max_in_flight=None,
+    progress=None,
+    gate=None,
+    url_headers=None,
+    adaptive=None,
+    retry_policy=None,
+    breaker=None,
+    fetch_mode="stream",
+    health=None,
+    request_trackers=(),
+):
+    """Warm URLs and yield each result as soon as it completes
+
+    urls may be any iterable and is consumed lazily. In threaded mode at
+    most max_in_flight futures (default: twice max_workers) exist at once,
+    so memory does not grow with the number of URLs, and results come back
+    in completion order so one slow URL never holds up the others.
+    An optional ProgressReporter is told about every finished URL, and it
+    and the request_trackers (e.g. StageMetrics) about every request while
+    it is actually sent, after rate limits and gates let it through. An
+    optional ConcurrencyGate caps requests shared with other stages.
+    url_headers maps URLs to extra headers sent with them only, such as
+    conditional request validators. With an AdaptiveConcurrency controller
+    (threaded mode only) the number of requests in flight follows its limit,
+    up to its maximum, instead of max_workers. A RetryPolicy sends failed
+    URLs again and a CircuitBreaker fails URLs of a down host fast.
+    fetch_mode says how response bodies are handled, see FETCH_MODES.
+    While a HealthMonitor is paused no new request is sent.
+    """
+    if progress is not None:
+        request_trackers = [progress, *request_trackers]
+
+    for result in _iter_warm_results(
+        urls,
+        max_workers,
+        timeout,
+        custom_headers,
+        custom_cookies,
+        use_threads,
+        rate_limiter,
+        engine,
+        concurrency,
+        max_in_flight,
+        gate,
+        url_headers,
+        adaptive,
+        retry_policy,
+        breaker,
+        fetch_mode,
+        health,
+        request_trackers,
+    ):
+        if progress is not None:
+            progress.completed()
+        yield result
+
+
+@contextlib.contextmanager
+def _tracking_request(trackers):
+    """Count a request as in flight with every tracker while it is sent"""
+    for tracker in trackers:
+        tracker.request_started()
+    try:
+        yield
+    finally:
+        for tracker in trackers:
+            tracker.request_finished()
+
+
+def request_headers(custom_headers, url_headers, url):
+    """Return the configuration's headers merged with the URL's own extra headers
+
+    A VariantURL adds the headers of its variant. Validators in url_headers
+    were recorded for a URL's base variant and are only sent with that one.
+    """
+    extra = url_headers.get(url) if url_headers else None
+    if isinstance(url, VariantURL):
+        if not url.is_base:
+            extra = None
+        if url.headers:
+            extra = {**url.headers, **(extra or {})}
+    if not extra:
+        return custom_headers
+    return {**(custom_headers or {}), **extra}
+
+
+def request_cookies(custom_cookies, url):
+    """Return the configuration's cookies merged with those of a VariantURL"""
+    if isinstance(url, VariantURL) and url.cookies:
+        return {**(custom_cookies or {}), **url.cookies}
+    return custom_cookies
+
+
+class VariantDimension:
+    """One way a page is cached in several variants, such as the currency
+
+    Every value sets the header or cookie `key` (None leaves it unset).
+    `vary` is the header name a response's Vary header has to list for the
+    cache to tell the values apart, None if it always does.
+    """
+
+    def __init__(self, name, target, key, values, vary):
+        self.name = name
+        self.target = target
+        self.key = key
+        self.values = values
+        self.vary = vary.lower() if vary else None
+
+
+def compile_variants(spec):
+    """Parse the "variants" list of a configuration into VariantDimensions
+
+    Each entry sets a "header" or a "cookie" to each of its "values", a list
+    or an object of labelled values. "vary" defaults to the header's name,
+    cookie dimensions are never pruned unless it is set (e.g. to "Cookie").
+    """
+    if not isinstance(spec, list):
+        raise ValueError("variants must be a list of dimensions")
+    dimensions = []
+    for i, entry in enumerate(spec):
+        if not isinstance(entry, dict) or ("header" in entry) == ("cookie" in entry):
+            raise ValueError(
+                f"Variant dimension at index {i} needs either a header or a cookie"
+            )
+        target = "header" if "header" in entry else "cookie"
+        key = entry[target]
+        values = entry.get("values")
+        if isinstance(values, dict):
+            values = list(values.items())
+        elif isinstance(values, list):
+            values = [
+                ("none" if value is None else str(value), value) for value in values
+            ]
+        if not values:
+            raise ValueError(f"Variant dimension at index {i} has no values")
+        vary = entry.get("vary", key if target == "header" else None)
+        dimensions.append(
+            VariantDimension(entry.get("name", key), target, key, values, vary)
+        )
+    return dimensions
+
+
+class VariantURL(str):
+    """A URL to warm with the headers and cookies of one cache variant
+
+    It compares and hashes like the plain URL, so rate limits, circuit
+    breakers and host matching treat it as that URL. combination holds the
+    index of the value used from every dimension.
+    """
+
+    def __new__(cls, url, combination, label, headers, cookies):
+        variant = super().__new__(cls, url)
+        variant.combination = combination
+        variant.label = label
+        variant.headers = headers
+        variant.cookies = cookies
+        return variant
+
+    @property
+    def is_base(self):
+        return not any(self.combination)
+
+
+class VariantPlanner:
+    """Expands a configuration's URLs lazily into its cache variants
+
+    Every URL is first warmed with the first value of each dimension, its
+    base variant. Once that result is back (see observe), the URL's other
+    combinations follow, but only across the dimensions the response's Vary
+    header names; the others would warm the same cache entry again. The
+    combinations of URLs whose base result came back after the last URL
+    was sent are left in pending, for drain() once all results are in. At
+    most one URL's combinations are generated at a time.
+    """
+
+    def __init__(self, dimensions):
+        self.dimensions = dimensions
+        self.size = math.prod(len(dimension.values) for dimension in dimensions)
+        self.pending = deque()
+        self.outstanding = set()
+        self.urls = 0
+        self.requests = 0
+        self.pruned = 0
+
+    def variant(self, url, combination):
+        headers = {}
+        cookies = {}
+        labels = []
+        for dimension, index in zip(self.dimensions, combination):
+            label, value = dimension.values[index]
+            labels.append(f"{dimension.name}={label}")
+            if value is not None:
+                (headers if dimension.target == "header" else cookies)[
+                    dimension.key
+                ] = value
+        self.requests += 1
+        return VariantURL(url, combination, ", ".join(labels), headers, cookies)
+
+    def relevant(self, result):
+        """Indexes of the dimensions result's cache entry varies on"""
+        vary = result.get("vary")
+        if vary is None or "*" in vary:
+            # Nothing learned from a failed request, warm every combination
+            return set(range(len(self.dimensions)))
+        return {
+            i
+            for i, dimension in enumerate(self.dimensions)
+            if dimension.vary is None or dimension.vary in vary
+        }
+
+    def combinations(self, url, relevant):
+        ranges = [
+            range(len(dimension.values)) if i in relevant else range(1)
+            for i, dimension in enumerate(self.dimensions)
+        ]
+        self.pruned += self.size - math.prod(len(values) for values in ranges)
+        # The first combination is the base variant, already warmed
+        for combination in itertools.islice(itertools.product(*ranges), 1, None):
+            yield self.variant(url, combination)
+
+    def observe(self, result):
+        """Queue the other variants of a URL once its base variant is back"""
+        url = result["url"]
+        if isinstance(url, VariantURL) and url.is_base and url in self.outstanding:
+            self.outstanding.discard(url)
+            self.pending.append(self.combinations(url, self.relevant(result)))
+
+    def drain(self):
+        while self.pending:
+            yield from self.pending[0]
+            self.pending.popleft()
+
+    def expand(self, urls):
+        """Yield the variants to warm for urls, base variants first"""
+        base = (0,) * len(self.dimensions)
+        for url in urls:
+            yield from self.drain()
+            self.urls += 1
+            self.outstanding.add(url)
+            yield self.variant(url, base)
+        yield from self.drain()
+
+    def format(self):
+        return (
+            f"Variants: {self.requests} requests for {self.urls} URLs, "
+            f"{self.pruned} combinations skipped as the cache does not vary on them"
+        )
+
+
+def _iter_warm_results(
+    urls,
+    max_workers,
+    timeout,
+    custom_headers,
+    custom_cookies,
+    use_threads,
+    rate_limiter,
+    engine,
+    concurrency,
+    max_in_flight,
+    gate,
+    url_headers,
+    adaptive,
+    retry_policy,
+    breaker,
+    fetch_mode,
+    health,
+    request_trackers,
+):
+    if adaptive is not None:
+        max_workers = adaptive.maximum
+
+    if engine == "asyncio":
+        yield from iter_results_async(
+            urls,
+            concurrency,
+            timeout,
+            custom_headers,
+            custom_cookies,
+            rate_limiter,
+            gate,
+            url_headers,
+            retry_policy,
+            breaker,
+            fetch_mode,
+            health,
+            request_trackers,
+        )
+        return
+
+    with create_session(pool_size=max_workers if use_threads else 1) as session:
+
+        def warm_once(url):
+            if health:
+                health.wait()
+            if rate_limiter:
+                rate_limiter.acquire(url)
+            if gate:
+                gate.acquire(url)
+            try:
+                with _tracking_request(request_trackers):
+                    return warm_url(
+                        url,
+                        request_headers(custom_headers, url_headers, url),
+                        request_cookies(custom_cookies, url),
+                        timeout,
+                        session=session,
+                        fetch_mode=fetch_mode,
+                    )
+            finally:
+                if gate:
+                    gate.release(url)
+
+        def warm(url):
+            return warm_with_retries(url, warm_once, retry_policy, breaker)
+
+        if not use_threads:
+            # Sequential processing without threads
+            for url in urls:
+                yield warm(url)
+            return
+
+        window = max_in_flight or max_workers * 2
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for url in urls:
+                # The controller only changes here, between results, so the
+                # window always reflects its latest limit
+                if adaptive is not None:
+                    window = adaptive.limit
+                while len(in_flight) >= window:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        result = future.result()
+                        if adaptive is not None:
+                            adaptive.record(result)
+                            window = adaptive.limit
+                        yield result
+                in_flight.add(executor.submit(warm, url))
+            for future in as_completed(in_flight):
+                result = future.result()
+                if adaptive is not None:
+                    adaptive.record(result)
+                yield result
+
+
+class ProgressReporter:
+    """Prints URLs done, requests in flight, rate and ETA every `interval` seconds
+
+    Reports come from a background thread, so they keep coming even while
+    every worker is stuck on a slow URL.
+    """
+
+    def __init__(
+        self, total=None, interval=10, out=print, clock=time.monotonic, label=None
+    ):
+        self.total = total
+        self.label = label
+        self.interval = interval
+        self.out = out
+        self.clock = clock
+        self.requests = 0
+        self.done = 0
+        self.started = clock()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def request_started(self):
+        with self.lock:
+            self.requests += 1
+
+    def request_finished(self):
+        with self.lock:
+            self.requests -= 1
+
+    def completed(self):
+        with self.lock:
+            self.done += 1
+
+    def format(self):
+        with self.lock:
+            requests, done = self.requests, self.done
+        elapsed = self.clock() - self.started
+        rate = done / elapsed if elapsed > 0 else 0.0
+        line = f"Progress [{self.label}]: " if self.label else "Progress: "
+        line += f"{done}"
+        if self.total:
+            line += f"/{self.total}"
+        line += f" done, {requests} in flight, {rate:.1f} URLs/s"
+        if self.total and rate > 0:
+            line += f", ETA {format_duration((self.total - done) / rate)}"
+        return line
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.out(self.format(), flush=True)
+
+    def start(self):
+        self.started = self.clock()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def format_duration(seconds):
+    """Format seconds as a short human readable duration, e.g. 1h 02m 03s"""
+    seconds = int(round(seconds))
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f"{hours}h {minutes:02d}m {seconds:02d}s"
+    if minutes:
+        return f"{minutes}m {seconds:02d}s"
+    return f"{seconds}s"
+
+
+def process_urls_threaded(
+    urls,
+    max_workers=5,
+    timeout=50,
+    custom_headers=None,
+    custom_cookies=None,
+    use_threads=True,
+    rate_limit=None,
+    engine="threads",
+    concurrency=100,
+    rate_limiter=None,
+    adaptive=None,
+    retry_policy=None,
+    breaker=None,
+    fetch_mode="stream",
+    health=None,
+):
+    """Process URLs in parallel using ThreadPoolExecutor or sequentially
+
+    All URLs of a call share one keep-alive session, so connections to the
+    same host are opened once and reused instead of once per URL. With
+    engine="asyncio" the URLs are warmed on an asyncio event loop instead.
+
+    rate_limit (URLs per minute) is applied in every mode through a token
+    bucket shared by all workers. Pass a RateLimiter instead to share it
+    across several calls or to add burst and per-host limits.
+
+    Pass an AdaptiveConcurrency controller to let origin latency and errors
+    pick the number of threads instead of max_workers, a RetryPolicy to
+    retry transient failures and a CircuitBreaker to fail fast on down hosts.
+    A started HealthMonitor holds new requests back while the origin is busy.
+
+    Returns the list of all results, see iter_warm_results to consume them
+    one at a time instead.
+    """
+    if rate_limiter is None and rate_limit:
+        rate_limiter = RateLimiter(rate_limit)
+
+    return list(
+        iter_warm_results(
+            urls,
+            max_workers=max_workers,
+            timeout=timeout,
+            custom_headers=custom_headers,
+            custom_cookies=custom_cookies,
+            use_threads=use_threads,
+            rate_limiter=rate_limiter,
+            engine=engine,
+            concurrency=concurrency,
+            adaptive=adaptive,
+            retry_policy=retry_policy,
+            breaker=breaker,
+            fetch_mode=fetch_mode,
+            health=health,
+        )
+    )
+
+
+def cache_status(x_cache):
+    """Classify an x-cache header as "HIT", "MISS" or "OTHER"
+
+    Chained caches append their status, e.g. "HIT, MISS" from a Fastly
+    shield and edge, so the last entry is the one of the cache the warmer
+    talked to.
+    """
+    last = x_cache.rpartition(",")[2].strip().upper()
+    if "HIT" in last:
+        return "HIT"
+    if "MISS" in last:
+        return "MISS"
+    return "OTHER"
+
+
+class LatencyHistogram:
+    """Bounded-memory latency histogram giving percentiles within ~5%
+
+    Durations are counted in logarithmic buckets, 16 per doubling, so
+    memory does not grow with the number of requests.
+    """
+
+    BUCKETS_PER_DOUBLING = 16
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        index = math.ceil(math.log2(max(seconds, 1e-6)) * self.BUCKETS_PER_DOUBLING)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percent):
+        """Upper bound of the bucket holding the given percentile, in seconds"""
+        if not self.count:
+            return None
+        rank = math.ceil(percent / 100 * self.count)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                break
+        return min(2 ** (index / self.BUCKETS_PER_DOUBLING), self.max)
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max if self.count else None,
+        }
+
+    def format(self):
+        return " / ".join(
+            f"{self.percentile(percent):.3f}s" for percent in (50, 95, 99)
+        )
+
+
+class StageStats:
+    """Running totals of one warming stage, updated one result at a time
+
+    Besides the counts it keeps latency histograms (overall, by status and
+    by cache status) and the slowest URLs, all in bounded memory.
+    """
+
+    SLOWEST = 10
+
+    def __init__(self):
+        self.processed = 0
+        self.hit_count = 0
+        self.miss_count = 0
+        self.not_modified = 0
+        self.skipped = 0
+        self.retried = 0
+        self.circuit_open = 0
+        self.bytes = 0
+        self.latency = LatencyHistogram()
+        self.connect = LatencyHistogram()
+        self.ttfb = LatencyHistogram()
+        self.by_status = {}
+        self.by_cache_status = {}
+        self.slowest = []
+        self.duration = None
+        self.concurrency = None
+        self.paused = None
+
+    def add(self, result):
+        self.processed += 1
+        if result.get("status") == 304:
+            self.not_modified += 1
+        if result.get("attempts", 1) > 1:
+            self.retried += 1
+        if result.get("circuit_open"):
+            self.circuit_open += 1
+        status = None
+        if result["success"] and result["x_cache"]:
+            status = cache_status(result["x_cache"])
+            if status == "HIT":
+                self.hit_count += 1
+            elif status == "MISS":
+                self.miss_count += 1
+        self.bytes += result.get("bytes") or 0
+
+        elapsed = result.get("elapsed")
+        if elapsed is None or result.get("circuit_open"):
+            return
+        self.latency.add(elapsed)
+        if result.get("connect") is not None:
+            self.connect.add(result["connect"])
+        if result.get("ttfb") is not None:
+            self.ttfb.add(result["ttfb"])
+        self._histogram(self.by_status, str(result.get("status") or "error")).add(
+            elapsed
+        )
+        if status is not None:
+            self._histogram(self.by_cache_status, status).add(elapsed)
+
+        entry = (elapsed, result["url"], result.get("status"), result["x_cache"])
+        if len(self.slowest) < self.SLOWEST:
+            heapq.heappush(self.slowest, entry)
+        elif entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+    @staticmethod
+    def _histogram(histograms, key):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = LatencyHistogram()
+        return histogram
+
+    def latency_lines(self):
+        """Summary lines with the p50 / p95 / p99 latencies"""
+        if not self.latency.count:
+            return []
+        lines = [
+            "Latency p50 / p95 / p99:",
+            f"  all: {self.latency.format()}",
+        ]
+        for status, histogram in sorted(self.by_cache_status.items()):
+            lines.append(f"  {status}: {histogram.format()}")
+        return lines
+
+    def to_dict(self):
+        return {
+            "duration": self.duration,
+            "concurrency": self.concurrency,
+            "paused": self.paused,
+            "processed": self.processed,
+            "hit": self.hit_count,
+            "miss": self.miss_count,
+            "not_modified": self.not_modified,
+            "skipped": self.skipped,
+            "retried": self.retried,
+            "circuit_open": self.circuit_open,
+            "bytes": self.bytes,
+            "latency": self.latency.to_dict(),
+            "connect": self.connect.to_dict(),
+            "ttfb": self.ttfb.to_dict(),
+            "by_status": {
+                status: histogram.to_dict()
+                for status, histogram in sorted(self.by_status.items())
+            },
+            "by_cache_status": {
+                status: histogram.to_dict()
+                for status, histogram in sorted(self.by_cache_status.items())
+            },
+            "slowest": [
+                {"url": url, "elapsed": elapsed, "status": status, "x_cache": x_cache}
+                for elapsed, url, status, x_cache in sorted(self.slowest, reverse=True)
+            ],
+        }
+
+
+class WarmState:
+    """Persistent warm history of every URL in an SQLite database
+
+    For each configuration and URL it stores when the URL was last warmed
+    successfully and the ETag / Last-Modified validators of the response,
+    and indexes the URL by the cache tags of the response, so purged tags
+    can be mapped back to pages (see urls_for_tags). One instance may be
+    shared by stages running in parallel. Writes are committed in batches
+    and by commit().
+    """
+
+    def __init__(self, filename, clock=time.time, batch_size=1000):
+        import sqlite3
+
+        self.clock = clock
+        self.batch_size = batch_size
+        self.uncommitted = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS warmed ("
+            "config TEXT NOT NULL, url TEXT NOT NULL, warmed_at REAL NOT NULL, "
+            "etag TEXT, last_modified TEXT, PRIMARY KEY (config, url))"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS tags ("
+            "tag TEXT NOT NULL, config TEXT NOT NULL, url TEXT NOT NULL, "
+            "PRIMARY KEY (tag, config, url)) WITHOUT ROWID"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS tags_by_url ON tags (config, url)")
+        self.db.commit()
+
+    def get(self, config, url):
+        """Return (warmed_at, etag, last_modified) of a URL, or None if never warmed"""
+        with self.lock:
+            return self.db.execute(
+                "SELECT warmed_at, etag, last_modified FROM warmed "
+                "WHERE config = ? AND url = ?",
+                (config, url),
+            ).fetchone()
+
+    def record(self, config, result):
+        """Store the outcome of warming a URL, failed and error responses are ignored"""
+        status = result.get("status")
+        if not result["success"] or status is None or status >= 400:
+            return
+        if status == 304:
+            # A 304 may omit the validators, the stored ones still apply
+            update = (
+                "etag = COALESCE(excluded.etag, etag), "
+                "last_modified = COALESCE(excluded.last_modified, last_modified)"
+            )
+        else:
+            update = "etag = excluded.etag, last_modified = excluded.last_modified"
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO warmed (config, url, warmed_at, etag, last_modified) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT (config, url) DO UPDATE SET "
+                f"warmed_at = excluded.warmed_at, {update}",
+                (
+                    config,
+                    result["url"],
+                    self.clock(),
+                    result.get("etag"),
+                    result.get("last_modified"),
+                ),
+            )
+            # A 304 carries no page, keep the tags of the last full response
+            if status != 304 and result.get("tags") is not None:
+                self.db.execute(
+                    "DELETE FROM tags WHERE config = ? AND url = ?",
+                    (config, result["url"]),
+                )
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO tags (tag, config, url) VALUES (?, ?, ?)",
+                    [(tag, config, result["url"]) for tag in result["tags"]],
+                )
+            self.uncommitted += 1
+            if self.uncommitted >= self.batch_size:
+                self.db.commit()
+                self.uncommitted = 0
+
+    def urls_for_tags(self, tags, chunk_size=500):
+        """Return the {config: set of URLs} of pages warmed with any of the tags"""
+        tags = list(tags)
+        pages = {}
+        with self.lock:
+            for start in range(0, len(tags), chunk_size):
+                chunk = tags[start : start + chunk_size]
+                rows = self.db.execute(
+                    "SELECT DISTINCT config, url FROM tags "
+                    f"WHERE tag IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                )
+                for config, url in rows:
+                    pages.setdefault(config, set()).add(url)
+        return pages
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+            self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+
+def plan_rewarm(urls, state, config, max_age=None, lastmods=None, conditional=False):
+    """Decide which URLs of a configuration need warming again
+
+    A URL warmed less than max_age seconds ago is skipped, unless its
+    sitemap lastmod (from lastmods, keyed by url_fingerprint()) is newer
+    than that warm. With conditional, the other URLs that have stored
+    validators get If-None-Match / If-Modified-Since headers, so a cache
+    that still holds them can answer 304 without a full response.
+    Returns (urls_to_warm, url_headers, skipped).
+    """
+    now = state.clock()
+    urls_to_warm = []
+    url_headers = {}
+    skipped = 0
+    for url in urls:
+        row = state.get(config, url)
+        if row is None:
+            urls_to_warm.append(url)
+            continue
+        warmed_at, etag, last_modified = row
+        lastmod = lastmods.get(url_fingerprint(url)) if lastmods else None
+        changed = lastmod is not None and lastmod > warmed_at
+        if not changed and max_age is not None and now - warmed_at < max_age:
+            skipped += 1
+            continue
+        urls_to_warm.append(url)
+        # A page known to have changed must not be answered from its old version
+        if conditional and not changed:
+            headers = {}
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+            if headers:
+                url_headers[url] = headers
+    return urls_to_warm, url_headers, skipped
+
+
+# Upper bounds of the request duration histogram buckets, in seconds
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for value in labels.values()
+    )
+    return (
+        "{"
+        + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped))
+        + "}"
+    )
+
+
+def _format_value(value):
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+class Metrics:
+    """Minimal Prometheus metrics registry of a warm run
+
+    render() returns the text exposition format, served on /metrics by
+    start_metrics_server() or written as a node-exporter textfile by
+    write_metrics_textfile(). Stages update it through stage(name).
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.started = clock()
+        self.finished = None
+        self.success = None
+        self.requests = {}
+        self.in_flight = {}
+        self.durations = {}
+        self.bytes = {}
+        self.skipped = {}
+        self.stage_urls = {}
+        self.stage_durations = {}
+
+    def stage(self, name):
+        return StageMetrics(self, name)
+
+    def finish(self, success):
+        with self.lock:
+            self.finished = self.clock()
+            self.success = success
+
+    def render(self):
+        with self.lock:
+            families = [
+                (
+                    "warmer_requests_total",
+                    "counter",
+                    "Warm requests by stage, HTTP status and cache status",
+                    [
+                        (
+                            {"stage": stage, "status": status, "cache_status": cache},
+                            count,
+                        )
+                        for (stage, status, cache), count in sorted(
+                            self.requests.items()
+                        )
+                    ],
+                ),
+                (
+                    "warmer_requests_in_flight",
+                    "gauge",
+                    "Warm requests sent and not finished yet",
+                    [
+                        ({"stage": stage}, count)
+                        for stage, count in sorted(self.in_flight.items())
+                    ],
+                ),
+                (
+                    "warmer_response_bytes_total",
+                    "counter",
+                    "Response body bytes read",
+                    [
+                        ({"stage": stage}, count)
+                        for stage, count in sorted(self.bytes.items())
+                    ],
+                ),
+                (
+                    "warmer_urls_skipped_total",
+                    "counter",
+                    "URLs skipped as recently warmed and unchanged",
+                    [
+                        ({"stage": stage}, count)
+                        for stage, count in sorted(self.skipped.items())
+                    ],
+                ),
+                (
+                    "warmer_stage_urls",
+                    "gauge",
+                    "URLs a stage set out to warm",
+                    [
+                        ({"stage": stage}, count)
+                        for stage, count in sorted(self.stage_urls.items())
+                    ],
+                ),
+                (
+                    "warmer_stage_duration_seconds",
+                    "gauge",
+                    "Wall time of finished stages",
+                    [
+                        ({"stage": stage}, seconds)
+                        for stage, seconds in sorted(self.stage_durations.items())
+                    ],
+                ),
+                (
+                    "warmer_run_start_timestamp_seconds",
+                    "gauge",
+                    "UNIX time the run started",
+                    [({}, self.started)],
+                ),
+            ]
+            if self.finished is not None:
+                families += [
+                    (
+                        "warmer_run_end_timestamp_seconds",
+                        "gauge",
+                        "UNIX time the run finished",
+                        [({}, self.finished)],
+                    ),
+                    (
+                        "warmer_run_success",
+                        "gauge",
+                        "1 if the run finished without an error, 0 otherwise",
+                        [({}, int(self.success))],
+                    ),
+                ]
+            durations = sorted(self.durations.items())
+
+        lines = []
+        for name, kind, help_text, samples in families:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            lines += [
+                f"{name}{_format_labels(labels)} {_format_value(value)}"
+                for labels, value in samples
+            ]
+
+        name = "warmer_request_duration_seconds"
+        lines += [
+            f"# HELP {name} Warm request durations by stage and cache status",
+            f"# TYPE {name} histogram",
+        ]
+        for (stage, cache), (buckets, total, count) in durations:
+            labels = {"stage": stage, "cache_status": cache}
+            for bound, bucket_count in zip(DURATION_BUCKETS, buckets):
+                bucket_labels = _format_labels({**labels, "le": repr(bound)})
+                lines.append(f"{name}_bucket{bucket_labels} {bucket_count}")
+            lines.append(
+                f'{name}_bucket{_format_labels({**labels, "le": "+Inf"})} {count}'
+            )
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+class StageMetrics:
+    """Updates the Metrics of one stage, works as a progress tracker too"""
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def start(self, urls, skipped=0):
+        with self.metrics.lock:
+            self.metrics.stage_urls[self.name] = urls
+            self.metrics.in_flight[self.name] = 0
+            self.metrics.skipped[self.name] = skipped
+
+    def request_started(self):
+        with self.metrics.lock:
+            self.metrics.in_flight[self.name] = (
+                self.metrics.in_flight.get(self.name, 0) + 1
+            )
+
+    def request_finished(self):
+        with self.metrics.lock:
+            self.metrics.in_flight[self.name] = (
+                self.metrics.in_flight.get(self.name, 0) - 1
+            )
+
+    def observe(self, result):
+        status = str(result.get("status") or "error")
+        cache = cache_status(result["x_cache"]) if result["success"] else "none"
+        elapsed = result.get("elapsed")
+        metrics = self.metrics
+        with metrics.lock:
+            key = (self.name, status, cache)
+            metrics.requests[key] = metrics.requests.get(key, 0) + 1
+            metrics.bytes[self.name] = metrics.bytes.get(self.name, 0) + (
+                result.get("bytes") or 0
+            )
+            if elapsed is None or result.get("circuit_open"):
+                return
+            histogram = metrics.durations.get((self.name, cache))
+            if histogram is None:
+                histogram = [[0] * len(DURATION_BUCKETS), 0.0, 0]
+                metrics.durations[(self.name, cache)] = histogram
+            # Buckets are cumulative, as the exposition format wants them
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if elapsed <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += elapsed
+            histogram[2] += 1
+
+    def finish(self, duration):
+        with self.metrics.lock:
+            self.metrics.stage_durations[self.name] = duration
+
+
+def start_metrics_server(metrics, port, address="0.0.0.0"):
+    """Serve metrics on http://address:port/metrics from a background thread
+
+    Returns the server, call shutdown() on it when the run is over.
+    """
+    # Only --metrics-port needs the HTTP server, which is slow to import
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.partition("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_metrics_textfile(metrics, filename):
+    """Write the metrics for the node-exporter textfile collector
+
+    The file is replaced atomically, so the collector never reads half of it.
+    """
+    temporary = f"{filename}.tmp"
+    with open(temporary, "w") as f:
+        f.write(metrics.render())
+    os.replace(temporary, filename)
+
+
+def read_json_config(json_file):
+    """Read the JSON configuration file with its optional global settings
+
+    The file is either a list of configurations or an object with a
+    "configurations" list and an optional "normalization" section.
+    Returns a dict with both keys.
+    """
+    try:
+        with open(json_file, "r") as f:
+            config_data = json.load(f)
+
+        settings = {"normalization": None}
+        if isinstance(config_data, dict) and "configurations" in config_data:
+            settings["normalization"] = config_data.get("normalization")
+            config_data = config_data["configurations"]
+
+        # Validate the structure of the loaded configuration
+        if not isinstance(config_data, list):
+            raise ValueError("JSON configuration must be a list of configurations")
+
+        for i, config in enumerate(config_data):
+            if "name" not in config or "headers" not in config:
+                raise ValueError(
+                    f"Configuration at index {i} is missing required fields 'name' and/or 'headers'"
+                )
+
+        for config in config_data:
+            if config.get("variants"):
+                config["variants"] = compile_variants(config["variants"])
+
+        if settings["normalization"]:
+            settings["normalization"] = compile_normalization_rules(
+                settings["normalization"]
+            )
+
+        settings["configurations"] = config_data
+        return settings
+    except FileNotFoundError:
+        print(f"Error: Configuration file '{json_file}' not found.")
+        sys.exit(1)
+    except json.JSONDecodeError as e:
+        print(f"Error: Invalid JSON in configuration file: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"Error loading configuration from JSON: {e}")
+        sys.exit(1)
+
+
+def load_config_from_json(json_file):
+    """Load configuration from JSON file"""
+    return read_json_config(json_file)["configurations"]
+
+
+# Parsed configurations of a --serve worker by path, with the modification
+# time and size they were read at
+_settings_cache = None
+
+
+def load_settings(json_file):
+    """read_json_config, reusing the last parse while the file is unchanged
+
+    Only a --serve worker keeps parsed configurations, every other run reads
+    its file once anyway.
+    """
+    if _settings_cache is None:
+        return read_json_config(json_file)
+    try:
+        status = os.stat(json_file)
+    except OSError:
+        return read_json_config(json_file)
+    path = os.path.abspath(json_file)
+    version = (status.st_mtime_ns, status.st_size)
+    cached = _settings_cache.get(path)
+    if cached is None or cached[0] != version:
+        cached = _settings_cache[path] = (version, read_json_config(json_file))
+    return cached[1]
+
+
+DEFAULT_NORMALIZATION = {
+    "lowercase_host": True,
+    "remove_default_port": True,
+    "trailing_slash": "remove",
+    "sort_query": True,
+    "drop_query_params": ["utm_*", "gclid", "fbclid"],
+    "drop_fragment": True,
+}
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def compile_normalization_rules(rules):
+    """Merge normalization rules over the defaults and precompile them
+
+    rules may be True to use the defaults as they are, or a dict that
+    overrides some of them.
+    """
+    compiled = dict(DEFAULT_NORMALIZATION)
+    if isinstance(rules, dict):
+        unknown = set(rules) - set(DEFAULT_NORMALIZATION)
+        if unknown:
+            raise ValueError(
+                f"Unknown normalization rules: {', '.join(sorted(unknown))}"
+            )
+        compiled.update(rules)
+    elif rules is not True:
+        raise ValueError("normalization must be true or an object of rules")
+
+    if compiled["trailing_slash"] not in ("remove", "add", "keep"):
+        raise ValueError("normalization trailing_slash must be remove, add or keep")
+
+    patterns = compiled["drop_query_params"]
+    compiled["drop_query_params"] = (
+        re.compile("|".join(fnmatch.translate(p) for p in patterns), re.IGNORECASE)
+        if patterns
+        else None
+    )
+    return compiled
+
+
+def _query_key(segment):
+    """Decoded parameter name of a raw "key=value" query string segment"""
+    return unquote_plus(segment.partition("=")[0])
+
+
+def normalize_url(url, rules):
+    """Canonicalize a URL so equivalent variants collapse into one
+
+    rules come from compile_normalization_rules.
+    """
+    scheme, netloc, path, query, fragment = urlsplit(url)
+    scheme = scheme.lower()
+
+    if rules["lowercase_host"]:
+        netloc = netloc.lower()
+    if rules["remove_default_port"]:
+        host, colon, port = netloc.rpartition(":")
+        if colon and port.isdigit() and int(port) == _DEFAULT_PORTS.get(scheme):
+            netloc = host
+
+    if rules["trailing_slash"] == "remove":
+        if len(path) > 1:
+            path = path.rstrip("/") or "/"
+    elif rules["trailing_slash"] == "add":
+        # Leave file-like paths such as /product.html alone
+        if not path.endswith("/") and "." not in path.rsplit("/", 1)[-1]:
+            path += "/"
+    if not path:
+        path = "/"
+
+    if query:
+        # Match and sort parameters by their decoded key, but keep each one
+        # encoded the way it came in: bare keys, "+" and reserved characters
+        # are part of the cache key real visitors hit
+        segments = query.split("&")
+        params = segments
+        dropped = rules["drop_query_params"]
+        if dropped is not None:
+            params = [
+                segment for segment in params if not dropped.match(_query_key(segment))
+            ]
+        if rules["sort_query"]:
+            params = sorted(params, key=_query_key)
+        if params != segments:
+            query = "&".join(params)
+
+    if rules["drop_fragment"]:
+        fragment = ""
+
+    return urlunsplit((scheme, netloc, path, query, fragment))
+
+
+def extract_base_url_from_config(config):
+    """Extract base URL from configuration (removing protocol and trailing slashes)"""
+    website_base_url = config.get("website_base_url", "")
+    if not website_base_url:
+        return ""
+
+    # Remove protocol (http:// or https://)
+    if website_base_url.startswith("http://"):
+        base_url = website_base_url[7:]
+    elif website_base_url.startswith("https://"):
+        base_url = website_base_url[8:]
+    else:
+        base_url = website_base_url
+
+    # Remove trailing slashes
+    base_url = base_url.rstrip("/")
+
+    # If there's a path after the domain, remove it to get just the domain + port
+    if "/" in base_url:
+        # Find where the domain ends and path begins (before any slash)
+        parts = base_url.split("/", 1)
+        base_url = parts[0]  # Take only the part before the first slash
+
+    return base_url
+
+
+def extract_base_url_from_url(url):
+    """Extract base URL from full URL (removing protocol and trailing slashes)"""
+    try:
+        parsed = urlparse(url)
+        if parsed.netloc:
+            # Reconstruct the base URL without protocol
+            base_url = f"{parsed.netloc}"
+            return base_url
+    except Exception:
+        pass
+    return None
+
+
+def match_urls_by_base_url(urls, config):
+    """Match URLs by their base URL against configuration's website_base_url"""
+    # Get the base URL from configuration
+    config_base_url = extract_base_url_from_config(config)
+
+    if not config_base_url:
+        return urls  # Return all URLs if no base URL specified
+
+    matched_urls = []
+    for url in urls:
+        url_base = extract_base_url_from_url(url)
+        if url_base and url_base == config_base_url:
+            matched_urls.append(url)
+
+    return matched_urls
+
+
+def bucket_urls_by_host(urls):
+    """Index URLs by their base URL (host and port) in a single pass
+
+    Returns a dict of base URL -> list of URLs, in their original order.
+    """
+    buckets = {}
+    for url in urls:
+        url_base = extract_base_url_from_url(url)
+        if url_base:
+            bucket = buckets.get(url_base)
+            if bucket is None:
+                buckets[url_base] = [url]
+            else:
+                bucket.append(url)
+    return buckets
+
+
+def urls_for_config(buckets, config, all_urls):
+    """Look up the URLs of a configuration's website_base_url in the host buckets
+
+    Same result as match_urls_by_base_url(all_urls, config) without parsing
+    any URL again.
+    """
+    config_base_url = extract_base_url_from_config(config)
+
+    if not config_base_url:
+        return all_urls  # Return all URLs if no base URL specified
+
+    return buckets.get(config_base_url, [])
+
+
+_print_lock = threading.Lock()
+
+
+def print_block(lines):
+    """Print lines in one piece, so output of parallel stages never interleaves"""
+    with _print_lock:
+        print("\n".join(lines), flush=True)
+
+
+def run_stage(
+    number,
+    config,
+    urls_to_warm,
+    args,
+    rate_limiter=None,
+    gate=None,
+    weights=None,
+    state=None,
+    lastmods=None,
+    breaker=None,
+    metrics=None,
+    on_result=None,
+    health=None,
+):
+    """Warm one configuration's URLs and print its summary
+
+    With weights, URLs are warmed hottest first (see iter_by_priority).
+    With a WarmState, URLs warmed recently and unchanged since are skipped
+    (see plan_rewarm) and every successful warm is recorded. A
+    CircuitBreaker is shared with the other stages, as hosts may be.
+    With Metrics, the stage's requests are counted in them as they finish.
+    on_result(number, config name, result) is called for every result, a
+    worker uses it to stream results to its coordinator. A HealthMonitor
+    shared by all stages pauses them while the origin is busy. The cache
+    variants of a configuration with "variants" share the stage's pool (see
+    VariantPlanner).
+    Returns the stage's StageStats, or None when no URL matched.
+    """
+    header = [
+        f"\n{'=' * 50}",
+        f"STAGE {number}: {config['name']} Configuration",
+        f"{'=' * 50}",
+    ]
+
+    if not urls_to_warm:
+        print_block(header + ["No matching URLs found for this configuration."])
+        return None
+
+    url_headers = None
+    skipped = 0
+    if state is not None:
+        max_age = args.skip_recent * 3600 if args.skip_recent else None
+        urls_to_warm, url_headers, skipped = plan_rewarm(
+            urls_to_warm,
+            state,
+            config["name"],
+            max_age=max_age,
+            lastmods=lastmods,
+            conditional=args.conditional,
+        )
+        if skipped:
+            header.append(
+                f"Skipped {skipped} URLs warmed in the last {args.skip_recent:g} "
+                "hours and unchanged since"
+            )
+    stage_metrics = None
+    if metrics is not None:
+        stage_metrics = metrics.stage(config["name"])
+        stage_metrics.start(len(urls_to_warm), skipped)
+
+    if not urls_to_warm:
+        print_block(header + ["All matching URLs are up to date."])
+        stats = StageStats()
+        stats.skipped = skipped
+        return stats
+
+    print_block(
+        header
+        + [
+            f"Configuration '{config['name']}' will warm up {len(urls_to_warm)} URLs",
+            "Starting to warm up URLs...",
+        ]
+    )
+
+    # Warm up URLs in parallel
+    start_time = time.time()
+
+    # Cache variants are expanded per URL as the URLs are sent, their total
+    # is only known at the end
+    planner = VariantPlanner(config["variants"]) if config.get("variants") else None
+
+    progress = None
+    if args.progress_interval > 0:
+        progress = ProgressReporter(
+            total=len(urls_to_warm) if planner is None else None,
+            interval=args.progress_interval,
+            out=lambda line, **kwargs: print_block([line]),
+            label=f"Stage {number}" if args.parallel_stages > 1 else None,
+        ).start()
+
+    # Every stage tunes its own concurrency, stages may hit different origins
+    adaptive = None
+    if args.adaptive_concurrency:
+        adaptive = AdaptiveConcurrency(
+            initial=args.threads,
+            maximum=args.max_threads,
+            latency_ceiling=args.latency_ceiling,
+            error_ceiling=args.error_ceiling,
+        )
+
+    retry_policy = None
+    if args.retries:
+        retry_policy = RetryPolicy(
+            args.retries, backoff=args.retry_backoff, statuses=args.retry_statuses
+        )
+
+    urls = iter_by_priority(urls_to_warm, weights) if weights else urls_to_warm
+    if planner is not None:
+        urls = planner.expand(urls)
+
+    # Results are counted as they stream in instead of being collected first
+    stats = StageStats()
+    stats.skipped = skipped
+    paused_before = health.paused_time() if health is not None else 0.0
+    try:
+        batch = urls
+        while batch is not None:
+            for result in iter_warm_results(
+                batch,
+                max_workers=args.threads,
+                timeout=args.timeout,
+                custom_headers=config["headers"],
+                custom_cookies=config.get("cookies", {}),
+                use_threads=(args.without_async == 0),
+                rate_limiter=rate_limiter,
+                engine=args.engine,
+                concurrency=args.concurrency,
+                progress=progress,
+                gate=gate,
+                url_headers=url_headers,
+                adaptive=adaptive,
+                retry_policy=retry_policy,
+                breaker=breaker,
+                fetch_mode=args.fetch_mode,
+                health=health,
+                request_trackers=[stage_metrics] if stage_metrics is not None else [],
+            ):
+                stats.add(result)
+                if stage_metrics is not None:
+                    stage_metrics.observe(result)
+                if planner is not None:
+                    planner.observe(result)
+                    result["variant"] = result["url"].label
+                # Validators and tags are kept for the base variant of a URL only
+                if state is not None and (planner is None or result["url"].is_base):
+                    state.record(config["name"], result)
+                if on_result is not None:
+                    on_result(number, config["name"], result)
+            # Variants of the URLs whose base result came in after the last
+            # URL was sent, on a second, short pass
+            batch = None
+            if planner is not None and planner.pending:
+                batch = planner.drain()
+    finally:
+        if progress is not None:
+            progress.stop()
+        if state is not None:
+            state.commit()
+
+    end_time = time.time()
+    stats.duration = end_time - start_time
+    if health is not None:
+        stats.paused = health.paused_time() - paused_before
+    if stage_metrics is not None:
+        stage_metrics.finish(stats.duration)
+    if adaptive is not None:
+        stats.concurrency = adaptive.limit
+
+    summary = ["-" * 50]
+    if args.parallel_stages > 1:
+        summary.append(f"STAGE {number}: {config['name']} Configuration")
+    summary += [
+        "FINAL SUMMARY:",
+        f"Total URLs processed: {stats.processed}",
+        f"Cache HIT: {stats.hit_count}",
+        f"Cache MISS: {stats.miss_count}",
+    ]
+    if args.conditional:
+        summary.append(f"Not modified (304): {stats.not_modified}")
+    if retry_policy is not None:
+        summary.append(f"Retried: {stats.retried}")
+    if breaker is not None:
+        summary.append(f"Failed fast (circuit open): {stats.circuit_open}")
+    if adaptive is not None:
+        summary.append(adaptive.format())
+    if planner is not None:
+        summary.append(planner.format())
+    if health is not None:
+        summary.append(
+            f"Paused while the origin was busy: {format_duration(stats.paused)}"
+        )
+    summary += stats.latency_lines()
+    summary.append(f"Total time: {end_time - start_time:.2f} seconds")
+    print_block(summary)
+    return stats
+
+
+def build_report(stages, duration):
+    """Machine-readable run report from (number, config name, StageStats) tuples
+
+    Stages without matching URLs have None stats and are left out.
+    """
+    stage_reports = [
+        {"number": number, "name": name, **stats.to_dict()}
+        for number, name, stats in stages
+        if stats is not None
+    ]
+    totals = {
+        key: sum(stage[key] for stage in stage_reports)
+        for key in (
+            "processed",
+            "hit",
+            "miss",
+            "not_modified",
+            "skipped",
+            "retried",
+            "circuit_open",
+            "bytes",
+        )
+    }
+    return {
+        "finished": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "duration": duration,
+        "totals": totals,
+        "stages": stage_reports,
+    }
+
+
+def write_report(report, filename=None, stream=None):
+    """Write the report as JSON to filename atomically, or to stream without one
+
+    stream defaults to stdout.
+    """
+    if filename is None:
+        print(json.dumps(report), file=stream)
+        return
+    temporary = f"{filename}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(temporary, filename)
+
+
+def parse_address(value, default_host=""):
+    """Parse "HOST:PORT" (or just "PORT" with a default host) into a tuple"""
+    host, _, port = value.rpartition(":")
+    host = host.strip("[]") or default_host
+    if not host:
+        raise ValueError(f"Address {value} has no host")
+    return host, int(port)
+
+
+def _send_message(stream, message):
+    stream.write(json.dumps(message, default=str) + "\n")
+    stream.flush()
+
+
+def _serve_worker(connection, shard, shards, urls, weights, lastmods, merge):
+    """Send a worker its shard, then merge the results it streams back
+
+    Returns True when the worker reported it finished its shard.
+    """
+    with connection, connection.makefile("rw", encoding="utf-8") as stream:
+        _send_message(stream, {"shard": shard, "shards": shards, "urls": len(urls)})
+        for url in urls:
+            message = {"url": url}
+            if weights is not None:
+                message["weight"] = weights.get(url_fingerprint(url), 0.0)
+            if lastmods:
+                lastmod = lastmods.get(url_fingerprint(url))
+                if lastmod is not None:
+                    message["lastmod"] = lastmod
+            stream.write(json.dumps(message) + "\n")
+        _send_message(stream, {"end": True})
+
+        for line in stream:
+            message = json.loads(line)
+            if message.get("done"):
+                return True
+            merge(message)
+    return False
+
+
+def run_coordinator(
+    server,
+    workers,
+    all_urls,
+    weights=None,
+    lastmods=None,
+    metrics=None,
+    connect_timeout=None,
+):
+    """Split the URLs into `workers` shards and hand one to each connecting worker
+
+    server is a listening socket. Workers get their shard in the order they
+    connect and run the stages on it (see CoordinatorClient); their results
+    are merged per stage as they stream in, and counted in the Metrics when
+    given. Shards whose worker did not connect within connect_timeout
+    seconds are not handed out. Returns ({stage number: StageStats},
+    unfinished shard numbers).
+    """
+    shards = [[] for _ in range(workers)]
+    for url in all_urls:
+        shards[shard_of(url, workers)].append(url)
+
+    lock = threading.Lock()
+    merged = {}
+
+    def merge(message):
+        with lock:
+            stats = merged.get(message["stage"])
+            if stats is None:
+                stats = merged[message["stage"]] = StageStats()
+                stats.duration = 0.0
+            if "result" in message:
+                stats.add(message["result"])
+                if metrics is not None:
+                    metrics.stage(message["name"]).observe(message["result"])
+            else:
+                # A worker finished the stage, it lasts as long as the slowest one
+                stats.skipped += message["skipped"]
+                stats.duration = max(stats.duration, message["duration"] or 0.0)
+
+    finished = {}
+    threads = []
+    deadline = None
+    if connect_timeout:
+        deadline = time.monotonic() + connect_timeout
+    for shard in range(1, workers + 1):
+        if deadline is not None:
+            server.settimeout(max(deadline - time.monotonic(), 0.001))
+        try:
+            connection, peer = server.accept()
+        except socket.timeout:
+            print_block(
+                [
+                    f"Error: Only {shard - 1} of {workers} workers connected "
+                    f"within {connect_timeout:g} seconds"
+                ]
+            )
+            for missing in range(shard, workers + 1):
+                finished[missing] = False
+            break
+        print(
+            f"Worker {peer[0]}:{peer[1]} connected, sending shard {shard}/{workers} "
+            f"with {len(shards[shard - 1])} URLs",
+            flush=True,
+        )
+
+        def serve(connection=connection, shard=shard):
+            try:
+                finished[shard] = _serve_worker(
+                    connection,
+                    shard,
+                    workers,
+                    shards[shard - 1],
+                    weights,
+                    lastmods,
+                    merge,
+                )
+            except (OSError, ValueError) as e:
+                print_block([f"Error: Worker of shard {shard}/{workers} failed: {e}"])
+                finished[shard] = False
+
+        thread = threading.Thread(target=serve, daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    return merged, [shard for shard in sorted(finished) if not finished[shard]]
+
+
+class CoordinatorClient:
+    """A worker's connection to the coordinator, see run_coordinator()
+
+    Results are sent as they come, from any number of stage threads.
+    """
+
+    def __init__(self, address, timeout=None):
+        self.connection = socket.create_connection(address, timeout=timeout)
+        self.connection.settimeout(None)
+        self.stream = self.connection.makefile("rw", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def receive_shard(self, lastmods=None):
+        """Read the shard: returns (shard, shards, urls, weights)
+
+        weights is None unless the coordinator weighs URLs, lastmods of the
+        URLs are added to the lastmods dict when one is given.
+        """
+        line = self.stream.readline()
+        if not line:
+            raise ConnectionError("Coordinator closed the connection")
+        header = json.loads(line)
+        urls = []
+        weights = None
+        for line in self.stream:
+            message = json.loads(line)
+            if message.get("end"):
+                break
+            url = message["url"]
+            urls.append(url)
+            if "weight" in message:
+                if weights is None:
+                    weights = {}
+                weights[url_fingerprint(url)] = message["weight"]
+            if lastmods is not None and "lastmod" in message:
+                lastmods[url_fingerprint(url)] = message["lastmod"]
+        else:
+            raise ConnectionError("Coordinator closed the connection mid-shard")
+        return header["shard"], header["shards"], urls, weights
+
+    def send_result(self, number, name, result):
+        with self.lock:
+            _send_message(
+                self.stream, {"stage": number, "name": name, "result": result}
+            )
+
+    def finish(self, stages, all_stats):
+        """Report each stage's skipped URLs and time, then that the shard is done"""
+        with self.lock:
+            for (number, config, _), stats in zip(stages, all_stats):
+                if stats is not None:
+                    _send_message(
+                        self.stream,
+                        {
+                            "stage": number,
+                            "name": config["name"],
+                            "skipped": stats.skipped,
+                            "duration": stats.duration,
+                        },
+                    )
+            _send_message(self.stream, {"done": True})
+
+    def close(self):
+        self.stream.close()
+        self.connection.close()
+
+
+def collect_urls(args, settings):
+    """Read the URLs of all sources given on the command line, each once
+
+    Returns (all_urls, weights, lastmods), weights and lastmods being None
+    when no source or option needs them.
+    """
+    # Each URL is kept once, even if it is listed in several files or sources
+    seen = set()
+    weights = {} if args.weight_column is not None or args.access_log else None
+    all_urls = read_unique_urls(
+        args.files,
+        seen=seen,
+        normalization=settings["normalization"],
+        weight_column=args.weight_column,
+        weights=weights,
+    )
+
+    if args.access_log:
+        # Hit counts become weights, so the most visited pages go first
+        ignore_agents = compile_agent_patterns(args.access_log_ignore_agent)
+        if args.access_log_state:
+            log_state = load_log_state(args.access_log_state)
+            top_urls = read_access_logs_incremental(
+                args.access_log,
+                log_state,
+                top=args.access_log_top,
+                base_url=args.access_log_base_url,
+                ignore_agents=ignore_agents,
+                half_life=args.access_log_half_life,
+            )
+            save_log_state(args.access_log_state, log_state)
+        else:
+            top_urls = read_access_logs(
+                args.access_log,
+                top=args.access_log_top,
+                base_url=args.access_log_base_url,
+                ignore_agents=ignore_agents,
+            )
+        found, _ = add_unique_urls(
+            top_urls, all_urls, seen, settings["normalization"], weights
+        )
+        print(
+            f"Found {found} URLs in the top {args.access_log_top} of the access logs."
+        )
+
+    # Sitemap lastmod dates tell which recently warmed pages changed since,
+    # a coordinator passes them on to its workers
+    lastmods = {} if args.state_db or args.coordinator else None
+    if args.sitemap or args.robots:
+        print("Fetching sitemaps.")
+        # Pages are added while the remaining sitemaps are still downloading,
+        # the rows are already normalized
+        found, duplicates = add_unique_urls(
+            iter_sitemap_rows(
+                iter_sitemap_urls(
+                    args.sitemap,
+                    robots=args.robots,
+                    max_workers=args.threads,
+                    timeout=args.timeout,
+                ),
+                settings["normalization"],
+                lastmods,
+            ),
+            all_urls,
+            seen,
+            weights=weights,
+        )
+        message = f"Found {found} URLs in the sitemaps."
+        if duplicates:
+            message += f" Skipped {duplicates} duplicate URLs."
+        print(message)
+
+    return all_urls, weights, lastmods
+
+
+def warm_stages(
+    args, stages, weights=None, lastmods=None, metrics=None, on_result=None
+):
+    """Run the (number, config, urls) stages, returns the StageStats of each
+
+    Stages run one after another, or --parallel-stages at a time, sharing
+    one rate limiter, concurrency gate, circuit breaker, health monitor and
+    warm state.
+    """
+    # One limiter for the whole run, so the rate holds across all stages
+    rate_limiter = None
+    if args.rate_limit or args.rate_limit_per_host:
+        rate_limiter = RateLimiter(
+            args.rate_limit,
+            burst=args.rate_limit_burst,
+            per_host=args.rate_limit_per_host,
+        )
+
+    gate = None
+    if args.parallel_stages > 1 or args.max_concurrency or args.per_host_concurrency:
+        # A stage has --concurrency requests in flight on the asyncio engine
+        stage_limit = args.concurrency if args.engine == "asyncio" else args.threads
+        gate = ConcurrencyGate(
+            args.max_concurrency or stage_limit * args.parallel_stages,
+            per_host=args.per_host_concurrency,
+        )
+
+    # One breaker for the whole run, stages of a down host all fail fast
+    breaker = None
+    if args.circuit_breaker_failures:
+        breaker = CircuitBreaker(
+            args.circuit_breaker_failures, reset_timeout=args.circuit_breaker_reset
+        )
+
+    # One monitor for the whole run, a busy origin pauses every stage
+    health = None
+    if args.health_check:
+        session = create_session(pool_size=1)
+        health = HealthMonitor(
+            [
+                parse_health_check(spec, session, args.timeout)
+                for spec in args.health_check
+            ],
+            interval=args.health_interval,
+            resume=args.health_resume,
+            out=lambda line: print_block([line]),
+        ).start()
+
+    state = WarmState(args.state_db) if args.state_db else None
+    stage_args = (
+        args,
+        rate_limiter,
+        gate,
+        weights,
+        state,
+        lastmods,
+        breaker,
+        metrics,
+        on_result,
+        health,
+    )
+    try:
+        if args.parallel_stages > 1:
+            with ThreadPoolExecutor(max_workers=args.parallel_stages) as executor:
+                futures = [
+                    executor.submit(run_stage, number, config, urls, *stage_args)
+                    for number, config, urls in stages
+                ]
+                return [future.result() for future in futures]
+        return [
+            run_stage(number, config, urls, *stage_args)
+            for number, config, urls in stages
+        ]
+    finally:
+        if state is not None:
+            state.close()
+        if health is not None:
+            health.stop()
+            session.close()
+
+
+def start_metrics(args):
+    """Metrics of the run and their --metrics-port server, None when not asked for"""
+    metrics = None
+    metrics_server = None
+    if args.metrics_port is not None or args.metrics_textfile:
+        metrics = Metrics()
+    if args.metrics_port is not None:
+        metrics_server = start_metrics_server(
+            metrics, args.metrics_port, args.metrics_address
+        )
+        print(f"Serving metrics on port {metrics_server.server_address[1]}")
+    return metrics, metrics_server
+
+
+def stop_metrics(args, metrics, metrics_server, success):
+    """Finish the metrics of the run, write their textfile and stop their server"""
+    if metrics is not None:
+        metrics.finish(success)
+        if args.metrics_textfile:
+            write_metrics_textfile(metrics, args.metrics_textfile)
+    if metrics_server is not None:
+        metrics_server.shutdown()
+        metrics_server.server_close()
+
+
+def parse_change_event(line):
+    """Parse one change feed line into (urls, tags)
+
+    A line is a JSON object with "url" / "urls" and "tag" / "tags" keys,
+    or just a URL. Returns None for blank or unreadable lines.
+    """
+    line = line.strip()
+    if not line:
+        return None
+    if is_warmable_url(line):
+        return [line], []
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(event, dict):
+        return None
+
+    def values(*keys):
+        found = []
+        for key in keys:
+            value = event.get(key)
+            if isinstance(value, str):
+                found.append(value)
+            elif isinstance(value, list):
+                found.extend(item for item in value if isinstance(item, str))
+        return found
+
+    urls = [url for url in values("url", "urls") if is_warmable_url(url)]
+    tags = values("tag", "tags")
+    if not (urls or tags):
+        return None
+    return urls, tags
+
+
+def follow_file(filename, lines, stop, poll_interval=0.5):
+    """Put the lines appended to a file, or written to a FIFO, on the lines queue
+
+    A regular file is read from its end on, like tail -F, and from its
+    start again once it is rotated or truncated. A FIFO is opened again for
+    the next writer whenever one closes it. Runs until stop is set.
+    """
+    inode = None
+    position = 0
+    while not stop.is_set():
+        try:
+            status = os.stat(filename)
+        except FileNotFoundError:
+            stop.wait(poll_interval)
+            continue
+        if stat.S_ISFIFO(status.st_mode):
+            # Blocks until a writer opens the FIFO, ends when it closes it
+            with open(filename, encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    lines.put(line)
+            continue
+
+        if status.st_ino != inode or status.st_size < position:
+            # Events written before the first look are not replayed
+            position = status.st_size if inode is None else 0
+            inode = status.st_ino
+        if status.st_size > position:
+            with open(filename, "rb") as f:
+                f.seek(position)
+                data = f.read()
+            # A line still being written is left for the next poll
+            end = data.rfind(b"\n") + 1
+            for line in data[:end].decode("utf-8", "replace").splitlines():
+                lines.put(line)
+            position += end
+        stop.wait(poll_interval)
+
+
+def serve_change_feed(address, lines):
+    """Accept change feed lines on a Unix socket path or a (host, port) TCP address
+
+    Every connection may send any number of lines. Returns the server,
+    which runs on a daemon thread until shutdown().
+    """
+    import socketserver
+
+    class ChangeFeedHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                self.server.lines.put(line.decode("utf-8", "replace"))
+
+    class ChangeFeedUnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+    class ChangeFeedTCPServer(socketserver.ThreadingTCPServer):
+        daemon_threads = True
+        allow_reuse_address = True
+
+    if isinstance(address, str):
+        # A socket left behind by a previous daemon would block the bind
+        if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+            os.unlink(address)
+        server = ChangeFeedUnixServer(address, ChangeFeedHandler)
+    else:
+        server = ChangeFeedTCPServer(address, ChangeFeedHandler)
+    server.lines = lines
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def iter_change_batches(
+    lines, quiet=2.0, max_wait=10.0, stop=None, clock=time.monotonic
+):
+    """Group change feed lines from a queue into batches of (urls, tags) sets
+
+    A batch closes once no event came for `quiet` seconds, or `max_wait`
+    seconds after its first event, so a burst of saves and purges becomes
+    a single warm of every page once. Stops when stop is set.
+    """
+    while stop is None or not stop.is_set():
+        try:
+            event = parse_change_event(lines.get(timeout=0.5))
+        except queue.Empty:
+            continue
+        if event is None:
+            continue
+        urls, tags = set(event[0]), set(event[1])
+        started = clock()
+        while True:
+            remaining = min(quiet, started + max_wait - clock())
+            if remaining <= 0:
+                break
+            try:
+                event = parse_change_event(lines.get(timeout=remaining))
+            except queue.Empty:
+                break
+            if event is not None:
+                urls.update(event[0])
+                tags.update(event[1])
+        yield urls, tags
+
+
+def change_stages(configurations, urls, tags, normalization=None, index=None):
+    """Stages warming the pages a batch of changes affects
+
+    Changed URLs are warmed with every configuration of their host, pages
+    found for the tags in the index (a WarmState) with the configurations
+    they were warmed with. Returns the (number, config, urls) stages that
+    have URLs.
+    """
+    if normalization:
+        urls = {normalize_url(url, normalization) for url in urls}
+    urls = sorted(urls)
+    buckets = bucket_urls_by_host(urls)
+    tagged = index.urls_for_tags(tags) if index is not None and tags else {}
+    stages = []
+    for i, config in enumerate(configurations):
+        pages = set(urls_for_config(buckets, config, urls))
+        pages.update(tagged.get(config["name"], ()))
+        if pages:
+            stages.append((i + 1, config, sorted(pages)))
+    return stages
+
+
+def follow_changes(args, settings, lines, stop, metrics=None):
+    """Warm the pages affected by every batch of change events until stop is set
+
+    Tags are resolved through the --state-db index, which every warm,
+    including these, keeps up to date.
+    """
+    index = WarmState(args.state_db)
+    try:
+        for urls, tags in iter_change_batches(
+            lines, args.follow_quiet, args.follow_max_wait, stop
+        ):
+            stages = change_stages(
+                settings["configurations"], urls, tags, settings["normalization"], index
+            )
+            pages = sum(len(stage_urls) for _, _, stage_urls in stages)
+            print_block(
+                [
+                    f"\nChanges: {len(urls)} URLs and {len(tags)} tags, "
+                    f"{pages} pages to warm"
+                ]
+            )
+            if stages:
+                warm_stages(args, stages, metrics=metrics)
+            if metrics is not None and args.metrics_textfile:
+                write_metrics_textfile(metrics, args.metrics_textfile)
+    finally:
+        index.close()
+
+
+def follow(args, settings, feed_address=None):
+    """Run --follow until interrupted or terminated
+
+    Lines come from a socket at feed_address, or from the --follow file.
+    """
+    lines = queue.Queue()
+    stop = threading.Event()
+    if feed_address is not None:
+        feed = serve_change_feed(feed_address, lines)
+        print(f"Listening for changes on {args.follow}", flush=True)
+    else:
+        feed = None
+        threading.Thread(
+            target=follow_file, args=(args.follow, lines, stop), daemon=True
+        ).start()
+        print(f"Following changes in {args.follow}", flush=True)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    metrics, metrics_server = start_metrics(args)
+    try:
+        follow_changes(args, settings, lines, stop, metrics)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        if feed is not None:
+            feed.shutdown()
+            feed.server_close()
+            if isinstance(feed_address, str) and os.path.exists(feed_address):
+                os.unlink(feed_address)
+        stop_metrics(args, metrics, metrics_server, success=True)
+    print("Stopped following changes.")
+
+
+class _JobOutput(io.TextIOBase):
+    """Text stream sending each line written to it to a --serve client
+
+    Lines go out as {"output": LINE} JSON lines. Once the client is gone the
+    output is dropped and the job carries on.
+    """
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.pending = ""
+        self.connected = True
+        self.lock = threading.Lock()
 
+    def writable(self):
+        return True
 
-def extract_base_url_from_config(config):
-    """Extract base URL from configuration (removing protocol and trailing slashes)"""
-    website_base_url = config.get("website_base_url", "")
-    if not website_base_url:
-        return ""
+    def send(self, message):
+        if not self.connected:
+            return
+        try:
+            self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+            self.wfile.flush()
+        except OSError:
+            self.connected = False
 
-    # Remove protocol (http:// or https://)
-    if website_base_url.startswith("http://"):
-        base_url = website_base_url[7:]
-    elif website_base_url.startswith("https://"):
-        base_url = website_base_url[8:]
-    else:
-        base_url = website_base_url
+    def write(self, text):
+        with self.lock:
+            *lines, self.pending = (self.pending + text).split("\n")
+            for line in lines:
+                self.send({"output": line})
+        return len(text)
 
-    # Remove trailing slashes
-    base_url = base_url.rstrip("/")
+    def finish(self, code):
+        """Send what is left of the last line and the job's exit code"""
+        with self.lock:
+            if self.pending:
+                self.send({"output": self.pending})
+                self.pending = ""
+            self.send({"exit": code})
 
-    # If there's a path after the domain, remove it to get just the domain + port
-    if "/" in base_url:
-        # Find where the domain ends and path begins (before any slash)
-        parts = base_url.split("/", 1)
-        base_url = parts[0]  # Take only the part before the first slash
 
-    return base_url
+def run_job(argv, out):
+    """Run main() on argv in this process with its output written to out
 
+    Standard error goes to out as well, so usage errors reach the client.
+    Returns the exit code the run would have had as its own process.
+    """
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+        try:
+            main(argv, job=True)
+        except SystemExit as e:
+            if e.code is None or isinstance(e.code, int):
+                return e.code or 0
+            print(e.code)
+            return 1
+        except Exception:
+            traceback.print_exc(file=out)
+            return 1
+    return 0
 
-def extract_base_url_from_url(url):
-    """Extract base URL from full URL (removing protocol and trailing slashes)"""
-    import urllib.parse
 
+def serve(path):
+    """Run warming jobs sent to the Unix socket at path until terminated
+
+    Every connection sends one job, a JSON line {"argv": [...]} with the
+    command line arguments of a run, and reads the run's output back as
+    {"output": LINE} lines followed by {"exit": CODE}. Jobs run one at a
+    time in this process, so the interpreter, the imports and the parsed
+    configuration files are shared by all of them.
+    """
+    global _settings_cache
+
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX)
+        try:
+            probe.connect(path)
+        except OSError:
+            # Left behind by a worker that did not shut down cleanly
+            os.unlink(path)
+        else:
+            print(f"Error: Another worker is already serving on {path}")
+            sys.exit(1)
+        finally:
+            probe.close()
+
+    import socketserver
+
+    class JobHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            out = _JobOutput(self.wfile)
+            try:
+                argv = json.loads(self.rfile.readline())["argv"]
+                if not isinstance(argv, list) or not all(
+                    isinstance(arg, str) for arg in argv
+                ):
+                    raise ValueError("argv must be a list of strings")
+            except (ValueError, KeyError, TypeError) as e:
+                out.write(f'Error: A job is a JSON line {{"argv": [...]}}: {e}\n')
+                out.finish(1)
+                return
+            print(f"Running job: {' '.join(argv)}", flush=True)
+            start_time = time.monotonic()
+            code = run_job(argv, out)
+            out.finish(code)
+            print(
+                f"Job finished with exit code {code} "
+                f"in {time.monotonic() - start_time:.2f} seconds",
+                flush=True,
+            )
+
+    _settings_cache = {}
+    _load_requests()
+    server = socketserver.UnixStreamServer(path, JobHandler)
+    # Stop like on Ctrl+C, a running job is abandoned and its client sees the
+    # connection close without an exit code
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    print(f"Serving warming jobs on {path}", flush=True)
     try:
-        parsed = urllib.parse.urlparse(url)
-        if parsed.netloc:
-            # Reconstruct the base URL without protocol
-            base_url = f"{parsed.netloc}"
-            return base_url
-    except Exception:
+        server.serve_forever()
+    except KeyboardInterrupt:
         pass
-    return None
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+    print("Stopped serving.")
 
 
-def match_urls_by_base_url(urls, config):
-    """Match URLs by their base URL against configuration's website_base_url"""
-    # Get the base URL from configuration
-    config_base_url = extract_base_url_from_config(config)
+def coordinate(
+    address,
+    workers,
+    stages,
+    all_urls,
+    weights=None,
+    lastmods=None,
+    metrics=None,
+    connect_timeout=None,
+):
+    """Hand the URLs to workers connecting on address, print each stage's summary
 
-    if not config_base_url:
-        return urls  # Return all URLs if no base URL specified
+    Returns (StageStats of every stage, unfinished shard numbers).
+    """
+    with socket.create_server(address) as server:
+        print(
+            f"Waiting for {workers} workers on port {server.getsockname()[1]}",
+            flush=True,
+        )
+        merged, unfinished = run_coordinator(
+            server, workers, all_urls, weights, lastmods, metrics, connect_timeout
+        )
 
-    matched_urls = []
-    for url in urls:
-        url_base = extract_base_url_from_url(url)
-        if url_base and url_base == config_base_url:
-            matched_urls.append(url)
+    all_stats = [merged.get(number) for number, _, _ in stages]
+    for (number, config, _), stats in zip(stages, all_stats):
+        if stats is None:
+            continue
+        if metrics is not None:
+            stage_metrics = metrics.stage(config["name"])
+            stage_metrics.start(stats.processed, stats.skipped)
+            stage_metrics.finish(stats.duration)
+        print_block(
+            [
+                "-" * 50,
+                f"STAGE {number}: {config['name']} Configuration (all shards)",
+                f"Total URLs processed: {stats.processed}",
+                f"Cache HIT: {stats.hit_count}",
+                f"Cache MISS: {stats.miss_count}",
+            ]
+            + stats.latency_lines()
+            + [f"Total time: {stats.duration:.2f} seconds"]
+        )
+    return all_stats, unfinished
 
-    return matched_urls
 
+def main(argv=None, job=False):
+    """Run the warmer with the command line arguments argv (default: sys.argv)
 
-def main():
+    job is set for the runs of a --serve worker.
+    """
     parser = argparse.ArgumentParser(description="URL Cache Warmer")
     parser.add_argument(
-        "--files", nargs="+", required=True, help="CSV files containing URLs to warm up"
+        "--files",
+        nargs="+",
+        default=[],
+        help="CSV files containing URLs to warm up (.gz files are decompressed)",
+    )
+    parser.add_argument(
+        "--sitemap",
+        nargs="+",
+        default=[],
+        help="Sitemap or sitemap index URLs to warm the pages of (.xml.gz sitemaps are decompressed)",
+    )
+    parser.add_argument(
+        "--robots",
+        nargs="+",
+        default=[],
+        help="robots.txt URLs (or store base URLs) whose Sitemap: entries are warmed",
+    )
+    parser.add_argument(
+        "--access-log",
+        nargs="+",
+        default=[],
+        help="nginx access logs (.gz files are decompressed) to warm the most visited pages of, without an intermediate CSV",
+    )
+    parser.add_argument(
+        "--access-log-top",
+        type=int,
+        default=500,
+        help="Number of most visited pages taken from the access logs (default: 500)",
+    )
+    parser.add_argument(
+        "--access-log-base-url",
+        help="Base URL (e.g. https://magento.local) prepended to path-only requests in the access logs",
+    )
+    parser.add_argument(
+        "--access-log-state",
+        help="State file for incremental parsing: only log lines added since the last run are read, and hit counts are merged into a persisted, decaying popularity table",
+    )
+    parser.add_argument(
+        "--access-log-half-life",
+        type=float,
+        default=24,
+        help="Hours after which past hit counts weigh half in the popularity table (default: 24)",
+    )
+    parser.add_argument(
+        "--access-log-ignore-agent",
+        nargs="+",
+        default=[],
+        help="Regular expressions of user agents (or whole log lines) to ignore in the access logs",
+    )
+    parser.add_argument(
+        "--weight-column",
+        type=int,
+        default=None,
+        help="CSV column (0-based, URLs are column 0) with a hit count or weight, URLs are then warmed highest weight first",
+    )
+    parser.add_argument(
+        "--state-db",
+        help="SQLite file keeping when each URL was last warmed and its ETag / Last-Modified validators, created if missing",
+    )
+    parser.add_argument(
+        "--skip-recent",
+        type=float,
+        default=None,
+        help="Skip URLs warmed in the last HOURS unless their sitemap lastmod is newer (requires --state-db)",
+    )
+    parser.add_argument(
+        "--conditional",
+        action="store_true",
+        help="Send If-None-Match / If-Modified-Since with the stored validators, a 304 counts as warm (requires --state-db)",
     )
     parser.add_argument(
         "--threads", type=int, default=5, help="Number of threads to use (default: 5)"
     )
+    parser.add_argument(
+        "--adaptive-concurrency",
+        action="store_true",
+        help="Adjust the number of threads to the origin: start at --threads, grow while latency and errors stay low, back off on 5xx, timeouts and latency spikes",
+    )
+    parser.add_argument(
+        "--max-threads",
+        type=int,
+        default=64,
+        help="Upper bound for --adaptive-concurrency (default: 64)",
+    )
+    parser.add_argument(
+        "--latency-ceiling",
+        type=float,
+        default=2.0,
+        help="p95 response time in seconds above which --adaptive-concurrency backs off (default: 2.0)",
+    )
+    parser.add_argument(
+        "--error-ceiling",
+        type=float,
+        default=0.05,
+        help="Share of failed requests above which --adaptive-concurrency backs off (default: 0.05)",
+    )
+    parser.add_argument(
+        "--fetch-mode",
+        choices=FETCH_MODES,
+        default="stream",
+        help="How page bodies are fetched: full (buffered), stream (read in chunks and discarded), headers (connection closed after the headers) or head (HEAD requests) (default: stream)",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=0,
+        help="Times a URL is retried after a connection error, timeout or a --retry-statuses response (default: 0, no retries)",
+    )
+    parser.add_argument(
+        "--retry-backoff",
+        type=float,
+        default=1.0,
+        help="Base of the jittered exponential wait between retries in seconds (default: 1.0)",
+    )
+    parser.add_argument(
+        "--retry-statuses",
+        type=int,
+        nargs="+",
+        default=[429, 502, 503, 504],
+        help="HTTP status codes that are retried (default: 429 502 503 504)",
+    )
+    parser.add_argument(
+        "--circuit-breaker-failures",
+        type=int,
+        default=0,
+        help="Failed requests in a row after which a host's URLs fail fast without a request (default: 0, no circuit breaker)",
+    )
+    parser.add_argument(
+        "--circuit-breaker-reset",
+        type=float,
+        default=30,
+        help="Seconds before a probe request is sent to a host whose circuit is open (default: 30)",
+    )
+    parser.add_argument(
+        "--health-check",
+        nargs="+",
+        default=[],
+        help="Pause sending while the origin is busy, KIND=THRESHOLD[@TARGET] with KIND latency (status URL response seconds), nginx (stub_status active connections), fpm (PHP-FPM status active processes) or load (1 minute load average of a loadavg file, default /proc/loadavg)",
+    )
+    parser.add_argument(
+        "--health-interval",
+        type=float,
+        default=5,
+        help="Seconds between --health-check polls (default: 5)",
+    )
+    parser.add_argument(
+        "--health-resume",
+        type=float,
+        default=0.8,
+        help="Resume once every --health-check is below this share of its threshold (default: 0.8)",
+    )
     parser.add_argument(
         "--timeout",
         type=int,
@@ -213,8 +4250,7 @@ def main():
     )
     parser.add_argument(
         "--json-config",
-        help="Path to JSON configuration file with warming configurations",
-        required=True,
+        help="Path to JSON configuration file with warming configurations (required unless --serve)",
     )
     parser.add_argument(
         "--without-async",
@@ -228,95 +4264,407 @@ def main():
         default=None,
         help="Rate limit for URL warming in URLs per minute (e.g., --rate-limit 100 for 100 URLs/minute)",
     )
+    parser.add_argument(
+        "--rate-limit-burst",
+        type=int,
+        default=1,
+        help="Number of URLs that may be sent at once before --rate-limit pacing applies (default: 1)",
+    )
+    parser.add_argument(
+        "--rate-limit-per-host",
+        type=int,
+        default=None,
+        help="Additional rate limit in URLs per minute applied to each host separately",
+    )
+    parser.add_argument(
+        "--progress-interval",
+        type=int,
+        default=10,
+        help="Seconds between progress reports while a stage runs, 0 disables them (default: 10)",
+    )
+    parser.add_argument(
+        "--report",
+        choices=["text", "json"],
+        default="text",
+        help="json also writes a machine-readable report with latency percentiles by status and cache status and the slowest URLs (default: text)",
+    )
+    parser.add_argument(
+        "--report-file",
+        help="File the --report json report is written to, instead of stdout (the text output then goes to stderr)",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=None,
+        help="Serve Prometheus metrics on http://ADDRESS:PORT/metrics while the run lasts",
+    )
+    parser.add_argument(
+        "--metrics-address",
+        default="0.0.0.0",
+        help="Address the --metrics-port endpoint listens on (default: 0.0.0.0)",
+    )
+    parser.add_argument(
+        "--metrics-textfile",
+        help="Write Prometheus metrics of the run to this file at the end, for the node-exporter textfile collector (use a .prom name)",
+    )
+    parser.add_argument(
+        "--parallel-stages",
+        type=int,
+        default=1,
+        help="Number of configurations (stages) warmed at the same time (default: 1)",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=None,
+        help="Maximum requests in flight across all stages (default: threads x "
+        "parallel stages, concurrency x parallel stages with --engine asyncio)",
+    )
+    parser.add_argument(
+        "--per-host-concurrency",
+        type=int,
+        default=None,
+        help="Maximum requests in flight to a single host across all stages",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["threads", "asyncio"],
+        default="threads",
+        help="Warming engine: a thread pool or a single asyncio event loop, which requires aiohttp (default: threads)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=100,
+        help="Maximum requests in flight with --engine asyncio (default: 100)",
+    )
+    parser.add_argument(
+        "--follow",
+        help="Run as a daemon warming the pages of a change feed: a JSONL file or FIFO path, unix:PATH or tcp:[ADDRESS:]PORT to listen on. Lines hold purged URLs and cache tags, tags are resolved through the --state-db index it requires",
+    )
+    parser.add_argument(
+        "--follow-quiet",
+        type=float,
+        default=2.0,
+        help="Seconds without a new change event after which --follow warms the changes so far (default: 2)",
+    )
+    parser.add_argument(
+        "--follow-max-wait",
+        type=float,
+        default=10.0,
+        help="Longest --follow waits after the first change event of a batch before warming it (default: 10)",
+    )
+    parser.add_argument(
+        "--shard",
+        help="Warm only shard i of N (e.g. 2/4) of the URLs, split by a stable hash so N hosts or processes run with --shard 1/N ... N/N warm every URL once",
+    )
+    parser.add_argument(
+        "--coordinator",
+        help="Read the URLs, wait for --workers workers on [ADDRESS:]PORT, hand each one shard and merge their results into the summary, without warming itself",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of workers a --coordinator waits for, the URLs are split into as many shards",
+    )
+    parser.add_argument(
+        "--workers-timeout",
+        type=float,
+        default=300,
+        help="Seconds a --coordinator waits for all --workers to connect, the shards of missing workers are reported as unfinished, 0 waits forever (default: 300)",
+    )
+    parser.add_argument(
+        "--worker",
+        help="Warm the shard of URLs handed out by the coordinator at HOST:PORT and stream the results back to it",
+    )
+    parser.add_argument(
+        "--serve",
+        metavar="SOCKET",
+        help="Stay running and warm the jobs sent to this Unix socket, each with its own command line arguments",
+    )
+
+    args = parser.parse_args(argv)
+
+    has_sources = args.files or args.access_log or args.sitemap or args.robots
+    if args.worker and has_sources:
+        print(
+            "Error: A --worker gets its URLs from the coordinator, "
+            "do not pass URL sources"
+        )
+        sys.exit(1)
+
+    if args.follow and has_sources:
+        print(
+            "Error: --follow gets its URLs from the change feed, "
+            "do not pass URL sources"
+        )
+        sys.exit(1)
+
+    if job and (args.serve or args.follow):
+        print("Error: --serve and --follow cannot run as a job of a --serve worker")
+        sys.exit(1)
+
+    if args.serve:
+        if (
+            has_sources
+            or args.json_config
+            or args.shard
+            or args.coordinator
+            or args.worker
+            or args.follow
+        ):
+            print(
+                "Error: --serve takes its arguments from each job, "
+                "pass only the socket path"
+            )
+            sys.exit(1)
+        serve(args.serve)
+        return
+
+    if not args.json_config:
+        print("Error: --json-config is required")
+        sys.exit(1)
+
+    if not (has_sources or args.worker or args.follow):
+        print("Error: Provide URLs with --files, --access-log, --sitemap or --robots")
+        sys.exit(1)
+
+    modes = (args.shard, args.coordinator, args.worker, args.follow)
+    if sum(1 for option in modes if option) > 1:
+        print("Error: --shard, --coordinator, --worker and --follow cannot be combined")
+        sys.exit(1)
+
+    if args.follow and args.skip_recent:
+        print(
+            "Error: --follow warms changed pages however recently they were "
+            "warmed, drop --skip-recent"
+        )
+        sys.exit(1)
+
+    if args.follow and not args.state_db:
+        # Without the tag index every tag event would warm nothing
+        print(
+            "Error: --follow requires --state-db to find the pages of changed "
+            "cache tags"
+        )
+        sys.exit(1)
+
+    if args.follow_quiet <= 0 or args.follow_max_wait < args.follow_quiet:
+        print(
+            "Error: Follow quiet must be positive and follow max wait not lower than it"
+        )
+        sys.exit(1)
+
+    if bool(args.coordinator) != (args.workers is not None):
+        print("Error: --coordinator and --workers must be given together")
+        sys.exit(1)
+
+    if args.workers is not None and args.workers <= 0:
+        print("Error: Workers must be a positive integer")
+        sys.exit(1)
+
+    if args.workers_timeout < 0:
+        print("Error: Workers timeout must not be negative")
+        sys.exit(1)
 
-    args = parser.parse_args()
+    try:
+        shard = parse_shard(args.shard) if args.shard else None
+        worker_address = parse_address(args.worker) if args.worker else None
+        coordinator_address = (
+            parse_address(args.coordinator, "0.0.0.0") if args.coordinator else None
+        )
+        feed_address = None
+        if args.follow and args.follow.startswith("unix:"):
+            feed_address = args.follow[len("unix:") :]
+        elif args.follow and args.follow.startswith("tcp:"):
+            feed_address = parse_address(args.follow[len("tcp:") :], "127.0.0.1")
+    except ValueError as e:
+        print(f"Error: Invalid --shard, --coordinator, --worker or --follow value: {e}")
+        sys.exit(1)
 
     # Validate threads parameter
     if args.threads <= 0:
         print("Error: Threads must be a positive integer")
         sys.exit(1)
 
-    all_urls = []
-    for csv_file in args.files:
-        print(f"Reading URLs from {csv_file}.")
-        urls = read_urls_from_csv(csv_file)
-        if not urls:
-            print(f"No URLs found in {csv_file}.")
-            continue
-        print(f"Found {len(urls)} URLs in {csv_file}.")
-        all_urls.extend(urls)
+    if args.adaptive_concurrency and args.engine != "threads":
+        print("Error: --adaptive-concurrency requires --engine threads")
+        sys.exit(1)
 
-    if not all_urls:
-        print("No URLs found in any of the provided files.")
-        return
+    if args.adaptive_concurrency and args.max_threads < args.threads:
+        print("Error: Max threads must not be lower than threads")
+        sys.exit(1)
 
-    print(f"Total URLs to warm up: {len(all_urls)}")
+    if args.concurrency <= 0:
+        print("Error: Concurrency must be a positive integer")
+        sys.exit(1)
 
-    # Load configurations from JSON or use default hardcoded ones
-    if args.json_config:
-        configurations = load_config_from_json(args.json_config)
-        print(f"Loaded {len(configurations)} configurations from JSON file")
-    else:
-        print("Error: no configurations provided")
+    if args.access_log_top <= 0:
+        print("Error: Access log top must be a positive integer")
+        sys.exit(1)
+
+    if args.parallel_stages <= 0:
+        print("Error: Parallel stages must be a positive integer")
+        sys.exit(1)
+
+    if args.weight_column is not None and args.weight_column <= 0:
+        print(
+            "Error: Weight column must be a positive integer (column 0 holds the URL)"
+        )
+        sys.exit(1)
+
+    if args.rate_limit_burst <= 0:
+        print("Error: Rate limit burst must be a positive integer")
+        sys.exit(1)
+
+    if args.metrics_port is not None and not 0 <= args.metrics_port <= 65535:
+        print("Error: Metrics port must be between 0 and 65535")
+        sys.exit(1)
+
+    if args.report_file and args.report != "json":
+        print("Error: --report-file requires --report json")
+        sys.exit(1)
+
+    if args.retries < 0 or args.circuit_breaker_failures < 0:
+        print("Error: Retries and circuit breaker failures must not be negative")
+        sys.exit(1)
+
+    if (args.skip_recent or args.conditional) and not args.state_db:
+        print("Error: --skip-recent and --conditional require --state-db")
+        sys.exit(1)
+
+    if args.skip_recent is not None and args.skip_recent <= 0:
+        print("Error: Skip recent must be a positive number of hours")
+        sys.exit(1)
+
+    if args.health_interval <= 0 or not 0 < args.health_resume <= 1:
+        print(
+            "Error: Health interval must be positive and health resume between 0 and 1"
+        )
+        sys.exit(1)
+
+    for spec in args.health_check:
+        try:
+            parse_health_check(spec, session=None)
+        except ValueError as e:
+            print(f"Error: Invalid --health-check: {e}")
+            sys.exit(1)
+
+    # A JSON report without a file gets stdout to itself, so it can be piped
+    # into a parser, and everything else goes to stderr
+    report_stream = sys.stdout
+    output = contextlib.nullcontext()
+    if args.report == "json" and not args.report_file:
+        output = contextlib.redirect_stdout(sys.stderr)
+    with output:
+        _run(
+            args,
+            shard,
+            worker_address,
+            coordinator_address,
+            feed_address,
+            report_stream,
+        )
+
+
+def _run(args, shard, worker_address, coordinator_address, feed_address, report_stream):
+    """Warm the URLs of the validated command line arguments of main()"""
+    # The configuration is read first, its normalization rules apply to the URLs
+    settings = load_settings(args.json_config)
+
+    if args.follow:
+        follow(args, settings, feed_address)
         return
 
-    # Run warmup for each configuration with matching URLs only
-    total_hit_count = 0
-    total_miss_count = 0
+    coordinator = None
+    if worker_address is not None:
+        # A worker warms the shard of URLs its coordinator hands it
+        try:
+            coordinator = CoordinatorClient(worker_address, timeout=args.timeout)
+        except OSError as e:
+            print(f"Error: Cannot connect to the coordinator at {args.worker}: {e}")
+            sys.exit(1)
+        lastmods = {} if args.state_db else None
+        try:
+            index, count, all_urls, weights = coordinator.receive_shard(lastmods)
+        except (OSError, ValueError) as e:
+            print(f"Error: Cannot read the shard from the coordinator: {e}")
+            sys.exit(1)
+        print(
+            f"Received shard {index}/{count} with {len(all_urls)} URLs "
+            "from the coordinator."
+        )
+    else:
+        all_urls, weights, lastmods = collect_urls(args, settings)
+
+    if shard is not None:
+        index, count = shard
+        total = len(all_urls)
+        all_urls = [url for url in all_urls if shard_of(url, count) == index - 1]
+        print(f"Shard {index}/{count}: warming {len(all_urls)} of {total} URLs.")
 
-    for i, config in enumerate(configurations):
-        print(f"\n{'=' * 50}")
-        print(f"STAGE {i + 1}: {config['name']} Configuration")
-        print(f"{'=' * 50}")
+    if not all_urls:
+        print("No URLs found in any of the provided files.")
+        if coordinator is not None:
+            coordinator.finish([], [])
+            coordinator.close()
+        return
 
-        # Filter URLs that match the current configuration's website_base_url
-        urls_to_warm = match_urls_by_base_url(all_urls, config)
+    print(f"Total URLs to warm up: {len(all_urls)}")
 
-        if not urls_to_warm:
-            print("No matching URLs found for this configuration.")
-            continue
+    configurations = settings["configurations"]
+    print(f"Loaded {len(configurations)} configurations from JSON file")
 
-        print(f"Configuration '{config['name']}' will warm up {len(urls_to_warm)} URLs")
+    if coordinator_address is not None:
+        # Workers match the URLs of their shard to the configurations
+        stages = [(i + 1, config, None) for i, config in enumerate(configurations)]
+    else:
+        # Parse every URL once, each configuration then just looks up its host
+        buckets = bucket_urls_by_host(all_urls)
 
-        print("Starting to warm up URLs...")
+        # Run warmup for each configuration with matching URLs only
+        stages = [
+            (i + 1, config, urls_for_config(buckets, config, all_urls))
+            for i, config in enumerate(configurations)
+        ]
 
-        # Warm up URLs in parallel
-        start_time = time.time()
+    metrics, metrics_server = start_metrics(args)
+    run_start = time.time()
+    success = False
+    unfinished = []
+    try:
+        if coordinator_address is not None:
+            all_stats, unfinished = coordinate(
+                coordinator_address,
+                args.workers,
+                stages,
+                all_urls,
+                weights,
+                lastmods,
+                metrics,
+                args.workers_timeout,
+            )
+        else:
+            all_stats = warm_stages(
+                args,
+                stages,
+                weights,
+                lastmods,
+                metrics,
+                coordinator.send_result if coordinator is not None else None,
+            )
+            if coordinator is not None:
+                coordinator.finish(stages, all_stats)
+        success = not unfinished
+    finally:
+        if coordinator is not None:
+            coordinator.close()
+        stop_metrics(args, metrics, metrics_server, success)
 
-        # Process URLs in parallel
-        results = process_urls_threaded(
-            urls_to_warm,
-            max_workers=args.threads,
-            timeout=args.timeout,
-            custom_headers=config["headers"],
-            custom_cookies=config.get("cookies", {}),
-            use_threads=(args.without_async == 0),
-            rate_limit=args.rate_limit,
-        )
-
-        # Count hits and misses
-        hit_count = 0
-        miss_count = 0
-        for result in results:
-            if result["success"] and result["x_cache"]:
-                x_cache = result["x_cache"]
-                if "HIT" in x_cache.upper():
-                    hit_count += 1
-                elif "MISS" in x_cache.upper():
-                    miss_count += 1
-
-        # Print summary with colored output
-        end_time = time.time()
-
-        print("-" * 50)
-        print("FINAL SUMMARY:")
-        print(f"Total URLs processed: {len(urls_to_warm)}")
-        print(f"Cache HIT: {hit_count}")
-        print(f"Cache MISS: {miss_count}")
-        print(f"Total time: {end_time - start_time:.2f} seconds")
-
-        total_hit_count += hit_count
-        total_miss_count += miss_count
+    total_hit_count = sum(stats.hit_count for stats in all_stats if stats)
+    total_miss_count = sum(stats.miss_count for stats in all_stats if stats)
+    total_skipped = sum(stats.skipped for stats in all_stats if stats)
 
     # Print final summary
     print(f"\n{'=' * 50}")
@@ -325,6 +4673,27 @@ def main():
     print(f"Total URLs processed: {len(all_urls)} (across all configurations)")
     print(f"Total Cache HIT: {total_hit_count}")
     print(f"Total Cache MISS: {total_miss_count}")
+    if args.state_db or total_skipped:
+        print(f"Total skipped as unchanged: {total_skipped}")
+
+    if args.report == "json":
+        report = build_report(
+            [
+                (number, config["name"], stats)
+                for (number, config, _), stats in zip(stages, all_stats)
+            ],
+            time.time() - run_start,
+        )
+        write_report(report, args.report_file, report_stream)
+        if args.report_file:
+            print(f"Report written to {args.report_file}")
+
+    if unfinished:
+        print(
+            f"Error: Shards {', '.join(map(str, unfinished))} of {args.workers} "
+            "were not finished, their workers disconnected or never connected"
+        )
+        sys.exit(1)
 
 
 if __name__ == "__main__":